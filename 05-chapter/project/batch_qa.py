@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from langchain.schema import Document
+
+from conversation import ConversationRetrievalChain
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path: str) -> List[Dict[str, Any]]:
+    """
+    读取待回答的问题。
+
+    每行一个 JSON 对象：question 为问题，chat_history 为可选的 [[人类, AI], ...] 历史对话，
+    id 为可选的问题编号，缺省时使用行号。
+
+    参数:
+        path (str): 输入的 JSONL 文件路径。
+
+    返回:
+        List[Dict[str, Any]]: 问题记录，id 统一为字符串。
+    """
+    records = []
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            record["id"] = str(record.get("id", line_number))
+            record["chat_history"] = [tuple(turn) for turn in record.get("chat_history") or []]
+            records.append(record)
+    return records
+
+
+def read_finished_ids(path: str) -> Set[str]:
+    """
+    读取输出文件中已经完成的问题编号，用于中断后续跑。
+
+    最后一行可能在写入时被中断而不完整，无法解析的行直接忽略，对应的问题会重新回答。
+
+    参数:
+        path (str): 输出的 JSONL 文件路径。
+
+    返回:
+        Set[str]: 已完成的问题编号。
+    """
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                finished.add(str(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                continue
+    return finished
+
+
+def serialize_source_documents(docs_dict: Dict[str, List[Document]]) -> Dict[str, List[Dict]]:
+    """把 文件名 -> 文档列表 转换为可写入 JSON 的结构，原始文本只保留在 page_content 中。"""
+    return {
+        file_name: [
+            {
+                "page_content": doc.metadata.get("page_content", doc.page_content),
+                "metadata": {k: v for k, v in doc.metadata.items() if k != "page_content"},
+            }
+            for doc in docs
+        ]
+        for file_name, docs in (docs_dict or {}).items()
+    }
+
+
+class CheckpointWriter:
+    """
+    逐条追加写入回答，每条写完即落盘，输出文件本身就是进度检查点。
+
+    属性:
+        path (str): 输出的 JSONL 文件路径。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        # 上次中断时最后一行可能没有写完，先补上换行，避免与新记录粘在同一行
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as file:
+                file.seek(-1, os.SEEK_END)
+                needs_newline = file.read(1) != b"\n"
+            if needs_newline:
+                with open(path, "a", encoding="utf-8") as file:
+                    file.write("\n")
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, record: Dict[str, Any]):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+@contextmanager
+def open_retriever(corpus_id: Optional[str] = None) -> Iterator[Tuple[Any, Any, List[str]]]:
+    """
+    打开问答使用的语言模型、检索器和入库的文件名。
+
+    corpus_id 为 None 时使用 DB_DIR 中的数据库（在导入 main 时加载）；否则通过 CorpusRegistry
+    加载 CORPORA_DIR 下的该语料，用完后释放它的文档块存储、向量和检索结果缓存。
+
+    参数:
+        corpus_id (Optional[str]): 语料编号，即 CORPORA_DIR 下的子目录名。
+
+    返回:
+        Iterator[Tuple[Any, Any, List[str]]]: (语言模型, 检索器, 文件名)。
+    """
+    if corpus_id is None:
+        from main import llm, my_retriever, file_names
+
+        yield llm, my_retriever, file_names
+        return
+
+    from langchain.chat_models import ChatOpenAI
+    from corpus_registry import CorpusRegistry
+
+    llm = ChatOpenAI(model=MODEL_NAME, temperature=0, max_tokens=1200)
+    registry = CorpusRegistry(llm)
+    try:
+        with registry.use(corpus_id) as corpus:
+            yield llm, corpus.retriever, corpus.file_names
+    finally:
+        registry.close()
+
+
+async def answer_questions(
+    chain: ConversationRetrievalChain,
+    records: List[Dict[str, Any]],
+    writer: CheckpointWriter,
+    concurrency: int = BATCH_MAX_CONCURRENCY,
+) -> Dict[str, Any]:
+    """
+    以有界并发通过问答链的异步路径回答一批问题，每完成一个就写入检查点。
+
+    参数:
+        chain (ConversationRetrievalChain): 不带记忆的问答链，历史对话随每个问题传入。
+        records (List[Dict[str, Any]]): 待回答的问题记录。
+        writer (CheckpointWriter): 回答写入器。
+        concurrency (int): 同时回答的问题数量上限。
+
+    返回:
+        Dict[str, Any]: 完成数、失败数、实际检索的子问题数和耗时。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    stats = {"answered": 0, "failed": 0}
+    start_time = time.time()
+
+    async def answer(record: Dict[str, Any]):
+        async with semaphore:
+            try:
+                resp = await chain.acall(
+                    {"question": record["question"], "chat_history": record["chat_history"]}
+                )
+            except Exception as e:
+                # 失败的问题不写入输出，下次运行时会重新回答
+                logger.error("问题 %s 回答失败: %s", record["id"], e)
+                stats["failed"] += 1
+                return
+        result = {"id": record["id"], "question": record["question"], "answer": resp["answer"]}
+        if "generated_question" in resp:
+            result["generated_question"] = resp["generated_question"]
+        if "context_usage" in resp:
+            result["context_usage"] = resp["context_usage"]
+        if "source_documents" in resp:
+            result["source_documents"] = serialize_source_documents(resp["source_documents"])
+        writer.write(result)
+        stats["answered"] += 1
+        logger.info("已完成 %d/%d", stats["answered"], len(records))
+
+    await asyncio.gather(*(answer(record) for record in records))
+    stats["retrievals"] = len(chain.docs_memo) if chain.docs_memo is not None else None
+    stats["seconds"] = time.time() - start_time
+    return stats
+
+
+def run_batch(
+    input_path: str,
+    output_path: str,
+    concurrency: int = BATCH_MAX_CONCURRENCY,
+    corpus_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    批量回答输入文件中的问题，把回答和来源文档写入输出文件。
+
+    输出文件中已有的问题会被跳过，中断后用相同参数重新运行即可从中断处继续。
+    所有问题共享一份子问题检索结果，不同问题拆出的相同子问题只检索一次。
+
+    参数:
+        input_path (str): 输入的 JSONL 文件路径。
+        output_path (str): 输出的 JSONL 文件路径。
+        concurrency (int): 同时回答的问题数量上限。
+        corpus_id (Optional[str]): 在 CORPORA_DIR 下的该语料中检索，为 None 时使用 DB_DIR。
+
+    返回:
+        Dict[str, Any]: 运行统计。
+    """
+    records = read_questions(input_path)
+    finished = read_finished_ids(output_path)
+    pending = [record for record in records if record["id"] not in finished]
+    logger.info("共 %d 个问题，已完成 %d 个", len(records), len(records) - len(pending))
+
+    with open_retriever(corpus_id) as (llm, retriever, file_names):
+        chain = ConversationRetrievalChain.from_llm(
+            llm,
+            retriever,
+            file_names=file_names,
+            max_concurrency=MAX_RETRIEVAL_CONCURRENCY,
+            docs_memo={},
+            return_source_documents=True,
+            return_generated_question=True,
+            return_context_usage=True,
+        )
+        writer = CheckpointWriter(output_path)
+        try:
+            stats = asyncio.run(answer_questions(chain, pending, writer, concurrency))
+        finally:
+            writer.close()
+    stats["skipped"] = len(records) - len(pending)
+    return stats
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="批量问答")
+    parser.add_argument("input", help="问题 JSONL 文件，每行包含 question 和可选的 id、chat_history")
+    parser.add_argument("output", help="回答 JSONL 文件，已存在时从中断处继续")
+    parser.add_argument("--concurrency", type=int, default=BATCH_MAX_CONCURRENCY)
+    parser.add_argument("--corpus", help="语料编号（CORPORA_DIR 下的子目录），缺省时使用 DB_DIR")
+    args = parser.parse_args()
+    print(run_batch(args.input, args.output, args.concurrency, args.corpus))
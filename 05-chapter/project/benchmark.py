@@ -0,0 +1,458 @@
+"""
+检索项目的微基准测试，不依赖向量数据库和 API Key，使用合成数据运行：
+
+    python benchmark.py splitting --size-mb 4
+    python benchmark.py clean_text --size-mb 1
+    python benchmark.py overlaps --cases 2000
+    python benchmark.py chunk_store --size-mb 20
+    python benchmark.py hierarchy --size-mb 2
+    python benchmark.py context --cases 200
+"""
+
+import os
+import re
+import math
+import time
+import pickle
+import tempfile
+import tracemalloc
+from collections import deque
+import string
+import random
+import argparse
+
+import tiktoken
+from langchain.schema import Document
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+
+from config import (
+    BASE_CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    CHUNK_SCALE,
+    MAX_LLM_CONTEXT,
+    MODEL_NAME,
+    WINDOW_SCALE,
+    WINDOW_STEPS,
+)
+from doc2db import iter_chunk_hierarchy, iter_window_document, merge_metadata_dicts, string_to_md5
+from chunk_store import ChunkStore
+from context_packer import ContextPacker
+from interval_groups import window_centroids
+from token_counter import CachedTokenTextSplitter, TokenCounter, get_token_counter
+from utils import TextNormalizer
+
+
+def synthetic_corpus(size_mb: float, seed: int = 0):
+    """生成由段落、句子和单词组成的合成语料，大小约为 size_mb MB。"""
+    rng = random.Random(seed)
+    vocab = [
+        "".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(2, 10)))
+        for _ in range(5000)
+    ]
+    vocab += ["The", "and", "of", "it's", "GPT-3.5", "2023", "v2", "e.g.", "[SEP]", "(see", "below)", "U.S.A."]
+    pages = []
+    size = 0
+    while size < size_mb * 1024 * 1024:
+        paragraphs = []
+        for _ in range(rng.randint(3, 8)):
+            sentences = [
+                " ".join(rng.choices(vocab, k=rng.randint(5, 25))).capitalize() + "."
+                for _ in range(rng.randint(2, 6))
+            ]
+            paragraphs.append(" ".join(sentences))
+        page = "\n\n".join(paragraphs)
+        pages.append(Document(page_content=page, metadata={"source": "synthetic.txt"}))
+        size += len(page.encode("utf-8"))
+    return pages, size
+
+
+def uncached_token_length(text: str):
+    # 优化前 doc2db.calculate_token_length 的实现：每次调用都重新获取编码器
+    tokenizer_name = tiktoken.encoding_for_model(MODEL_NAME)
+    tokenizer = tiktoken.get_encoding(tokenizer_name.name)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def bench_splitting(size_mb: float):
+    """对比优化前后 split_document 使用的切分器吞吐量（MB/s）。"""
+    pages, size = synthetic_corpus(size_mb)
+    splitters = {
+        "before": RecursiveCharacterTextSplitter(
+            chunk_size=BASE_CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            length_function=uncached_token_length,
+        ),
+        "after": CachedTokenTextSplitter(
+            token_counter=TokenCounter(),
+            chunk_size=BASE_CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+        ),
+    }
+    results = {}
+    for name, splitter in splitters.items():
+        start = time.perf_counter()
+        chunks = splitter.split_documents(pages)
+        elapsed = time.perf_counter() - start
+        results[name] = [chunk.page_content for chunk in chunks]
+        print(
+            f"{name:>6}: {len(chunks)} 个块, {elapsed:.2f}s, "
+            f"{size / 1024 / 1024 / elapsed:.2f} MB/s"
+        )
+    print("切分结果一致:", results["before"] == results["after"])
+
+
+def legacy_clean_text(text):
+    # 优化前 utils.clean_text 的实现：每次调用都重新加载停用词、标点表和词形还原器
+    text = text.replace("[SEP]", "")
+    tokens = word_tokenize(text)
+    tokens = [w.lower() for w in tokens]
+    table = str.maketrans("", "", string.punctuation)
+    stripped = [w.translate(table) for w in tokens]
+    words = [
+        word
+        for word in stripped
+        if word.isalpha()
+        or word.isdigit()
+        or (re.search(r"\d", word) and re.search("[a-zA-Z]", word))
+    ]
+    stop_words = set(stopwords.words("english"))
+    words = [w for w in words if w not in stop_words]
+    lemmatizer = WordNetLemmatizer()
+    lemmatized = [lemmatizer.lemmatize(w) for w in words]
+    return " ".join(lemmatized)
+
+
+def bench_clean_text(size_mb: float, workers: int):
+    """对比优化前后文本清洗的吞吐量，并检查两者输出完全一致。"""
+    pages, size = synthetic_corpus(size_mb)
+    texts = [page.page_content for page in pages]
+
+    start = time.perf_counter()
+    before = [legacy_clean_text(text) for text in texts]
+    elapsed = time.perf_counter() - start
+    print(f"before: {elapsed:.2f}s, {size / 1024 / 1024 / elapsed:.2f} MB/s")
+
+    normalizer = TextNormalizer()
+    start = time.perf_counter()
+    after = normalizer.clean_many(texts, max_workers=workers)
+    elapsed = time.perf_counter() - start
+    print(f" after: {elapsed:.2f}s, {size / 1024 / 1024 / elapsed:.2f} MB/s ({workers} 个进程)")
+    print("清洗结果一致:", before == after)
+
+
+def legacy_find_overlaps(intervals):
+    # 优化前 MyRetriever.find_overlaps 的实现：逐对比较区间展开后的集合
+    remaining_intervals, centroids = list(intervals), []
+
+    while remaining_intervals:
+        curr_interval = remaining_intervals.pop(0)
+        curr_group = [curr_interval]
+        subset_interval = None
+
+        for start, end in remaining_intervals.copy():
+            for s, e in curr_group:
+                overlap = set(range(s, e + 1)) & set(range(start, end + 1))
+                if overlap:
+                    curr_group.append((start, end))
+                    remaining_intervals.remove((start, end))
+                    if set(range(start, end + 1)).issubset(set(range(s, e + 1))):
+                        subset_interval = (start, end)
+                    break
+
+        if subset_interval:
+            centroid = [math.ceil((subset_interval[0] + subset_interval[1]) / 2)]
+        elif len(curr_group) > 2:
+            first_overlap = max(
+                set(range(curr_group[0][0], curr_group[0][1] + 1))
+                & set(range(curr_group[1][0], curr_group[1][1] + 1))
+            )
+            last_overlap_set = set(
+                range(curr_group[-1][0], curr_group[-1][1] + 1)
+            ) & set(range(curr_group[-2][0], curr_group[-2][1] + 1))
+            last_overlap = min(last_overlap_set) if last_overlap_set else first_overlap
+            step = 1 if first_overlap <= last_overlap else -1
+            centroid = list(range(first_overlap, last_overlap + step, step))
+        else:
+            centroid = [
+                round(sum([math.ceil((s + e) / 2) for s, e in curr_group]) / len(curr_group))
+            ]
+        centroids.extend(centroid)
+    return centroids
+
+
+def random_intervals(rng: random.Random, n: int, span: int, max_width: int):
+    """随机生成 n 个闭区间，包含重复、嵌套以及下界大于上界的空区间。"""
+    intervals = []
+    while len(intervals) < n:
+        if intervals and rng.random() < 0.1:
+            intervals.append(rng.choice(intervals))
+            continue
+        start = rng.randint(0, span)
+        intervals.append((start, start + rng.randint(-1, max_width)))
+    return intervals
+
+
+def bench_overlaps(cases: int, seed: int = 0):
+    """随机区间上对比新旧 find_overlaps 的结果，并在 10/100/1000 个区间上计时。"""
+    rng = random.Random(seed)
+    mismatches = 0
+    for _ in range(cases):
+        intervals = random_intervals(
+            rng, rng.randint(0, 12), span=rng.randint(1, 40), max_width=rng.randint(0, 8)
+        )
+        if legacy_find_overlaps(intervals) != window_centroids(intervals):
+            mismatches += 1
+            if mismatches <= 5:
+                print("结果不一致:", intervals)
+    print(f"随机用例: {cases}, 不一致: {mismatches}")
+
+    for n in (10, 100, 1000):
+        # 区间宽度与入库时的窗口相当（WINDOW_SCALE 个大块），顺序随机，模拟检索排名
+        intervals = random_intervals(rng, n, span=n * 4, max_width=WINDOW_SCALE)
+        repeat = max(1, 1000 // n)
+        timings, results = {}, {}
+        for name, func in (("before", legacy_find_overlaps), ("after", window_centroids)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                results[name] = func(intervals)
+            timings[name] = (time.perf_counter() - start) / repeat * 1000
+        print(
+            f"{n:>5} 个区间: before {timings['before']:.3f} ms, after {timings['after']:.3f} ms, "
+            f"结果一致: {results['before'] == results['after']}"
+        )
+
+
+def bench_chunk_store(size_mb: float):
+    """对比 docs_pickle 与 ChunkStore 的冷启动耗时、文件大小，并检查读出的文档一致。"""
+    pages, _ = synthetic_corpus(size_mb)
+    splitter = RecursiveCharacterTextSplitter(chunk_size=600, chunk_overlap=0)
+    documents = []
+    for index, doc in enumerate(splitter.split_documents(pages)):
+        doc.metadata.update(
+            page_content=doc.page_content,
+            page_content_md5=f"{index:032x}",
+            source_md5="0" * 32,
+            medium_chunk_index=index,
+            large_chunks_index_lower_bound=index // 6,
+            large_chunks_index_upper_bound=index // 6 + 3,
+        )
+        doc.page_content = doc.page_content.lower()
+        documents.append(doc)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pickle_path = os.path.join(tmp_dir, "docs_pickle.pkl")
+        store_path = os.path.join(tmp_dir, "docs_store")
+        with open(pickle_path, "wb") as file:
+            pickle.dump(documents, file)
+        ChunkStore.write(store_path, documents)
+        store_size = sum(
+            os.path.getsize(os.path.join(store_path, name)) for name in os.listdir(store_path)
+        )
+
+        start = time.perf_counter()
+        with open(pickle_path, "rb") as file:
+            loaded = pickle.load(file)
+        pickle_time = time.perf_counter() - start
+        start = time.perf_counter()
+        store = ChunkStore.open(store_path)
+        store_time = time.perf_counter() - start
+
+        print(f"{len(documents)} 个块")
+        print(f"pickle: 加载 {pickle_time * 1000:.1f} ms, 文件 {os.path.getsize(pickle_path) / 1024 / 1024:.1f} MB")
+        print(f" store: 打开 {store_time * 1000:.1f} ms, 文件 {store_size / 1024 / 1024:.1f} MB")
+        print("读出的文档一致:", all(a == b for a, b in zip(loaded, store)) and len(loaded) == len(store))
+
+
+def legacy_add_window_to_document(document, window_steps, window_size, window_index_name):
+    # 优化前 doc2db.add_window_to_document 的实现：需要预先知道文档块总数
+    window_id = 0
+    window_queue = deque()
+    for index, doc in enumerate(document):
+        if index % window_steps == 0 and index != 0 and index < len(document) - window_size:
+            window_id += 1
+        window_queue.append(window_id)
+        if len(window_queue) > window_size:
+            for _ in range(window_steps):
+                window_queue.popleft()
+        window = set(window_queue)
+        doc.metadata[f"{window_index_name}_lower_bound"] = min(window)
+        doc.metadata[f"{window_index_name}_upper_bound"] = max(window)
+
+
+def legacy_merge_document_chunks(document, scale_factor, chunk_index_name):
+    # 优化前 doc2db.merge_document_chunks 的实现
+    merged_documents, content_aggregate, metadata_aggregate, chunk_index = [], "", [], 0
+    for index, item in enumerate(document):
+        content_aggregate += item.page_content
+        metadata_aggregate.append(item.metadata)
+        if (index + 1) % scale_factor == 0 or index == len(document) - 1:
+            metadata = merge_metadata_dicts(metadata_aggregate)
+            metadata[chunk_index_name] = chunk_index
+            merged_documents.append(Document(page_content=content_aggregate, metadata=metadata))
+            chunk_index += 1
+            content_aggregate, metadata_aggregate = "", []
+    return merged_documents
+
+
+def legacy_update_document_metadata(documents):
+    # 优化前 doc2db.update_document_metadata 的实现
+    file_name, _ = os.path.splitext(os.path.basename(documents[0].metadata["source"]))
+    for doc in documents:
+        for key, value in doc.metadata.items():
+            if isinstance(value, list):
+                doc.metadata[key] = str(value)
+        doc.metadata["page_content"] = doc.page_content
+        doc.metadata["page_content_md5"] = string_to_md5(doc.page_content)
+        doc.metadata["source_md5"] = string_to_md5(doc.metadata["source"])
+        doc.page_content = f"{file_name}\n{doc.page_content}"
+
+
+def legacy_chunk_hierarchy(pages):
+    # 优化前 doc2db.process_file 的处理流程：每一步都遍历整个文件的块列表
+    splitter = CachedTokenTextSplitter(chunk_size=BASE_CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    small = splitter.split_documents(pages)
+    for index, doc in enumerate(small):
+        doc.metadata["small_chunk_index"] = index
+    legacy_add_window_to_document(small, WINDOW_STEPS, WINDOW_SCALE, "large_chunks_index")
+    medium = legacy_merge_document_chunks(small, CHUNK_SCALE, "medium_chunk_index")
+    legacy_update_document_metadata(small)
+    legacy_update_document_metadata(medium)
+    return small, medium
+
+
+def bench_hierarchy(size_mb: float):
+    """对比单次遍历的块层级构建与原流程的耗时、内存峰值，并检查块和元数据完全一致。"""
+    rng = random.Random(0)
+    mismatches = 0
+    for _ in range(2000):
+        # 窗口化的边界情况：不同的块数、步长和窗口大小
+        num_chunks, steps = rng.randint(0, 60), rng.randint(1, 4)
+        size = rng.randint(steps, 20)
+        expected = [Document(page_content="", metadata={}) for _ in range(num_chunks)]
+        actual = [Document(page_content="", metadata={}) for _ in range(num_chunks)]
+        legacy_add_window_to_document(expected, steps, size, "w")
+        list(iter_window_document(iter(actual), steps, size, "w"))
+        mismatches += expected != actual
+    print("窗口化随机用例不一致:", mismatches)
+
+    pages, size = synthetic_corpus(size_mb)
+    results, timings = {}, {}
+    for name in ("before", "after"):
+        copies = [Document(page_content=p.page_content, metadata=dict(p.metadata)) for p in pages]
+        tracemalloc.start()
+        start = time.perf_counter()
+        if name == "before":
+            results[name] = legacy_chunk_hierarchy(copies)
+        else:
+            small, medium = [], []
+            for chunk_type, chunk in iter_chunk_hierarchy(iter(copies)):
+                (small if chunk_type == "small" else medium).append(chunk)
+            results[name] = small, medium
+        timings[name] = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{name:>6}: {len(results[name][0])} 个小块, {len(results[name][1])} 个中块, "
+            f"{timings[name]:.2f}s, 内存峰值 {peak / 1024 / 1024:.1f} MB"
+        )
+    print("块和元数据一致:", results["before"] == results["after"])
+
+
+def legacy_build_snippets(total_results):
+    """原实现：每个文件内按 medium_chunk_index 排序，按 page_content_md5 去重后全部拼接，不计令牌数。"""
+    snippets = ""
+    redundancy = set()
+    for file_name, docs in total_results.items():
+        sorted_docs = sorted(docs, key=lambda x: x.metadata["medium_chunk_index"])
+        temp = "\n".join(doc.page_content for doc in sorted_docs if doc.metadata["page_content_md5"] not in redundancy)
+        redundancy.update(doc.metadata["page_content_md5"] for doc in sorted_docs)
+        snippets += f"\nContext about {file_name}:\n{{{temp}}}\n"
+    return snippets
+
+
+def random_retrieval_results(rng: random.Random, medium_chunks):
+    """从中块中随机抽取若干文件的检索结果，模拟多个子问题的第三阶段输出（含重复块）。"""
+    total_results = {}
+    for file_number in range(rng.randint(1, 3)):
+        start = rng.randrange(0, max(1, len(medium_chunks) - 12))
+        docs = []
+        for _ in range(rng.randint(1, 3) * rng.randint(1, 4)):
+            index = start + rng.randint(0, 8)
+            chunk = medium_chunks[index]
+            metadata = {
+                **chunk.metadata,
+                "source": f"file_{file_number}.txt",
+                "source_md5": str(file_number),
+                "medium_chunk_index": index,
+                "page_content_md5": string_to_md5(f"{file_number}/{index}"),
+                "rrf_score": rng.random(),
+            }
+            docs.append(Document(page_content=chunk.page_content, metadata=metadata))
+        total_results[f"file_{file_number}.txt"] = docs
+    return total_results
+
+
+def bench_context(cases: int, seed: int = 0):
+    """对比原拼接方式与令牌预算装箱的上下文长度、超出预算的比例和耗时。"""
+    rng = random.Random(seed)
+    pages, _ = synthetic_corpus(0.2, seed)
+    medium_chunks = [chunk for kind, chunk in iter_chunk_hierarchy(iter(pages)) if kind == "medium"]
+    results = [random_retrieval_results(rng, medium_chunks) for _ in range(cases)]
+    counter = get_token_counter()
+    packer = ContextPacker(MAX_LLM_CONTEXT, counter)
+
+    start = time.perf_counter()
+    legacy_tokens = [counter.count(legacy_build_snippets(result)) for result in results]
+    legacy_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    packed = [packer.pack(result) for result in results]
+    packed_seconds = time.perf_counter() - start
+
+    packed_tokens = [counter.count(snippets) for snippets, _ in packed]
+    assert all(usage["total_tokens"] == tokens for (_, usage), tokens in zip(packed, packed_tokens))
+    for name, tokens, seconds in (
+        ("before", legacy_tokens, legacy_seconds),
+        ("after", packed_tokens, packed_seconds),
+    ):
+        over = sum(token > MAX_LLM_CONTEXT for token in tokens)
+        print(
+            f"{name:>6}: 平均 {sum(tokens) / len(tokens):.0f} 令牌, 最大 {max(tokens)}, "
+            f"超出预算 {over}/{len(tokens)}, {seconds * 1000 / len(tokens):.2f} ms/次"
+        )
+    dropped = sum(usage["dropped"] for _, usage in packed)
+    print(f"预算 {MAX_LLM_CONTEXT} 令牌，因预算放弃的块共 {dropped} 个")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检索项目的微基准测试")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+    splitting = subparsers.add_parser("splitting", help="文档切分吞吐量")
+    splitting.add_argument("--size-mb", type=float, default=2.0)
+    cleaning = subparsers.add_parser("clean_text", help="文本清洗吞吐量与一致性")
+    cleaning.add_argument("--size-mb", type=float, default=1.0)
+    cleaning.add_argument("--workers", type=int, default=1)
+    overlaps = subparsers.add_parser("overlaps", help="窗口区间分组的一致性与耗时")
+    overlaps.add_argument("--cases", type=int, default=2000)
+    store = subparsers.add_parser("chunk_store", help="文档块存储的冷启动耗时与一致性")
+    store.add_argument("--size-mb", type=float, default=20.0)
+    hierarchy = subparsers.add_parser("hierarchy", help="块层级构建的一致性、耗时与内存")
+    hierarchy.add_argument("--size-mb", type=float, default=2.0)
+    context = subparsers.add_parser("context", help="上下文令牌预算装箱的长度与耗时")
+    context.add_argument("--cases", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.name == "splitting":
+        bench_splitting(args.size_mb)
+    elif args.name == "clean_text":
+        bench_clean_text(args.size_mb, args.workers)
+    elif args.name == "overlaps":
+        bench_overlaps(args.cases)
+    elif args.name == "chunk_store":
+        bench_chunk_store(args.size_mb)
+    elif args.name == "hierarchy":
+        bench_hierarchy(args.size_mb)
+    elif args.name == "context":
+        bench_context(args.cases)
@@ -0,0 +1,214 @@
+from typing import Callable, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+
+def default_preprocessing_func(text: str) -> List[str]:
+    # 与 langchain BM25Retriever 默认的分词方式保持一致
+    return text.split()
+
+
+class BM25Index:
+    """
+    预构建的 BM25 倒排索引：在入库阶段对文档分词一次并持久化，检索时只做打分。
+
+    打分公式与 rank_bm25.BM25Okapi 保持一致。对过滤后的子集打分时，文档数、
+    平均文档长度、文档频率和负 IDF 的下限都只在子集上统计，与以往对子集
+    重建 BM25Retriever 的结果一致，但不需要重新分词。
+
+    属性:
+        vocab (Dict[str, int]): 词项到词项编号的映射。
+        postings (List[Tuple[np.ndarray, np.ndarray]]): 按词项编号排列的 (行号, 词频) 倒排表。
+        doc_len (np.ndarray): 每行文档的词数。
+        doc_term_offsets (np.ndarray): 正排表偏移，第 i 行的词项编号为 doc_term_ids[offsets[i]:offsets[i+1]]。
+        doc_term_ids (np.ndarray): 每行文档去重后的词项编号。
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        self.k1 = k1
+        self.b = b
+        self.epsilon = epsilon
+        self.vocab = {}
+        self.postings = []
+        self.doc_len = np.zeros(0, dtype=np.int32)
+        self.doc_term_offsets = np.zeros(1, dtype=np.int64)
+        self.doc_term_ids = np.zeros(0, dtype=np.int32)
+        self.avgdl = 0.0
+        self.idf = np.zeros(0)
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: List[Document],
+        preprocess_func: Callable[[str], List[str]] = default_preprocessing_func,
+        **kwargs,
+    ):
+        """
+        对文档列表分词并构建索引，行号与文档在列表中的位置一一对应。
+
+        参数:
+            documents (List[Document]): 需要被索引的文档列表（page_content 应已清洗）。
+            preprocess_func (Callable): 分词函数。
+
+        返回:
+            BM25Index: 构建好的索引。
+        """
+        index = cls(**kwargs)
+        vocab = {}
+        postings = []
+        doc_len = []
+        doc_term_offsets = [0]
+        doc_term_ids = []
+        for row, doc in enumerate(documents):
+            tokens = preprocess_func(doc.page_content)
+            doc_len.append(len(tokens))
+            frequencies = {}
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+            for token, freq in frequencies.items():
+                if token not in vocab:
+                    vocab[token] = len(vocab)
+                    postings.append(([], []))
+                term_id = vocab[token]
+                postings[term_id][0].append(row)
+                postings[term_id][1].append(freq)
+                doc_term_ids.append(term_id)
+            doc_term_offsets.append(len(doc_term_ids))
+
+        index.vocab = vocab
+        index.postings = [
+            (np.asarray(rows, dtype=np.int32), np.asarray(freqs, dtype=np.float32))
+            for rows, freqs in postings
+        ]
+        index.doc_len = np.asarray(doc_len, dtype=np.int32)
+        index.doc_term_offsets = np.asarray(doc_term_offsets, dtype=np.int64)
+        index.doc_term_ids = np.asarray(doc_term_ids, dtype=np.int32)
+        index.avgdl = float(index.doc_len.mean()) if doc_len else 0.0
+        doc_freqs = np.asarray([len(rows) for rows, _ in postings], dtype=np.float64)
+        index.idf = index._calc_idf(doc_freqs, len(doc_len))
+        return index
+
+    def _calc_idf(self, doc_freqs: np.ndarray, corpus_size: int):
+        # 与 BM25Okapi._calc_idf 相同：只统计出现过的词项，负 IDF 替换为 epsilon * 平均 IDF
+        present = doc_freqs > 0
+        idf = np.zeros(len(doc_freqs))
+        idf[present] = np.log(corpus_size - doc_freqs[present] + 0.5) - np.log(
+            doc_freqs[present] + 0.5
+        )
+        if present.any():
+            average_idf = idf[present].mean()
+            idf[present & (idf < 0)] = self.epsilon * average_idf
+        return idf
+
+    def _row_entries(self, row_ids: np.ndarray):
+        # 把若干行在正排表中的区间展开成 doc_term_ids 的下标
+        starts = self.doc_term_offsets[row_ids]
+        lengths = self.doc_term_offsets[row_ids + 1] - starts
+        total = int(lengths.sum())
+        shifts = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return shifts + np.arange(total)
+
+    def get_scores(self, query_tokens: List[str], row_ids: Optional[np.ndarray] = None):
+        """
+        计算查询对全部文档或指定行子集的 BM25 得分。
+
+        参数:
+            query_tokens (List[str]): 已分词的查询。
+            row_ids (np.ndarray, 可选): 升序的行号子集（如 DocIndexer.retrieve_row_ids 的结果），为 None 时对全量文档打分。
+
+        返回:
+            np.ndarray: 与 row_ids（或全部行）一一对应的得分。
+        """
+        term_ids = [self.vocab[token] for token in query_tokens if token in self.vocab]
+        if row_ids is None:
+            scores = np.zeros(len(self.doc_len))
+            for term_id in term_ids:
+                rows, freqs = self.postings[term_id]
+                scores[rows] += self.idf[term_id] * self._term_weight(
+                    freqs, self.doc_len[rows], self.avgdl
+                )
+            return scores
+
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        scores = np.zeros(len(row_ids))
+        if len(row_ids) == 0 or not term_ids:
+            return scores
+        # 只在子集上统计文档频率，得到与对子集重建索引相同的 IDF
+        doc_freqs = np.bincount(
+            self.doc_term_ids[self._row_entries(row_ids)], minlength=len(self.vocab)
+        ).astype(np.float64)
+        idf = self._calc_idf(doc_freqs, len(row_ids))
+        avgdl = float(self.doc_len[row_ids].mean())
+        member = np.zeros(len(self.doc_len), dtype=bool)
+        member[row_ids] = True
+        for term_id in term_ids:
+            if doc_freqs[term_id] == 0:
+                continue
+            rows, freqs = self.postings[term_id]
+            selected = member[rows]
+            rows, freqs = rows[selected], freqs[selected]
+            positions = np.searchsorted(row_ids, rows)
+            scores[positions] += idf[term_id] * self._term_weight(
+                freqs, self.doc_len[rows], avgdl
+            )
+        return scores
+
+    def score_rows(self, query_tokens: List[str], row_ids) -> np.ndarray:
+        """
+        用全量文档的 IDF 和平均文档长度给指定的若干行打分，行号可以无序、可以重复。
+
+        与 get_scores(query_tokens, row_ids) 不同，这里不在子集上重新统计，
+        不同候选之间的得分可以直接比较；每个词项只在倒排表上做一次二分查找。
+
+        参数:
+            query_tokens (List[str]): 已分词的查询。
+            row_ids: 行号列表。
+
+        返回:
+            np.ndarray: 与 row_ids 一一对应的得分。
+        """
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        scores = np.zeros(len(row_ids))
+        if len(row_ids) == 0:
+            return scores
+        doc_len = self.doc_len[row_ids]
+        for token in query_tokens:
+            term_id = self.vocab.get(token)
+            if term_id is None:
+                continue
+            rows, freqs = self.postings[term_id]
+            positions = np.minimum(np.searchsorted(rows, row_ids), len(rows) - 1)
+            present = rows[positions] == row_ids
+            scores[present] += self.idf[term_id] * self._term_weight(
+                freqs[positions[present]], doc_len[present], self.avgdl
+            )
+        return scores
+
+    def _term_weight(self, freqs, doc_len, avgdl):
+        return (freqs * (self.k1 + 1)) / (
+            freqs + self.k1 * (1 - self.b + self.b * doc_len / avgdl)
+        )
+
+    def get_top_n(
+        self, query_tokens: List[str], n: int, row_ids: Optional[np.ndarray] = None
+    ) -> List[int]:
+        """
+        返回得分最高的 n 个行号，排序方式与 BM25Okapi.get_top_n 相同。
+
+        参数:
+            query_tokens (List[str]): 已分词的查询。
+            n (int): 返回的数量。
+            row_ids (np.ndarray, 可选): 升序的行号子集。
+
+        返回:
+            List[int]: 行号列表。
+        """
+        scores = self.get_scores(query_tokens, row_ids)
+        top_n = np.argsort(scores)[::-1][:n]
+        if row_ids is None:
+            return top_n.tolist()
+        return np.asarray(row_ids)[top_n].tolist()
@@ -0,0 +1,281 @@
+import os
+import json
+import mmap
+import shutil
+from typing import Any, Dict, Iterable, Iterator, List
+
+import numpy as np
+from langchain.schema import Document
+
+# 原始文本在 Document 中保存在元数据的这个键下
+ORIGINAL_TEXT_KEY = "page_content"
+
+
+def _column_kind(values: List[Any]) -> str:
+    # 只有类型完全一致的列才按数值或字典编码保存，其余按 JSON 原样保存，保证读出的值与写入一致
+    present = [value for value in values if value is not None]
+    if present and all(type(value) is int for value in present):
+        return "int"
+    if present and all(type(value) is float for value in present):
+        return "float"
+    if present and all(type(value) is str for value in present):
+        return "str"
+    return "json"
+
+
+class ChunkStore:
+    """
+    只读的文档块存储，替代保存整个 Document 列表的 docs_pickle 文件。
+
+    目录中的文件:
+        text.bin: 所有块的清洗后文本和原始文本依次拼接的 UTF-8 字节，每段文本只保存一次。
+        offsets.npy: 长度为 2n+1 的偏移表，第 i 块的清洗后文本为 [offsets[2i], offsets[2i+1])，
+            原始文本为 [offsets[2i+1], offsets[2i+2])。
+        columns.json: 元数据列的描述，字符串列的取值字典和无法按列保存的值。
+        column_<编号>.npy / mask_<编号>.npy: 数值列或字符串列编码，以及缺失值掩码。
+
+    打开时只对文件做内存映射并读取列描述，按下标访问时才构造 Document，
+    行号与写入时的文档顺序一致，可以直接作为 BM25Index 和 DocIndexer 的文档列表使用。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "columns.json"), encoding="utf-8") as file:
+            header = json.load(file)
+        self._num_rows = header["num_rows"]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self._text_file = open(os.path.join(path, "text.bin"), "rb")
+        size = os.fstat(self._text_file.fileno()).st_size
+        self._text = (
+            mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+        self._columns = {}
+        for number, (key, spec) in enumerate(header["columns"]):
+            kind = spec["kind"]
+            if kind == "json":
+                column = spec["values"]
+            else:
+                column = np.load(os.path.join(path, f"column_{number}.npy"), mmap_mode="r")
+            mask = None
+            if spec.get("has_mask"):
+                mask = np.load(os.path.join(path, f"mask_{number}.npy"), mmap_mode="r")
+            self._columns[key] = (kind, column, mask, spec.get("values"))
+
+    @classmethod
+    def open(cls, path: str) -> "ChunkStore":
+        """
+        打开已经写入的文档块存储。
+
+        参数:
+            path (str): 存储目录。
+
+        返回:
+            ChunkStore: 内存映射的文档块存储。
+        """
+        return cls(path)
+
+    @staticmethod
+    def write(path: str, documents: Iterable[Document]):
+        """
+        把文档逐个写入存储目录。先写到临时目录，全部完成后再替换旧目录，
+        替换前打开的旧存储仍可继续读取（例如增量入库时边读旧块边写新存储）。
+
+        参数:
+            path (str): 存储目录。
+            documents (Iterable[Document]): 文档，可以是生成器；page_content 为清洗后文本，
+                元数据的 page_content 为原始文本。
+        """
+        with ChunkStoreWriter(path) as writer:
+            for doc in documents:
+                writer.add(doc)
+
+    def close(self):
+        """关闭文本文件并释放内存映射，之后不能再读取。"""
+        if isinstance(self._text, mmap.mmap):
+            self._text.close()
+        self._text = b""
+        self._text_file.close()
+        self.offsets = None
+        self._columns = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._num_rows
+
+    def _text_at(self, index: int) -> str:
+        start, end = int(self.offsets[index]), int(self.offsets[index + 1])
+        return self._text[start:end].decode("utf-8")
+
+    def page_content(self, row: int) -> str:
+        """返回第 row 块清洗后的文本。"""
+        return self._text_at(2 * row)
+
+    def original_text(self, row: int) -> str:
+        """返回第 row 块的原始文本。"""
+        return self._text_at(2 * row + 1)
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        """
+        返回第 row 块除原始文本外的元数据，只读取列数据，不解码文本。
+
+        参数:
+            row (int): 行号。
+
+        返回:
+            dict: 元数据。
+        """
+        metadata = {}
+        for key, (kind, column, mask, values) in self._columns.items():
+            if mask is not None and not mask[row]:
+                continue
+            if kind == "json":
+                value = column[row]
+                if value is None:
+                    continue
+            elif kind == "str":
+                value = values[column[row]]
+            else:
+                value = column[row].item()
+            metadata[key] = value
+        return metadata
+
+    def iter_metadata(self) -> Iterator[Dict[str, Any]]:
+        """按行号顺序遍历元数据（不含原始文本），供 DocIndexer 建索引使用。"""
+        for row in range(self._num_rows):
+            yield self.metadata(row)
+
+    def column(self, key: str) -> List[Any]:
+        """
+        返回一列元数据，缺失值为 None。
+
+        参数:
+            key (str): 元数据键。
+
+        返回:
+            List[Any]: 与行号一一对应的值，所有行都没有该键（例如空存储）时全部为 None。
+        """
+        if key not in self._columns:
+            return [None] * self._num_rows
+        kind, column, mask, values = self._columns[key]
+        if kind == "json":
+            return list(column)
+        if kind == "str":
+            result = [values[code] if code >= 0 else None for code in column.tolist()]
+        else:
+            result = column.tolist()
+        if mask is not None:
+            result = [value if present else None for value, present in zip(result, mask.tolist())]
+        return result
+
+    def __getitem__(self, row: int) -> Document:
+        if row < 0:
+            row += self._num_rows
+        if not 0 <= row < self._num_rows:
+            raise IndexError("chunk store index out of range")
+        metadata = self.metadata(row)
+        metadata[ORIGINAL_TEXT_KEY] = self.original_text(row)
+        return Document(page_content=self.page_content(row), metadata=metadata)
+
+    def __iter__(self) -> Iterator[Document]:
+        for row in range(self._num_rows):
+            yield self[row]
+
+
+class ChunkStoreWriter:
+    """
+    逐个追加文档的文档块存储写入器，文本边追加边写入临时目录，元数据列保存在内存中，
+    close 时写出列文件并替换旧目录。作为上下文管理器使用时，发生异常会丢弃临时目录、保留旧存储。
+
+    参数:
+        path (str): 存储目录。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self.num_rows = 0
+        self._offsets = [0]
+        self._columns: Dict[str, List[Any]] = {}
+        self._text_file = open(os.path.join(self.tmp_path, "text.bin"), "wb")
+
+    def add(self, doc: Document):
+        """
+        追加一个文档。
+
+        参数:
+            doc (Document): page_content 为清洗后文本，元数据的 page_content 为原始文本。
+        """
+        original = doc.metadata.get(ORIGINAL_TEXT_KEY, doc.page_content)
+        for text in (doc.page_content, original):
+            data = text.encode("utf-8")
+            self._text_file.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+        for key, value in doc.metadata.items():
+            if key == ORIGINAL_TEXT_KEY:
+                continue
+            if key not in self._columns:
+                self._columns[key] = [None] * self.num_rows
+            self._columns[key].append(value)
+        self.num_rows += 1
+        for values in self._columns.values():
+            if len(values) < self.num_rows:
+                values.append(None)
+
+    def close(self):
+        """写出偏移表和元数据列，用临时目录替换旧的存储目录。"""
+        tmp_path = self.tmp_path
+        self._text_file.close()
+        np.save(os.path.join(tmp_path, "offsets.npy"), np.asarray(self._offsets, dtype=np.int64))
+
+        header_columns = []
+        for number, (key, values) in enumerate(self._columns.items()):
+            kind = _column_kind(values)
+            spec = {"kind": kind}
+            if kind == "json":
+                spec["values"] = values
+            else:
+                mask = np.asarray([value is not None for value in values])
+                if not mask.all():
+                    spec["has_mask"] = True
+                    np.save(os.path.join(tmp_path, f"mask_{number}.npy"), mask)
+                if kind == "str":
+                    spec["values"] = list(dict.fromkeys(v for v in values if v is not None))
+                    codes = {value: code for code, value in enumerate(spec["values"])}
+                    column = np.asarray(
+                        [codes.get(value, -1) for value in values], dtype=np.int32
+                    )
+                else:
+                    dtype = np.int64 if kind == "int" else np.float64
+                    column = np.asarray([0 if v is None else v for v in values], dtype=dtype)
+                np.save(os.path.join(tmp_path, f"column_{number}.npy"), column)
+            header_columns.append((key, spec))
+        with open(os.path.join(tmp_path, "columns.json"), "w", encoding="utf-8") as file:
+            json.dump({"num_rows": self.num_rows, "columns": header_columns}, file, ensure_ascii=False)
+
+        old_path = f"{self.path}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.rename(self.path, old_path)
+        os.rename(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def abort(self):
+        """放弃写入，删除临时目录，旧的存储保持不变。"""
+        self._text_file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
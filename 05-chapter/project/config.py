@@ -16,10 +16,31 @@ current_directory = os.path.dirname(current_file_path)
 # 存储嵌入向量和 Langchain 文档的目录
 DB_DIR = os.path.join(current_directory, "database_store")
 
+# 多语料时各语料数据库和源文件所在的根目录，每个语料一个子目录，数据库子目录的结构与 DB_DIR 相同。
+CORPORA_DIR = os.path.join(current_directory, "corpora_store")
+CORPORA_DOCS_DIR = os.path.join(current_directory, "corpora_data")
+
+# 常驻内存的语料按持久化索引大小估计的内存预算（MB），超出时淘汰最久未使用的语料。
+CORPUS_MEMORY_BUDGET_MB = 2048
+
 # 存储源文件的目录
 DOCS_DIR = os.path.join(current_directory, "data")
 FILE_PATH = glob.glob(DOCS_DIR + "/*")
 
+# 入库时解析和切分文件的进程数，None 表示使用全部 CPU 核。
+INGEST_MAX_WORKERS = None
+
+# 入库时每批写入向量存储、向量文件和文档块存储的块数，同一时刻只在内存中保留一批块。
+INGEST_BATCH_SIZE = 1000
+
+# 嵌入客户端："openai" 使用 OpenAIEmbeddings，"hash" 使用本地确定性嵌入（测试用，入库和检索需一致）。
+EMBEDDING_CLIENT = "openai"
+
+# 入库时每批嵌入的文本数、同时请求的批次数和失败重试次数，已嵌入过的文本从磁盘缓存读取。
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_MAX_RETRIES = 5
+
 # 模型名称
 MODEL_NAME = "gpt-3.5-turbo" 
 
@@ -58,6 +79,46 @@ SECOND_RETRIEVAL_K = 3  # 第二次检索块数量
 # 第三个检索器的窗口数（大块）。
 NUM_WINDOWS = 2  # 窗口数（大块数量）
 
+# 第一阶段检索后选择文件的重排序器："local" 在本地做 BM25 与向量的交叉打分，"llm" 由语言模型选择。
+RERANKER = "local"
+
+# 本地重排序时 BM25 得分的权重，向量相似度的权重为 1 减去该值。
+RERANK_LEXICAL_WEIGHT = 0.5
+
+# 本地重排序选出的文件数上限，以及文件入选的最低得分（相对最高分的比例）。
+RERANK_MAX_FILES = 2
+RERANK_MIN_SCORE_RATIO = 0.8
+
+# 异步检索时单个检索器（BM25 或向量检索）的超时时间（秒），超时的检索器不参与融合；设置为 None 时不限时。
+RETRIEVER_TIMEOUT = 10
+
+# 异步检索时 BM25 打分专用的线程数。已经开始的打分无法中断，超时后仍占用线程直到完成，
+# 使用独立的有界线程池，不会占满事件循环的默认线程池。
+BM25_MAX_WORKERS = 4
+
+# 是否在日志中输出各阶段检索到的完整块内容，仅用于调试，输出大量文本会明显拖慢检索。
+LOG_CHUNK_CONTENTS = False
+
+# 启动时并行加载数据库和索引的线程数。
+LOADER_MAX_WORKERS = 8
+
+# 健康检查端口（/healthz 存活、/readyz 就绪），设置为 None 时不启动。
+HEALTH_PORT = None
+
+# 拆分出的子问题同时检索的数量上限，设置为 1 时逐个检索。
+MAX_RETRIEVAL_CONCURRENCY = 3
+
+# 批量问答时同时处理的问题数量上限。
+BATCH_MAX_CONCURRENCY = 4
+
+# 检索结果缓存的条目数上限和有效期（秒），条目数设置为 0 时不缓存。默认不缓存：
+# 命中时直接复用整次检索的结果（RERANKER 为 "llm" 时包括语言模型选择的文件），按需开启。
+RETRIEVAL_CACHE_SIZE = 0
+RETRIEVAL_CACHE_TTL = 24 * 3600
+
+# 语义缓存的余弦相似度阈值，设置为 None 时只使用精确匹配（不需要为查询计算嵌入）。
+RETRIEVAL_CACHE_SIMILARITY = None
+
 REFINE_QA_TEMPLATE = """
 对后续输入进行细化或重新表述，将其分解为少于 3 个异构的单跳查询，作为检索工具的输入。
 如果后续输入是多跳、多步骤、复杂或比较性查询，并且与聊天历史和文档名称相关，则进行分解。否则保持后续输入不变。
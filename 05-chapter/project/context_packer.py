@@ -0,0 +1,150 @@
+import logging
+from typing import Any, Dict, List, Tuple
+
+from langchain.schema import Document
+
+from token_counter import TokenCounter, get_token_counter
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def _chunk_score(doc: Document) -> float:
+    return doc.metadata.get("rrf_score", 0.0)
+
+
+def _ranges(docs: List[Document]) -> List[List[Document]]:
+    # 按 medium_chunk_index 排序后，把同一来源中编号相邻的块分到同一段
+    docs = sorted(docs, key=lambda doc: doc.metadata["medium_chunk_index"])
+    ranges = []
+    for doc in docs:
+        if ranges:
+            last = ranges[-1][-1]
+            if (
+                doc.metadata["medium_chunk_index"] == last.metadata["medium_chunk_index"] + 1
+                and doc.metadata.get("source_md5") == last.metadata.get("source_md5")
+            ):
+                ranges[-1].append(doc)
+                continue
+        ranges.append([doc])
+    return ranges
+
+
+def render_file_context(file_name: str, docs: List[Document]) -> str:
+    """
+    生成一个文件的上下文片段。
+
+    中块由相邻小块直接拼接而成，编号相邻的中块拼接后就是原文中连续的一段，
+    因此同一段内不加分隔符，不相邻的段之间用换行分隔。
+
+    参数:
+        file_name (str): 文件名。
+        docs (List[Document]): 该文件入选的中块。
+
+    返回:
+        str: 上下文片段。
+    """
+    text = "\n".join("".join(doc.page_content for doc in docs) for docs in _ranges(docs))
+    return f"\nContext about {file_name}:\n{{{text}}}\n"
+
+
+class ContextPacker:
+    """
+    把各个子问题检索到的中块装入固定的令牌预算。
+
+    所有文件的块按 page_content_md5 去重后按融合得分（rrf_score）从高到低依次尝试放入，
+    放不下的块跳过，继续尝试得分更低但更短的块；最后对完整的上下文计数，
+    超出预算时从得分最低的入选块开始移除，保证结果不超过预算。
+
+    属性:
+        max_tokens (int): 上下文的令牌预算。
+        token_counter (TokenCounter): 带缓存的令牌计数器。
+    """
+
+    def __init__(self, max_tokens: int = MAX_LLM_CONTEXT, token_counter: TokenCounter = None):
+        self.max_tokens = max_tokens
+        self.token_counter = token_counter or get_token_counter()
+
+    def _candidates(self, total_results: Dict[str, List[Document]]) -> List[Tuple[str, Document]]:
+        # 相同的块只保留得分最高的一份，放在第一次出现它的文件下
+        best = {}
+        for file_name, docs in total_results.items():
+            for doc in docs:
+                md5 = doc.metadata["page_content_md5"]
+                if md5 not in best:
+                    best[md5] = (file_name, doc)
+                elif _chunk_score(doc) > _chunk_score(best[md5][1]):
+                    best[md5] = (best[md5][0], doc)
+        # sorted 是稳定排序，得分相同时保持检索顺序
+        return sorted(best.values(), key=lambda item: -_chunk_score(item[1]))
+
+    def _render(self, selected: Dict[str, List[Document]]) -> str:
+        return "".join(
+            render_file_context(file_name, docs) for file_name, docs in selected.items() if docs
+        )
+
+    def pack(self, total_results: Dict[str, List[Document]]) -> Tuple[str, Dict[str, Any]]:
+        """
+        生成不超过令牌预算的上下文。
+
+        参数:
+            total_results (Dict[str, List[Document]]): 文件名 -> 检索到的中块，文件按出现顺序输出。
+
+        返回:
+            Tuple[str, Dict[str, Any]]: 上下文和用量统计。统计包括每个文件占用的令牌数
+                （files）、上下文总令牌数（total_tokens）、入选块数（chunks）和因预算放弃的块数（dropped）。
+        """
+        snippets, _, usage = self.pack_with_documents(total_results)
+        return snippets, usage
+
+    def pack_with_documents(
+        self, total_results: Dict[str, List[Document]]
+    ) -> Tuple[str, Dict[str, List[Document]], Dict[str, Any]]:
+        """
+        与 pack 相同，另外返回实际放入上下文的块，用作回答的来源文档。
+
+        参数:
+            total_results (Dict[str, List[Document]]): 文件名 -> 检索到的中块。
+
+        返回:
+            Tuple[str, Dict[str, List[Document]], Dict[str, Any]]: 上下文、文件名 -> 入选的中块
+                （按得分从高到低，不含没有块入选的文件）和用量统计。
+        """
+        candidates = self._candidates(total_results)
+        selected = {file_name: [] for file_name in total_results}
+        file_tokens = {file_name: 0 for file_name in total_results}
+        used = 0
+        order = []
+        for file_name, doc in candidates:
+            # 只重新计数这个文件的片段，计数器会缓存未变化的片段
+            tokens = self.token_counter.count(
+                render_file_context(file_name, selected[file_name] + [doc])
+            )
+            if used - file_tokens[file_name] + tokens > self.max_tokens:
+                continue
+            selected[file_name].append(doc)
+            used += tokens - file_tokens[file_name]
+            file_tokens[file_name] = tokens
+            order.append((file_name, doc))
+
+        # 片段拼接处的编码可能与分别计数略有不同，以整体计数为准
+        snippets = self._render(selected)
+        total_tokens = self.token_counter.count(snippets)
+        while total_tokens > self.max_tokens and order:
+            file_name, doc = order.pop()
+            selected[file_name].remove(doc)
+            snippets = self._render(selected)
+            total_tokens = self.token_counter.count(snippets)
+
+        usage = {
+            "files": {
+                file_name: self.token_counter.count(render_file_context(file_name, docs))
+                for file_name, docs in selected.items()
+                if docs
+            },
+            "total_tokens": total_tokens,
+            "chunks": len(order),
+            "dropped": len(candidates) - len(order),
+        }
+        logger.info("context_usage: %s", usage)
+        return snippets, {file_name: docs for file_name, docs in selected.items() if docs}, usage
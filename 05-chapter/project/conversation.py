@@ -1,6 +1,8 @@
+import asyncio
 import inspect
 import re
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional
 from typing import List, Tuple, Union
 from pydantic import Field
@@ -19,6 +21,8 @@ from langchain.callbacks.manager import (
 )
 
 from retrivers import MyRetriever
+from context_packer import ContextPacker
+from profiler import run_with_context, stage
 from config import *
 
 logger = logging.getLogger(__name__)
@@ -77,6 +81,18 @@ def _get_chat_history(chat_history: List[ChatTurnType]) -> str:
     return buffer
 
 
+def _merge_docs_dicts(docs_dicts: List[Dict[str, List[Document]]]) -> Dict[str, List[Document]]:
+    # 按问题顺序合并各个问题的检索结果，保证并发执行时结果顺序依然确定
+    total_results = {}
+    for docs_dict in docs_dicts:
+        for file_name, docs in docs_dict.items():
+            if file_name not in total_results:
+                total_results[file_name] = list(docs)
+            else:
+                total_results[file_name].extend(docs)
+    return total_results
+
+
 class ConversationRetrievalChain(BaseConversationalRetrievalChain):
     """
     基于对话的检索链类，用于处理对话形式的检索任务。
@@ -84,10 +100,26 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
     属性:
         retriever: MyRetriever 类型，用于获取文档的检索器。
         file_names: 文件名列表，用于检索的文件名。
+        max_concurrency: 同时检索的子问题数量上限，为 1 时逐个检索。
+        docs_memo: 子问题检索结果的共享缓存，键为 (子问题, 子问题数量)。批量问答时在所有问题之间
+            共享，相同的子问题只检索一次；为 None 时不缓存。
+        max_context_tokens: 检索上下文的令牌预算，检索到的中块按融合得分装入预算。
+        return_context_usage: 是否在输出的 context_usage 中返回每个文件占用的令牌数等统计。
     """
 
     retriever: MyRetriever = Field(exclude=True)
     file_names: List = Field(exclude=True)
+    max_concurrency: int = 1
+    docs_memo: Optional[Dict[Any, Any]] = None
+    max_context_tokens: int = MAX_LLM_CONTEXT
+    return_context_usage: bool = False
+
+    @property
+    def output_keys(self) -> List[str]:
+        keys = super().output_keys
+        if self.return_context_usage:
+            keys = keys + ["context_usage"]
+        return keys
 
     def _get_docs(self, question: str, inputs: Dict[str, Any], num_query: int, *, run_manager: Optional[CallbackManagerForChainRun] = None) -> List[Document]:
         """
@@ -109,7 +141,7 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
             logger.error("在 _get_docs 中发生错误: %s", error)
             return []
 
-    def _retrieve(self, question_list: List[str], inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None) -> List[str]:
+    def _retrieve(self, question_list: List[str], inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None) -> Tuple[str, Dict[str, List[Document]], Dict[str, Any]]:
         """
         对问题列表执行检索。
 
@@ -119,31 +151,38 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
             run_manager: 运行管理器。
 
         返回:
-            List[str]: 检索到的文档片段列表。
+            Tuple[str, Dict[str, List[Document]], Dict[str, Any]]: 按令牌预算装好的上下文、
+                实际放入上下文的块（按文件）和上下文用量统计。
         """
         num_query = len(question_list)
         accepts_run_manager = "run_manager" in inspect.signature(self._get_docs).parameters
 
-        total_results = {}
-        for question in question_list:
+        def get_docs(question: str) -> Dict[str, List[Document]]:
+            key = (question.strip(), num_query)
+            if self.docs_memo is not None and key in self.docs_memo:
+                return self.docs_memo[key]
             docs_dict = self._get_docs(question, inputs, num_query=num_query, run_manager=run_manager) if accepts_run_manager else self._get_docs(question, inputs, num_query=num_query)
-            for file_name, docs in docs_dict.items():
-                if file_name not in total_results:
-                    total_results[file_name] = docs
-                else:
-                    total_results[file_name].extend(docs)
-
+            if self.docs_memo is not None:
+                self.docs_memo[key] = docs_dict
             logger.info("-----step_done--------------------------------------------------")
+            return docs_dict
+
+        if self.max_concurrency > 1 and len(question_list) > 1:
+            # 子问题之间相互独立，使用有界线程池并发检索，map 按问题顺序返回结果
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(question_list))) as executor:
+                # 在调用方上下文的副本中运行，线程中的阶段记录在当前问题的检索阶段下
+                calls = [run_with_context(get_docs, question) for question in question_list]
+                docs_dicts = list(executor.map(lambda call: call(), calls))
+        else:
+            docs_dicts = [get_docs(question) for question in question_list]
 
-        snippets = ""
-        redundancy = set()
-        for file_name, docs in total_results.items():
-            sorted_docs = sorted(docs, key=lambda x: x.metadata["medium_chunk_index"])
-            temp = "\n".join(doc.page_content for doc in sorted_docs if doc.metadata["page_content_md5"] not in redundancy)
-            redundancy.update(doc.metadata["page_content_md5"] for doc in sorted_docs)
-            snippets += f"\nContext about {file_name}:\n{{{temp}}}\n"
+        with stage("context_packing") as counters:
+            snippets, docs_dict, usage = ContextPacker(self.max_context_tokens).pack_with_documents(
+                _merge_docs_dicts(docs_dicts)
+            )
+            counters.update(tokens=usage["total_tokens"], chunks=usage["chunks"], dropped=usage["dropped"])
 
-        return snippets, docs_dict
+        return snippets, docs_dict, usage
 
     def _call(self, inputs: Dict[str, Any], run_manager: Optional[CallbackManagerForChainRun] = None) -> Dict[str, Any]:
         """
@@ -163,7 +202,8 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
 
         # 生成新问题
         callbacks = _run_manager.get_child()
-        new_questions = self.question_generator.run(question=question, chat_history=chat_history_str, database=self.file_names, callbacks=callbacks)
+        with stage("question_generation"):
+            new_questions = self.question_generator.run(question=question, chat_history=chat_history_str, database=self.file_names, callbacks=callbacks)
 
         # 日志记录
         logger.info("new_questions: %s", new_questions)
@@ -172,13 +212,15 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
         logger.info("new_question_list: %s", new_question_list)
 
         # 检索相关文档片段
-        snippets, source_docs = self._retrieve(new_question_list, inputs, run_manager=_run_manager)
+        with stage("retrieval", sub_questions=len(new_question_list)):
+            snippets, source_docs, context_usage = self._retrieve(new_question_list, inputs, run_manager=_run_manager)
 
         # 组合检索结果生成回答
         docs = [Document(page_content=snippets, metadata={})]
         new_inputs = inputs.copy()
         new_inputs["chat_history"] = chat_history_str
-        answer = self.combine_docs_chain.run(input_documents=docs, database=self.file_names, callbacks=_run_manager.get_child(), **new_inputs)
+        with stage("answer_generation", context_tokens=context_usage["total_tokens"]):
+            answer = self.combine_docs_chain.run(input_documents=docs, database=self.file_names, callbacks=_run_manager.get_child(), **new_inputs)
 
         # 构造输出
         output: Dict[str, Any] = {self.output_key: answer}
@@ -186,6 +228,8 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
             output["source_documents"] = source_docs
         if self.return_generated_question:
             output["generated_question"] = new_questions
+        if self.return_context_usage:
+            output["context_usage"] = context_usage
 
         logger.info("*****response*****: %s", output["answer"])
         logger.info("=====epoch_done============================================================")
@@ -214,45 +258,55 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
         question_list: List[str],
         inputs: Dict[str, Any],
         run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
-    ) -> Dict[str, Any]:
+    ) -> Tuple[str, Dict[str, List[Document]], Dict[str, Any]]:
         num_query = len(question_list)
         accepts_run_manager = (
             "run_manager" in inspect.signature(self._get_docs).parameters
         )
-
-        total_results = {}
-        for question in question_list:
-            docs_dict = (
-                await self._aget_docs(
-                    question, inputs, num_query=num_query, run_manager=run_manager
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+
+        async def fetch_docs(question: str) -> Dict[str, List[Document]]:
+            async with semaphore:
+                docs_dict = (
+                    await self._aget_docs(
+                        question, inputs, num_query=num_query, run_manager=run_manager
+                    )
+                    if accepts_run_manager
+                    else await self._aget_docs(question, inputs, num_query=num_query)
                 )
-                if accepts_run_manager
-                else await self._aget_docs(question, inputs, num_query=num_query)
-            )
-
-            for file_name, docs in docs_dict.items():
-                if file_name not in total_results:
-                    total_results[file_name] = docs
-                else:
-                    total_results[file_name].extend(docs)
-
             logger.info(
                 "-----step_done--------------------------------------------------",
             )
+            return docs_dict
+
+        async def aget_docs(question: str) -> Dict[str, List[Document]]:
+            if self.docs_memo is None:
+                return await fetch_docs(question)
+            # 缓存的是任务本身，同时出现的相同子问题等待同一次检索
+            key = (question.strip(), num_query)
+            if key not in self.docs_memo:
+                self.docs_memo[key] = asyncio.ensure_future(fetch_docs(question))
+            task = self.docs_memo[key]
+            try:
+                return await asyncio.shield(task)
+            except Exception:
+                # 检索失败的结果不保留，之后的相同子问题重新检索
+                if self.docs_memo.get(key) is task:
+                    del self.docs_memo[key]
+                raise
+
+        # gather 按问题顺序返回结果，并发度由信号量限制
+        docs_dicts = await asyncio.gather(
+            *[aget_docs(question) for question in question_list]
+        )
 
-        snippets = ""
-        redundancy = set()
-        for file_name, docs in total_results.items():
-            sorted_docs = sorted(docs, key=lambda x: x.metadata["medium_chunk_index"])
-            temp = "\n".join(
-                doc.page_content
-                for doc in sorted_docs
-                if doc.metadata["page_content_md5"] not in redundancy
+        with stage("context_packing") as counters:
+            snippets, docs_dict, usage = ContextPacker(self.max_context_tokens).pack_with_documents(
+                _merge_docs_dicts(docs_dicts)
             )
-            redundancy.update(doc.metadata["page_content_md5"] for doc in sorted_docs)
-            snippets += f"\nContext about {file_name}:\n{{{temp}}}\n"
+            counters.update(tokens=usage["total_tokens"], chunks=usage["chunks"], dropped=usage["dropped"])
 
-        return snippets, docs_dict
+        return snippets, docs_dict, usage
 
     async def _acall(
         self,
@@ -265,19 +319,21 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
         chat_history_str = get_chat_history(inputs["chat_history"])
 
         callbacks = _run_manager.get_child()
-        new_questions = await self.question_generator.arun(
-            question=question,
-            chat_history=chat_history_str,
-            database=self.file_names,
-            callbacks=callbacks,
-        )
+        with stage("question_generation"):
+            new_questions = await self.question_generator.arun(
+                question=question,
+                chat_history=chat_history_str,
+                database=self.file_names,
+                callbacks=callbacks,
+            )
         new_question_list = _get_standalone_questions_list(new_questions)[:3]
         logger.info("new_questions: %s", new_questions)
         logger.info("new_question_list: %s", new_question_list)
 
-        snippets, source_docs = await self._aretrieve(
-            new_question_list, inputs, run_manager=_run_manager
-        )
+        with stage("retrieval", sub_questions=len(new_question_list)):
+            snippets, source_docs, context_usage = await self._aretrieve(
+                new_question_list, inputs, run_manager=_run_manager
+            )
 
         docs = [
             Document(
@@ -288,17 +344,20 @@ class ConversationRetrievalChain(BaseConversationalRetrievalChain):
 
         new_inputs = inputs.copy()
         new_inputs["chat_history"] = chat_history_str
-        answer = await self.combine_docs_chain.arun(
-            input_documents=docs,
-            database=self.file_names,
-            callbacks=_run_manager.get_child(),
-            **new_inputs,
-        )
+        with stage("answer_generation", context_tokens=context_usage["total_tokens"]):
+            answer = await self.combine_docs_chain.arun(
+                input_documents=docs,
+                database=self.file_names,
+                callbacks=_run_manager.get_child(),
+                **new_inputs,
+            )
         output: Dict[str, Any] = {self.output_key: answer}
         if self.return_source_documents:
             output["source_documents"] = source_docs
         if self.return_generated_question:
             output["generated_question"] = new_questions
+        if self.return_context_usage:
+            output["context_usage"] = context_usage
 
         logger.info("*****response*****: %s", output["answer"])
         logger.info(
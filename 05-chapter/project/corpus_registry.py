@@ -0,0 +1,268 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from loader import ServiceLoader
+from config import *
+
+logger = logging.getLogger(__name__)
+
+# 不计入内存估算的文件：检索结果缓存等 SQLite 文件不会常驻内存
+_UNCOUNTED_SUFFIXES = (".sqlite", ".sqlite-wal", ".sqlite-shm", ".tmp")
+
+
+def estimate_corpus_bytes(path: str) -> int:
+    """
+    用持久化索引的磁盘大小估计语料常驻后占用的内存。
+
+    BM25 索引和 DocIndexer 反序列化后的大小与文件大小相当，文档块存储和向量是内存映射，
+    检索时访问到的页才会进入内存，按文件大小计是偏保守的上界。
+
+    参数:
+        path (str): 语料的数据库目录。
+
+    返回:
+        int: 估计的字节数。
+    """
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            if not name.endswith(_UNCOUNTED_SUFFIXES):
+                total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+class Corpus:
+    """
+    一个已加载的语料。
+
+    属性:
+        corpus_id (str): 语料编号，即语料根目录下的子目录名。
+        path (str): 语料的数据库目录，结构与 DB_DIR 相同。
+        retriever (MyRetriever): 该语料的检索器。
+        file_names (list): 该语料入库的文件名。
+        retrieval_cache (RetrievalCache): 该语料的检索结果缓存，未启用时为 None。
+        size_bytes (int): 估计的内存占用。
+        phases (Dict[str, float]): 加载各阶段的耗时。
+        closed (bool): 是否已经释放文档块存储、向量和检索结果缓存。
+    """
+
+    def __init__(self, corpus_id: str, path: str, loader: ServiceLoader, size_bytes: int):
+        self.corpus_id = corpus_id
+        self.path = path
+        self.retriever = loader.retriever
+        self.file_names = loader.file_names
+        self.retrieval_cache = loader.retrieval_cache
+        self.size_bytes = size_bytes
+        self.phases = loader.phases
+        self.closed = False
+        # 正在使用该语料的请求数，被淘汰时等最后一个请求结束再释放
+        self._users = 0
+        self._evicted = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """登记一个使用者，语料已被淘汰时返回 False。"""
+        with self._lock:
+            if self._evicted:
+                return False
+            self._users += 1
+            return True
+
+    def release(self):
+        """注销一个使用者，语料已被淘汰且没有其他使用者时释放。"""
+        with self._lock:
+            self._users -= 1
+            close = self._evicted and self._users == 0
+        if close:
+            self.close()
+
+    def evict(self):
+        """标记为已淘汰，没有使用者时立即释放，否则由最后一个使用者释放。"""
+        with self._lock:
+            self._evicted = True
+            close = self._users == 0
+        if close:
+            self.close()
+
+    def close(self):
+        """释放文档块存储和向量的内存映射，关闭检索结果缓存，之后不能再检索。"""
+        if self.closed:
+            return
+        self.closed = True
+        retriever = self.retriever
+        for resource in (
+            retriever.docs_index_small.documents,
+            retriever.docs_index_medium.documents,
+            retriever.vector_index_small,
+            retriever.vector_index_medium,
+            self.retrieval_cache,
+        ):
+            # 文档块可能是普通列表，只释放有 close 方法的资源
+            close = getattr(resource, "close", None)
+            if close is not None:
+                close()
+        logger.info("closed corpus %s", self.corpus_id)
+
+
+class CorpusRegistry:
+    """
+    多语料注册表：每个团队的文档集是语料根目录下的一个子目录（由 doc2db.py 以该目录为 DB_DIR 入库），
+    按需加载为独立的 MyRetriever，常驻的语料按最近使用顺序保存在 LRU 中，
+    估计的总内存超过预算时淘汰最久未使用的语料。
+
+    分词器、文本清洗器、嵌入客户端和查询向量缓存都是进程级共享的，不随语料重复创建；
+    语料被淘汰后再次使用时，从持久化的 BM25 索引、DocIndexer、文档块存储和向量重新加载，
+    不需要重新分词或建索引。
+
+    属性:
+        llm: 语言模型，传给各语料的检索器。
+        root (str): 语料根目录。
+        memory_budget (int): 常驻语料的内存预算（字节）。
+    """
+
+    def __init__(self, llm, root: str = CORPORA_DIR, memory_budget_mb: float = CORPUS_MEMORY_BUDGET_MB):
+        self.llm = llm
+        self.root = root
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self._corpora: "OrderedDict[str, Corpus]" = OrderedDict()
+        self._loading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+
+    def available(self) -> List[str]:
+        """返回语料根目录下所有已入库的语料编号。"""
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, "ingest_manifest.pkl"))
+        )
+
+    def get(self, corpus_id: str) -> Corpus:
+        """
+        获取语料，未常驻时加载。同一语料同时只加载一次，其他请求等待加载完成。
+        返回的语料被淘汰后会被释放，检索期间需要保证可用时使用 use()。
+
+        参数:
+            corpus_id (str): 语料编号。
+
+        返回:
+            Corpus: 已加载的语料。
+        """
+        while True:
+            with self._lock:
+                corpus = self._corpora.get(corpus_id)
+                if corpus is not None:
+                    self._corpora.move_to_end(corpus_id)
+                    return corpus
+                event = self._loading.get(corpus_id)
+                if event is None:
+                    event = self._loading[corpus_id] = threading.Event()
+                    break
+            # 其他线程正在加载，等待后重新查看（加载失败时由本线程重试）
+            event.wait()
+
+        try:
+            corpus = self._load(corpus_id)
+            with self._lock:
+                self._corpora[corpus_id] = corpus
+                self.loads += 1
+                self._evict(keep=corpus_id)
+            return corpus
+        finally:
+            with self._lock:
+                del self._loading[corpus_id]
+            event.set()
+
+    def _load(self, corpus_id: str) -> Corpus:
+        path = os.path.join(self.root, corpus_id)
+        if os.path.basename(os.path.normpath(path)) != corpus_id or not os.path.isdir(path):
+            raise KeyError(f"语料 {corpus_id} 不存在")
+        loader = ServiceLoader(self.llm, path=path).start()
+        loader.wait()
+        corpus = Corpus(corpus_id, path, loader, estimate_corpus_bytes(path))
+        logger.info(
+            "loaded corpus %s (%.1f MB) in %.2fs",
+            corpus_id,
+            corpus.size_bytes / 1024 / 1024,
+            loader.phases.get("total", 0.0),
+        )
+        return corpus
+
+    def _evict(self, keep: Optional[str] = None):
+        # 在持有锁时调用：从最久未使用的语料开始淘汰，直到不超过预算；刚加载的语料始终保留
+        while self.resident_bytes() > self.memory_budget:
+            victim = next((cid for cid in self._corpora if cid != keep), None)
+            if victim is None:
+                break
+            corpus = self._corpora.pop(victim)
+            self.evictions += 1
+            logger.info("evicted corpus %s (%.1f MB)", victim, corpus.size_bytes / 1024 / 1024)
+            corpus.evict()
+
+    def evict(self, corpus_id: str) -> bool:
+        """
+        主动淘汰语料，例如语料重新入库之后。
+
+        参数:
+            corpus_id (str): 语料编号。
+
+        返回:
+            bool: 该语料是否曾经常驻。
+        """
+        with self._lock:
+            corpus = self._corpora.pop(corpus_id, None)
+            if corpus is None:
+                return False
+            corpus.evict()
+            return True
+
+    @contextmanager
+    def use(self, corpus_id: str) -> Iterator[Corpus]:
+        """
+        在 with 语句中使用语料：期间语料即使被淘汰也不会被释放，离开 with 语句后才释放。
+
+        参数:
+            corpus_id (str): 语料编号。
+
+        返回:
+            Iterator[Corpus]: 已加载的语料。
+        """
+        while True:
+            corpus = self.get(corpus_id)
+            # 取到语料和登记使用之间可能被淘汰，此时重新加载
+            if corpus.acquire():
+                break
+        try:
+            yield corpus
+        finally:
+            corpus.release()
+
+    def close(self):
+        """淘汰并释放全部常驻语料。"""
+        with self._lock:
+            corpora = list(self._corpora.values())
+            self._corpora.clear()
+        for corpus in corpora:
+            corpus.evict()
+
+    def resident_bytes(self) -> int:
+        """返回常驻语料估计的内存占用之和。"""
+        return sum(corpus.size_bytes for corpus in self._corpora.values())
+
+    def stats(self) -> Dict[str, object]:
+        """返回常驻语料、估计的内存占用、加载次数和淘汰次数。"""
+        with self._lock:
+            return {
+                "resident": list(self._corpora),
+                "resident_mb": self.resident_bytes() / 1024 / 1024,
+                "budget_mb": self.memory_budget / 1024 / 1024,
+                "loads": self.loads,
+                "evictions": self.evictions,
+            }
@@ -1,35 +1,44 @@
 import os
+import glob
 import pickle
-from typing import List
+import logging
+import argparse
+import tempfile
+from typing import Iterable, Iterator, List, Optional, Sequence
+from itertools import chain, islice, repeat
 from collections import deque
+from functools import lru_cache
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
 import hashlib
-import tiktoken
+import numpy as np
 from tqdm import tqdm
 from langchain.schema import Document
 from langchain.vectorstores.chroma import Chroma
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-)
 from langchain.document_loaders import PyPDFLoader, TextLoader
 
 from config import *
-from utils import clean_text
+from utils import get_text_normalizer
+from bm25_index import BM25Index
+from chunk_store import ChunkStore, ChunkStoreWriter
+from embedding_pipeline import CachedEmbeddings, EmbeddingCache, get_embedding_client
+from vector_index import VectorFileWriter, normalize_rows
+from token_counter import CachedTokenTextSplitter, get_token_counter
+
+logger = logging.getLogger(__name__)
 
 def calculate_token_length(text: str):
     """计算给定文本字符串使用TikToken的令牌长度。
 
+    编码器在进程内只创建一次，重复出现的文本片段直接从缓存中取长度。
+
     参数:
         text (str): 需要被令牌化的文本。
 
     返回值:
         int: 令牌化文本的长度。
     """
-    tokenizer_name = tiktoken.encoding_for_model(MODEL_NAME)
-    tokenizer = tiktoken.get_encoding(tokenizer_name.name)
-    tokens = tokenizer.encode(text, disallowed_special=())
-
-    return len(tokens)
+    return get_token_counter().count(text)
 
 
 def string_to_md5(text: str):
@@ -47,14 +56,14 @@ def string_to_md5(text: str):
     return md5_hash.hexdigest()
 
 
-def load_document(file_path):
-    """加载文件并将其内容作为文档对象返回。
+def get_loader(file_path):
+    """根据扩展名创建文件加载器。
 
     参数:
         file_path (str): 文件的路径。
 
     返回值:
-        Document: 加载的文档。
+        BaseLoader: 文件加载器。
     """
     loader_mapping = {
         "pdf": (PyPDFLoader, {}),
@@ -63,34 +72,122 @@ def load_document(file_path):
     extension = file_path.split(".")[-1]
     if extension in loader_mapping:
         loader_class, args = loader_mapping[extension]
-        loader = loader_class(file_path, **args)
-        document = loader.load()
-
-        return document
+        return loader_class(file_path, **args)
 
     raise ValueError(f"不支持的扩展名 {extension}")
 
-def documents_to_vector_store(documents: List[Document], embedding_name: str, suffix: str = ""):
+
+def load_document(file_path):
+    """加载文件并将其内容作为文档对象返回。
+
+    参数:
+        file_path (str): 文件的路径。
+
+    返回值:
+        Document: 加载的文档。
+    """
+    return get_loader(file_path).load()
+
+
+def iter_document_pages(file_path):
+    """逐页加载文件，加载器支持 lazy_load 时（如 PyPDFLoader）不会一次读入所有页面。
+
+    参数:
+        file_path (str): 文件的路径。
+
+    返回值:
+        Iterator[Document]: 文件的页面文档。
+    """
+    loader = get_loader(file_path)
+    try:
+        pages = loader.lazy_load()
+    except NotImplementedError:
+        pages = loader.load()
+    yield from pages
+
+@lru_cache(maxsize=None)
+def get_document_embeddings():
+    """
+    获取入库使用的带缓存嵌入，嵌入缓存保存在存储目录的 embedding_cache.sqlite 中。
+
+    返回值:
+        CachedEmbeddings: 批量、并发、带磁盘缓存的嵌入。
     """
-    将文档列表转换为向量格式并存储在指定的目录中。
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    return CachedEmbeddings(
+        get_embedding_client(), EmbeddingCache(f"{DB_DIR}/embedding_cache.sqlite")
+    )
+
+
+def report_embedding_stats(stats: dict, suffix: str):
+    """
+    在日志中记录嵌入的文本数、缓存命中数和每秒嵌入数。
+
+    参数:
+        stats (dict): 各批 CachedEmbeddings.stats 中 texts、cached、embedded 和 seconds 的累计值。
+        suffix (str): 存储名称的后缀。
+    """
+    if stats.get("texts"):
+        embeddings_per_second = stats["embedded"] / stats["seconds"] if stats["seconds"] else 0.0
+        logger.info(
+            "%s: 嵌入 %d 个文本，缓存命中 %d，新嵌入 %d，%.1f 条/秒",
+            suffix,
+            stats["texts"],
+            stats["cached"],
+            stats["embedded"],
+            embeddings_per_second,
+        )
+
+
+def reset_vector_store(embedding_name: str, suffix: str = ""):
+    """
+    清空同名的向量存储，返回一个空的存储供全量入库时逐批写入，避免重复入库产生重复的向量。
 
     参数:
-        documents (List[Document]): 要转换的文档对象列表。
         embedding_name (str): 使用的嵌入名称，用于标识不同的嵌入方法或模型。
         suffix (str, 可选): 用于生成存储名称的后缀，以区分不同的存储。默认为空字符串。
 
-    功能:
-        - 根据嵌入名称和后缀创建存储名称。
-        - 检查存储目录是否存在，如果不存在则创建它。
-        - 使用Chroma库将文档列表转换为向量格式，并持久化到指定目录。
+    返回值:
+        Chroma: 空的向量存储，写入新文档时使用带缓存的批量嵌入。
     """
     store_name = f"{embedding_name}_{suffix}"
     if not os.path.exists(DB_DIR):
         os.makedirs(DB_DIR)
-    Chroma.from_documents(
-        documents,
-        OpenAIEmbeddings(),
+    if os.path.exists(f"{DB_DIR}/chroma_{store_name}"):
+        load_vector_store(embedding_name, suffix).delete_collection()
+    return load_vector_store(embedding_name, suffix)
+
+
+def document_vectors(documents: List[Document]):
+    """
+    计算文档块的归一化向量。文档刚写入向量存储时已经嵌入过，这里直接从嵌入缓存读取。
+
+    参数:
+        documents (List[Document]): 写入向量存储时的文档对象列表（页面内容尚未清理）。
+
+    返回值:
+        np.ndarray: 与 documents 一一对应的归一化 float32 向量矩阵。
+    """
+    vectors = get_document_embeddings().embed_documents([doc.page_content for doc in documents])
+    return normalize_rows(vectors) if vectors else np.zeros((0, 0), dtype=np.float32)
+
+
+def load_vector_store(embedding_name: str, suffix: str = ""):
+    """
+    加载 documents_to_vector_store 持久化的向量存储。
+
+    参数:
+        embedding_name (str): 使用的嵌入名称。
+        suffix (str, 可选): 存储名称的后缀。默认为空字符串。
+
+    返回值:
+        Chroma: 向量存储对象，写入新文档时使用带缓存的批量嵌入。
+    """
+    store_name = f"{embedding_name}_{suffix}"
+    return Chroma(
         persist_directory=f"{DB_DIR}/chroma_{store_name}",
+        embedding_function=get_document_embeddings(),
     )
 
 
@@ -114,28 +211,122 @@ def file_names_to_pickle(file_names: list, save_name: str = ""):
         pickle.dump(file_names, file)
 
 
-def documents_to_pickle(documents: List[Document], suffix: str = ""):
+def iter_batches(documents: Iterable[Document], batch_size: int):
+    """把文档流切分成最多 batch_size 个文档的列表，逐个产出。"""
+    documents = iter(documents)
+    while True:
+        batch = list(islice(documents, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def chunks_to_stores(
+    chunks: Iterable[Document],
+    chunk_type: str,
+    vector_store: Chroma,
+    existing_store: Optional[ChunkStore] = None,
+    kept_rows: Sequence[int] = (),
+    executor=None,
+):
+    """
+    把块流逐批写入向量存储、按行对齐的向量文件和文档块存储，再基于写好的文档块存储重建BM25索引。
+
+    参数:
+        chunks (Iterable[Document]): 新块，页面内容尚未清理，可以是生成器。
+        chunk_type (str): 块的类型，"small" 或 "medium"。
+        vector_store (Chroma): 写入新块的向量存储。
+        existing_store (ChunkStore, 可选): 旧的文档块存储，kept_rows 中的块及其向量保存在新块之前。
+        kept_rows (Sequence[int], 可选): 保留的旧块行号。
+        executor (ProcessPoolExecutor, 可选): 清洗文本用的进程池，为 None 时在当前进程中清洗。
+
+    功能:
+        - 每批 INGEST_BATCH_SIZE 个块：写入向量存储（只嵌入缓存中没有的文本），从嵌入缓存读取归一化向量
+          追加到向量文件，清理页面内容后追加到文档块存储。同一时刻只在内存中保留一批块。
+        - 旧块已经清理过，按行号逐批复制文本和向量，不重新嵌入和清理。
+        - 向量文件和文档块存储都先写入临时文件，全部完成后才替换旧文件，写入前打开的旧存储仍可继续读取。
+    """
+    suffix = f"{chunk_type}_chunks"
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    normalizer = get_text_normalizer()
+    embeddings = get_document_embeddings()
+    stats = {"texts": 0, "cached": 0, "embedded": 0, "seconds": 0.0}
+    with ChunkStoreWriter(f"{DB_DIR}/docs_store_{suffix}") as store_writer, VectorFileWriter(
+        f"{DB_DIR}/vectors_{suffix}.npy", copy_rows=INGEST_BATCH_SIZE
+    ) as vector_writer:
+        if existing_store is not None and len(kept_rows):
+            existing_vectors = np.load(f"{DB_DIR}/vectors_{suffix}.npy", mmap_mode="r")
+            for start in range(0, len(kept_rows), INGEST_BATCH_SIZE):
+                rows = kept_rows[start : start + INGEST_BATCH_SIZE]
+                vector_writer.append(existing_vectors[rows])
+                for row in rows:
+                    store_writer.add(existing_store[row])
+            del existing_vectors
+
+        for batch in iter_batches(chunks, INGEST_BATCH_SIZE):
+            vector_store.add_documents(batch, ids=_documents_chunk_ids(batch, chunk_type))
+            for key in stats:
+                stats[key] += embeddings.stats.get(key, 0)
+            vector_writer.append(document_vectors(batch))
+            cleaned = normalizer.clean_many(
+                [doc.page_content for doc in batch], max_workers=1, executor=executor
+            )
+            for doc, page_content in zip(batch, cleaned):
+                doc.page_content = page_content
+                store_writer.add(doc)
+    report_embedding_stats(stats, suffix)
+
+    with ChunkStore.open(f"{DB_DIR}/docs_store_{suffix}") as store:
+        bm25_index_to_pickle(store, suffix=suffix)
+
+
+def bm25_index_to_pickle(documents: Sequence[Document], suffix: str = ""):
     """
-    将文档对象列表清理后保存为Pickle格式的文件。
+    为清理后的文档对象列表构建BM25索引并保存为Pickle格式的文件。
 
     参数:
-        documents (List[Document]): 要保存的文档对象列表。
+        documents (Sequence[Document]): 已经过documents_to_store清理的文档对象列表或文档块存储。
         suffix (str, 可选): 用于生成Pickle文件名称的后缀。默认为空字符串。
 
     功能:
-        - 对每个文档对象的页面内容进行清理。
-        - 根据后缀创建Pickle文件的完整路径。
-        - 检查存储目录是否存在，如果不存在则创建它。
-        - 将处理后的文档对象列表以Pickle格式写入文件。
+        - 对每个文档只分词一次，构建倒排表、文档长度和IDF。
+        - 索引的行号与docs_store中文档的顺序一致，检索时无需重新分词。
+        - 将索引以Pickle格式写入存储目录。
     """
-    for doc in documents:
-        doc.page_content = clean_text(doc.page_content)
+    bm25_index = BM25Index.from_documents(documents)
     pickle_name = f"pickle_{suffix}"
     if not os.path.exists(DB_DIR):
         os.makedirs(DB_DIR)
-    with open(f"{DB_DIR}/docs_{pickle_name}.pkl", "wb") as file:
-        pickle.dump(documents, file)
+    with open(f"{DB_DIR}/bm25_{pickle_name}.pkl", "wb") as file:
+        pickle.dump(bm25_index, file)
+
+
+
+def iter_split_document(
+    pages: Iterable[Document], chunk_size: int, chunk_overlap: int, chunk_index_name: str
+):
+    """逐页切分文档，按顺序产出带块索引的小块。
 
+    参数:
+        pages (Iterable[Document]): 要被切割的页面文档，可以是生成器。
+        chunk_size (int): 每个块的大小。
+        chunk_overlap (int): 相邻块之间的重叠。
+        chunk_index_name (str): 用于存储块索引的元数据键。
+
+    返回值:
+        Iterator[Document]: 表示块的文档对象。
+    """
+    splitter = CachedTokenTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+    chunk_index = 0
+    for page in pages:
+        for split_doc in splitter.split_documents([page]):
+            split_doc.metadata[chunk_index_name] = chunk_index
+            chunk_index += 1
+            yield split_doc
 
 
 def split_document(
@@ -152,19 +343,24 @@ def split_document(
     返回值:
         list: 表示块的文档对象列表。
     """
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap,
-        length_function=calculate_token_length,
-    )
-    split_documents = splitter.split_documents(document)
-    chunk_index = 0
+    return list(iter_split_document(document, chunk_size, chunk_overlap, chunk_index_name))
 
-    for split_doc in split_documents:
-        split_doc.metadata[chunk_index_name] = chunk_index
-        chunk_index += 1
 
-    return split_documents
+def update_chunk_metadata(doc: Document, file_name: str, source_md5: str):
+    """更新单个文档块的元数据：保存原始文本及其MD5，并在页面内容前加上文件名。
+
+    参数:
+        doc (Document): 文档块。
+        file_name (str): 不带扩展名的文件名。
+        source_md5 (str): 来源路径的MD5哈希值，同一文件的块共用。
+    """
+    for key, value in doc.metadata.items():
+        if isinstance(value, list):
+            doc.metadata[key] = str(value)
+    doc.metadata["page_content"] = doc.page_content
+    doc.metadata["page_content_md5"] = string_to_md5(doc.page_content)
+    doc.metadata["source_md5"] = source_md5
+    doc.page_content = f"{file_name}\n{doc.page_content}"
 
 
 def update_document_metadata(documents: List[Document]):
@@ -175,33 +371,36 @@ def update_document_metadata(documents: List[Document]):
     """
     file_name_with_extension = os.path.basename(documents[0].metadata["source"])
     file_name, _ = os.path.splitext(file_name_with_extension)
+    source_md5 = string_to_md5(documents[0].metadata["source"])
 
-    for _, doc in enumerate(documents):
-        for key, value in doc.metadata.items():
-            if isinstance(value, list):
-                doc.metadata[key] = str(value)
-        doc.metadata["page_content"] = doc.page_content
-        doc.metadata["page_content_md5"] = string_to_md5(doc.page_content)
-        doc.metadata["source_md5"] = string_to_md5(doc.metadata["source"])
-        doc.page_content = f"{file_name}\n{doc.page_content}"
+    for doc in documents:
+        update_chunk_metadata(doc, file_name, source_md5)
 
 
-def add_window_to_document(
-    document: Document, window_steps: int, window_size: int, window_index_name: str
+def iter_window_document(
+    documents: Iterable[Document], window_steps: int, window_size: int, window_index_name: str
 ):
-    """在文档列表的每个文档中添加窗口化信息。
+    """为文档块流添加窗口化信息，按顺序产出已经确定窗口的文档块。
+
+    窗口编号只在块之后还有超过 window_size 个块时才会递增，因此最多缓存 window_size 个块，
+    直到看到足够多的后续块或者流结束时再确定它们的窗口，结果与 add_window_to_document 一致。
 
     参数:
-        document (Document): 文档对象列表。
+        documents (Iterable[Document]): 文档块，可以是生成器。
         window_steps (int): 窗口化的步长。
         window_size (int): 每个窗口的大小。
         window_index_name (str): 用于存储窗口索引的元数据键。
+
+    返回值:
+        Iterator[Document]: 添加了窗口上下界的文档块。
     """
     window_id = 0
     window_queue = deque()
+    pending = deque()
 
-    for index, doc in enumerate(document):
-        if index % window_steps == 0 and index != 0 and index < len(document) - window_size:
+    def assign(index: int, doc: Document, before_tail: bool):
+        nonlocal window_id
+        if index % window_steps == 0 and index != 0 and before_tail:
             window_id += 1
         window_queue.append(window_id)
 
@@ -209,9 +408,32 @@ def add_window_to_document(
             for _ in range(window_steps):
                 window_queue.popleft()
 
-        window = set(window_queue)
-        doc.metadata[f"{window_index_name}_lower_bound"] = min(window)
-        doc.metadata[f"{window_index_name}_upper_bound"] = max(window)
+        # 队列中的窗口编号单调不减，首尾即为最小值和最大值
+        doc.metadata[f"{window_index_name}_lower_bound"] = window_queue[0]
+        doc.metadata[f"{window_index_name}_upper_bound"] = window_queue[-1]
+        return doc
+
+    for index, doc in enumerate(documents):
+        pending.append((index, doc))
+        if len(pending) > window_size:
+            # 已经看到第 index 块，说明待定的第一块之后至少还有 window_size 块
+            yield assign(*pending.popleft(), before_tail=True)
+    while pending:
+        yield assign(*pending.popleft(), before_tail=False)
+
+
+def add_window_to_document(
+    document: Document, window_steps: int, window_size: int, window_index_name: str
+):
+    """在文档列表的每个文档中添加窗口化信息。
+
+    参数:
+        document (Document): 文档对象列表。
+        window_steps (int): 窗口化的步长。
+        window_size (int): 每个窗口的大小。
+        window_index_name (str): 用于存储窗口索引的元数据键。
+    """
+    deque(iter_window_document(document, window_steps, window_size, window_index_name), maxlen=0)
 
 
 def merge_metadata_dicts(metadata_dicts: List[dict]):
@@ -252,6 +474,25 @@ def merge_metadata_dicts(metadata_dicts: List[dict]):
     }
 
 
+def merge_chunk_group(group: List[Document], chunk_index: int, chunk_index_name: str):
+    """把相邻的小块合并成一个较大的块。
+
+    参数:
+        group (List[Document]): 相邻的小块。
+        chunk_index (int): 合并块的索引。
+        chunk_index_name (str): 用于存储块索引的元数据键。
+
+    返回值:
+        Document: 合并后的文档块。
+    """
+    metadata = merge_metadata_dicts([item.metadata for item in group])
+    metadata[chunk_index_name] = chunk_index
+    return Document(
+        page_content="".join(item.page_content for item in group),
+        metadata=metadata,
+    )
+
+
 def merge_document_chunks(document: Document, scale_factor: int, chunk_index_name: str):
     """根据缩放因子将相邻的小块合并成较大的块。
 
@@ -263,82 +504,338 @@ def merge_document_chunks(document: Document, scale_factor: int, chunk_index_nam
     返回值:
         list: 表示合并块的文档对象列表。
     """
-    merged_documents = []
-    content_aggregate = ""
-    metadata_aggregate = []
-    chunk_index = 0
+    return [
+        merge_chunk_group(document[start : start + scale_factor], chunk_index, chunk_index_name)
+        for chunk_index, start in enumerate(range(0, len(document), scale_factor))
+    ]
 
-    for index, item in enumerate(document):
-        content_aggregate += item.page_content
-        metadata_aggregate.append(item.metadata)
-
-        if (index + 1) % scale_factor == 0 or index == len(document) - 1:
-            metadata = merge_metadata_dicts(metadata_aggregate)
-            metadata[chunk_index_name] = chunk_index
-            merged_documents.append(
-                Document(
-                    page_content=content_aggregate,
-                    metadata=metadata,
-                )
-            )
-            chunk_index += 1
-            content_aggregate = ""
-            metadata_aggregate = []
 
-    return merged_documents
+def iter_chunk_hierarchy(pages: Iterable[Document]):
+    """单次遍历页面流，依次完成小块切分、窗口化、中块合并和元数据更新。
 
+    同一时刻只缓存窗口化需要的 WINDOW_SCALE 个小块和正在合并的 CHUNK_SCALE 个小块，
+    不需要先把整个文件的页面或小块都读入内存。产出的块和元数据与依次调用
+    split_document、add_window_to_document、merge_document_chunks 和
+    update_document_metadata 的结果一致。
 
-def process_file_paths():
-    small_chunks = []
-    medium_chunks = []
-    processed_file_names = []
-    with tqdm(total=len(FILE_PATH), desc="处理文件", ncols=80) as progress_bar:
-        for path in FILE_PATH:
-            # 加载文件
-            document = load_document(path)
+    参数:
+        pages (Iterable[Document]): 同一文件的页面文档，可以是生成器。
 
-            file_name_with_extension = os.path.basename(document[0].metadata["source"])
+    返回值:
+        Iterator[Tuple[str, Document]]: ("small", 小块) 或 ("medium", 中块)，各自按块索引顺序产出。
+    """
+    small_chunks = iter_window_document(
+        iter_split_document(
+            pages,
+            chunk_size=BASE_CHUNK_SIZE,
+            chunk_overlap=CHUNK_OVERLAP,
+            chunk_index_name="small_chunk_index",
+        ),
+        window_steps=WINDOW_STEPS,
+        window_size=WINDOW_SCALE,
+        window_index_name="large_chunks_index",
+    )
 
-            # 对文档进行分割并添加窗口
-            small_chunk_split = split_document(
-                document=document,
-                chunk_size=BASE_CHUNK_SIZE,
-                chunk_overlap=CHUNK_OVERLAP,
-                chunk_index_name="small_chunk_index",
-            )
-            add_window_to_document(
-                document=small_chunk_split,
-                window_steps=WINDOW_STEPS,
-                window_size=WINDOW_SCALE,
-                window_index_name="large_chunks_index",
-            )
+    file_name = source_md5 = None
+    group = []
+    medium_chunk_index = 0
+
+    def flush():
+        # 中块必须在小块的元数据更新之前合并
+        nonlocal medium_chunk_index
+        medium = merge_chunk_group(group, medium_chunk_index, "medium_chunk_index")
+        medium_chunk_index += 1
+        for small in group:
+            update_chunk_metadata(small, file_name, source_md5)
+            yield "small", small
+        update_chunk_metadata(medium, file_name, source_md5)
+        yield "medium", medium
+        group.clear()
+
+    for small in small_chunks:
+        if file_name is None:
+            source = small.metadata["source"]
+            file_name, _ = os.path.splitext(os.path.basename(source))
+            source_md5 = string_to_md5(source)
+        group.append(small)
+        if len(group) == CHUNK_SCALE:
+            yield from flush()
+    if group:
+        yield from flush()
+
+
+def process_file(path: str, spool_dir: str):
+    """加载单个文件，切分为小块、添加窗口并合并为中块，边生成边写入该文件的临时文档块存储。
+
+    该函数在进程池的子进程中运行，只依赖参数和配置，返回值均可被 pickle。页面逐页读取，
+    块一生成就写入 spool_dir 中的小块和中块存储，同一时刻只在内存中保留窗口化和合并需要的少量块，
+    不随文件大小增长；主进程再从临时存储中逐批读取入库。
 
-            # 合并文档并处理元数据
-            medium_chunk_split = merge_document_chunks(
-                document=small_chunk_split,
-                scale_factor=CHUNK_SCALE,
-                chunk_index_name="medium_chunk_index",
-            )
-            update_document_metadata(small_chunk_split)
-            update_document_metadata(medium_chunk_split)
+    参数:
+        path (str): 文件的路径。
+        spool_dir (str): 临时文档块存储所在的目录。
+
+    返回值:
+        tuple: (带扩展名的文件名, 小块存储目录, 中块存储目录)。没有任何内容的文件两个存储都为空。
+    """
+    spool_path = os.path.join(spool_dir, string_to_md5(path))
+    small_path, medium_path = f"{spool_path}_small", f"{spool_path}_medium"
+    # 逐页加载并单次完成切分、窗口化、合并和元数据处理
+    with ChunkStoreWriter(small_path) as small_writer, ChunkStoreWriter(medium_path) as medium_writer:
+        for chunk_type, chunk in iter_chunk_hierarchy(iter_document_pages(path)):
+            (small_writer if chunk_type == "small" else medium_writer).add(chunk)
+    if not small_writer.num_rows:
+        # 空文件或只有空白字符的文件不产生任何块，跳过而不是中断整个入库
+        logger.warning("跳过没有内容的文件: %s", path)
+
+    return os.path.basename(path), small_path, medium_path
+
+
+def process_files(file_paths: List[str], spool_dir: str, max_workers: Optional[int] = None):
+    """使用进程池并行处理文件，结果顺序与 file_paths 一致。
+
+    参数:
+        file_paths (List[str]): 需要处理的文件路径列表。
+        spool_dir (str): 临时文档块存储所在的目录。
+        max_workers (int, 可选): 进程数，默认为 CPU 核数；为 1 时在当前进程中串行处理。
+
+    返回值:
+        list: 每个文件对应的 process_file 结果。
+    """
+    results = []
+    with tqdm(total=len(file_paths), desc="处理文件", ncols=80) as progress_bar:
+        if max_workers == 1 or len(file_paths) <= 1:
+            for path in file_paths:
+                results.append(process_file(path, spool_dir))
+                progress_bar.update()
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for result in executor.map(process_file, file_paths, repeat(spool_dir)):
+                    results.append(result)
+                    progress_bar.update()
+    return results
+
+
+def spooled_chunks(store_paths: Iterable[str]) -> Iterator[Document]:
+    """依次打开临时文档块存储并逐个产出其中的块，读完一个存储就关闭。"""
+    for path in store_paths:
+        with ChunkStore.open(path) as store:
+            yield from store
+
+
+def spooled_manifest_entry(file_md5: str, file_name: str, small_path: str, medium_path: str):
+    """根据 process_file 写入的临时存储生成入库清单条目。"""
+    with ChunkStore.open(small_path) as small_chunks, ChunkStore.open(medium_path) as medium_chunks:
+        return manifest_entry(file_md5, file_name, small_chunks, medium_chunks)
 
-            # 保存文件名和处理后的文档块
-            processed_file_names.append(file_name_with_extension)
-            small_chunks.extend(small_chunk_split)
-            medium_chunks.extend(medium_chunk_split)
 
-            progress_bar.update()
+def text_cleaning_pool(max_workers: Optional[int]):
+    """入库期间清洗文本共用的进程池，max_workers 为 1 时不创建进程池，在当前进程中清洗。"""
+    if max_workers == 1:
+        return nullcontext()
+    return get_text_normalizer().process_pool(max_workers)
 
-    # 将文件名保存为pickle文件
-    file_names_to_pickle(processed_file_names, save_name="file_names")
 
-    # 将处理后的文档块保存为向量存储和pickle文件
-    documents_to_vector_store(small_chunks, "openAIEmbeddings", suffix="small_chunks")
-    documents_to_vector_store(medium_chunks, "openAIEmbeddings", suffix="medium_chunks")
-    documents_to_pickle(small_chunks, suffix="small_chunks")
-    documents_to_pickle(medium_chunks, suffix="medium_chunks")
+def file_to_md5(file_path: str):
+    """计算文件内容的MD5哈希值，用于判断文件是否发生变化。
 
+    参数:
+        file_path (str): 文件的路径。
+
+    返回值:
+        str: 文件内容的MD5哈希值。
+    """
+    md5_hash = hashlib.md5()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            md5_hash.update(chunk)
+
+    return md5_hash.hexdigest()
+
+
+def chunk_ids(source_md5: str, chunk_type: str, num_chunks: int):
+    """生成文件中各个块在向量存储中的ID，同一文件的块ID在重复入库时保持不变。
+
+    参数:
+        source_md5 (str): 文件路径的MD5哈希值。
+        chunk_type (str): 块的类型，"small" 或 "medium"。
+        num_chunks (int): 块的数量。
+
+    返回值:
+        list: 块ID列表。
+    """
+    return [f"{source_md5}-{chunk_type}-{index}" for index in range(num_chunks)]
+
+
+def _documents_chunk_ids(documents: List[Document], chunk_type: str):
+    # 按块的 source_md5 和块索引生成与 chunk_ids 一致的ID
+    return [
+        f"{doc.metadata['source_md5']}-{chunk_type}-{doc.metadata[f'{chunk_type}_chunk_index']}"
+        for doc in documents
+    ]
+
+
+def load_ingest_manifest():
+    """加载入库清单，清单记录了每个已入库文件的内容哈希和块数量。
+
+    返回值:
+        dict: 形如 {文件路径: {"file_md5", "source_md5", "file_name", "num_small", "num_medium"}}。
+    """
+    manifest_path = f"{DB_DIR}/ingest_manifest.pkl"
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, "rb") as file:
+        return pickle.load(file)
+
+
+def ingest_manifest_to_pickle(manifest: dict):
+    """将入库清单保存为Pickle格式的文件。
+
+    参数:
+        manifest (dict): 入库清单。
+    """
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    with open(f"{DB_DIR}/ingest_manifest.pkl", "wb") as file:
+        pickle.dump(manifest, file)
+
+
+def manifest_entry(file_md5: str, file_name: str, small_chunks: Sequence[Document], medium_chunks: Sequence[Document]):
+    """根据处理结果生成单个文件的入库清单条目，没有内容的文件 source_md5 为 None、块数为 0。"""
+    return {
+        "file_md5": file_md5,
+        "source_md5": small_chunks[0].metadata["source_md5"] if small_chunks else None,
+        "file_name": file_name,
+        "num_small": len(small_chunks),
+        "num_medium": len(medium_chunks),
+    }
+
+
+def process_file_paths(max_workers: Optional[int] = INGEST_MAX_WORKERS):
+    """全量入库：处理 FILE_PATH 中的全部文件并重建向量存储、文档块、BM25索引和入库清单。
+
+    参数:
+        max_workers (int, 可选): 解析、切分文件和清洗文本的进程数。
+
+    功能:
+        - 子进程把每个文件的块写入临时文档块存储，主进程从中逐批读取入库，不会同时持有整个语料的块。
+    """
+    if not os.path.exists(DB_DIR):
+        os.makedirs(DB_DIR)
+    with tempfile.TemporaryDirectory(dir=DB_DIR) as spool_dir:
+        spooled = process_files(FILE_PATH, spool_dir, max_workers)
+        processed_file_names = []
+        manifest = {}
+        for path, (file_name, small_path, medium_path) in zip(FILE_PATH, spooled):
+            manifest[path] = spooled_manifest_entry(file_to_md5(path), file_name, small_path, medium_path)
+            # 保存有内容的文件名，没有内容的文件只记入清单，增量入库时不会重复处理
+            if manifest[path]["num_small"]:
+                processed_file_names.append(file_name)
+
+        # 将文件名保存为pickle文件
+        file_names_to_pickle(processed_file_names, save_name="file_names")
+
+        # 将处理后的文档块逐批写入向量存储、向量文件和文档块存储，并重建BM25索引
+        with text_cleaning_pool(max_workers) as executor:
+            for chunk_type, position in (("small", 1), ("medium", 2)):
+                suffix = f"{chunk_type}_chunks"
+                chunks_to_stores(
+                    spooled_chunks(result[position] for result in spooled),
+                    chunk_type,
+                    reset_vector_store("openAIEmbeddings", suffix=suffix),
+                    executor=executor,
+                )
+    ingest_manifest_to_pickle(manifest)
+
+
+def process_file_paths_incremental(max_workers: Optional[int] = INGEST_MAX_WORKERS):
+    """增量入库：只处理新增或内容发生变化的文件，并删除已移除文件的块。
+
+    参数:
+        max_workers (int, 可选): 解析、切分文件和清洗文本的进程数。
+
+    功能:
+        - 按文件内容的MD5哈希与入库清单比较，找出新增、变化和删除的文件。
+        - 只对新增和变化的文件进行解析、切分和嵌入，新块经临时文档块存储逐批入库。
+        - 在向量存储中按块ID删除旧块并写入新块，其余块保持不变，并同步更新按行对齐的向量文件。
+        - 从文档块存储中移除受影响文件的块（按 source_md5）并追加新块，只清洗新块。
+        - 基于更新后的文档块重建BM25索引（对整个存储重新分词，耗时与语料总量成正比），并更新文件名列表和入库清单。
+    """
+    manifest = load_ingest_manifest()
+    if not manifest:
+        process_file_paths(max_workers)
+        return
+
+    current_md5 = {path: file_to_md5(path) for path in FILE_PATH}
+    changed_paths = [
+        path
+        for path in FILE_PATH
+        if path not in manifest or manifest[path]["file_md5"] != current_md5[path]
+    ]
+    removed_paths = [path for path in manifest if path not in current_md5]
+    if not changed_paths and not removed_paths:
+        logger.info("没有新增、变化或删除的文件")
+        return
+
+    stale_entries = [manifest.pop(path) for path in changed_paths + removed_paths if path in manifest]
+    stale_sources = {entry["source_md5"] for entry in stale_entries}
+
+    with tempfile.TemporaryDirectory(dir=DB_DIR) as spool_dir:
+        spooled = process_files(changed_paths, spool_dir, max_workers)
+        for path, (file_name, small_path, medium_path) in zip(changed_paths, spooled):
+            manifest[path] = spooled_manifest_entry(current_md5[path], file_name, small_path, medium_path)
+
+        with text_cleaning_pool(max_workers) as executor:
+            for chunk_type, position in (("small", 1), ("medium", 2)):
+                suffix = f"{chunk_type}_chunks"
+                # 更新向量存储：删除旧块，新块在写入文档块存储时逐批写入
+                vector_store = load_vector_store("openAIEmbeddings", suffix=suffix)
+                stale_ids = [
+                    chunk_id
+                    for entry in stale_entries
+                    for chunk_id in chunk_ids(entry["source_md5"], chunk_type, entry[f"num_{chunk_type}"])
+                ]
+                if stale_ids:
+                    vector_store.delete(ids=stale_ids)
+
+                # 更新文档块存储、向量文件和BM25索引：只读取保留下来的旧块，不加载整个存储。
+                # 已知开销：BM25 的文档频率和平均文档长度依赖全部文档，重建索引时对整个存储重新分词，
+                # 耗时与语料总量成正比，是增量入库中唯一随语料规模增长的计算步骤
+                with ChunkStore.open(f"{DB_DIR}/docs_store_{suffix}") as existing_store:
+                    kept_rows = [
+                        row
+                        for row, source_md5 in enumerate(existing_store.column("source_md5"))
+                        if source_md5 not in stale_sources
+                    ]
+                    chunks_to_stores(
+                        spooled_chunks(result[position] for result in spooled),
+                        chunk_type,
+                        vector_store,
+                        existing_store=existing_store,
+                        kept_rows=kept_rows,
+                        executor=executor,
+                    )
+
+    file_names_to_pickle(
+        [manifest[path]["file_name"] for path in FILE_PATH if manifest[path]["num_small"]],
+        save_name="file_names",
+    )
+    ingest_manifest_to_pickle(manifest)
+    logger.info("更新 %d 个文件，删除 %d 个文件", len(changed_paths), len(removed_paths))
 
 
 if __name__ == "__main__":
-    process_file_paths()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="将 data 目录中的文件写入检索数据库")
+    parser.add_argument("--incremental", action="store_true", help="只处理新增、变化或删除的文件")
+    parser.add_argument("--workers", type=int, default=INGEST_MAX_WORKERS, help="解析和切分文件的进程数")
+    parser.add_argument("--corpus", help="语料编号：读取 CORPORA_DOCS_DIR/<语料编号> 中的文件，写入 CORPORA_DIR/<语料编号>")
+    args = parser.parse_args()
+    if args.corpus:
+        DB_DIR = os.path.join(CORPORA_DIR, args.corpus)
+        FILE_PATH = glob.glob(os.path.join(CORPORA_DOCS_DIR, args.corpus, "*"))
+        os.makedirs(DB_DIR, exist_ok=True)
+    if args.incremental:
+        process_file_paths_incremental(args.workers)
+    else:
+        process_file_paths(args.workers)
@@ -0,0 +1,204 @@
+import re
+import time
+import random
+import sqlite3
+import hashlib
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.schema.embeddings import Embeddings
+
+from config import *
+
+
+class HashEmbeddings(Embeddings):
+    """
+    确定性的本地嵌入：把词项哈希到固定维度并做 L2 归一化，不需要网络和 API Key，
+    相同文本总是得到相同向量，用于测试和离线调试入库流程。
+
+    属性:
+        dim (int): 向量维度。
+        model (str): 模型标识，作为嵌入缓存的命名空间。
+    """
+
+    _token_pattern = re.compile(r"\w+")
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.model = f"hash-{dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in self._token_pattern.findall(text.lower()):
+            digest = hashlib.md5(token.encode("utf-8")).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+@lru_cache(maxsize=None)
+def get_embedding_client(name: str = EMBEDDING_CLIENT) -> Embeddings:
+    """
+    根据名称获取嵌入客户端，入库和检索必须使用同一个客户端。同一进程内每种客户端只创建一次，
+    多个语料和多个检索阶段共享。
+
+    参数:
+        name (str): "openai" 使用 OpenAIEmbeddings，"hash" 使用本地的 HashEmbeddings。
+
+    返回:
+        Embeddings: 嵌入客户端。
+    """
+    if name == "openai":
+        return OpenAIEmbeddings()
+    if name == "hash":
+        return HashEmbeddings()
+    raise ValueError(f"不支持的嵌入客户端 {name}")
+
+
+class EmbeddingCache:
+    """
+    以 (模型, 文本内容哈希) 为键的磁盘嵌入缓存，保存在本地 SQLite 文件中，
+    向量以 float32 字节保存。
+
+    属性:
+        path (str): SQLite 文件路径。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+
+    @staticmethod
+    def key(namespace: str, text: str) -> str:
+        return hashlib.md5(f"{namespace}\n{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """
+        批量读取缓存的向量。
+
+        参数:
+            keys (List[str]): 缓存键。
+
+        返回:
+            Dict[str, List[float]]: 命中的 键 -> 向量。
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                placeholders = ",".join("?" * len(batch))
+                for key, vector in self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ):
+                    found[key] = np.frombuffer(vector, dtype=np.float32).tolist()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]):
+        """批量写入 键 -> 向量。"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [
+                    (key, np.asarray(vector, dtype=np.float32).tobytes())
+                    for key, vector in items.items()
+                ],
+            )
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带磁盘缓存的批量嵌入：文档文本先按内容哈希查缓存，只把没见过的文本分批交给嵌入客户端，
+    多个批次并发请求，失败时指数退避重试。可以直接作为 Chroma 的 embedding_function 使用。
+
+    属性:
+        client (Embeddings): 实际计算嵌入的客户端。
+        cache (EmbeddingCache): 磁盘嵌入缓存。
+        batch_size (int): 每批发送给客户端的文本数。
+        max_concurrency (int): 同时请求的批次数。
+        max_retries (int): 每批失败后的最大重试次数。
+        stats (dict): 最近一次 embed_documents 的文本数、缓存命中数、新嵌入数、耗时和每秒嵌入数。
+    """
+
+    def __init__(
+        self,
+        client: Embeddings,
+        cache: EmbeddingCache,
+        namespace: Optional[str] = None,
+        batch_size: int = EMBEDDING_BATCH_SIZE,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+        backoff: float = 1.0,
+    ):
+        self.client = client
+        self.cache = cache
+        self.namespace = namespace or getattr(client, "model", type(client).__name__)
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.stats = {}
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.client.embed_documents(texts)
+            except Exception:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self.backoff * 2**attempt * (1 + random.random()))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        start = time.perf_counter()
+        keys = [self.cache.key(self.namespace, text) for text in texts]
+        vectors = self.cache.get_many(list(dict.fromkeys(keys)))
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        missing_keys = list(missing)
+        batches = [
+            missing_keys[i : i + self.batch_size]
+            for i in range(0, len(missing_keys), self.batch_size)
+        ]
+        with ThreadPoolExecutor(max_workers=max(1, self.max_concurrency)) as executor:
+            futures = {
+                executor.submit(self._embed_batch, [missing[key] for key in batch]): batch
+                for batch in batches
+            }
+            for future in as_completed(futures):
+                # 每完成一批就写入缓存，中断后重新运行时不会重复嵌入已完成的批次
+                embedded = {
+                    key: np.asarray(vector, dtype=np.float32).tolist()
+                    for key, vector in zip(futures[future], future.result())
+                }
+                self.cache.put_many(embedded)
+                vectors.update(embedded)
+
+        elapsed = time.perf_counter() - start
+        self.stats = {
+            "texts": len(texts),
+            "cached": len(texts) - sum(1 for key in keys if key in missing),
+            "embedded": len(missing),
+            "seconds": elapsed,
+            "embeddings_per_second": len(missing) / elapsed if missing and elapsed else 0.0,
+        }
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.client.embed_query(text)
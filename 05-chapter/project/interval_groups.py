@@ -0,0 +1,323 @@
+import heapq
+import math
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, deque
+from typing import Deque, Dict, List, Optional, Sequence, Tuple
+
+Interval = Tuple[int, int]
+
+_REMOVED = float("-inf")
+
+
+class _MaxTree:
+    """按排序位置存放数值的最大值线段树，用于找出一段排序位置中所有不小于阈值的值。"""
+
+    def __init__(self, values: Sequence[int]):
+        size = 1
+        while size < len(values):
+            size *= 2
+        self.size = size
+        self.tree = [_REMOVED] * (2 * size)
+        self.tree[size : size + len(values)] = values
+        for node in range(size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def set(self, index: int, value) -> None:
+        tree = self.tree
+        node = index + self.size
+        tree[node] = value
+        node //= 2
+        while node:
+            left, right = tree[2 * node], tree[2 * node + 1]
+            best = left if left > right else right
+            if tree[node] == best:
+                # 上层的最大值不受影响
+                break
+            tree[node] = best
+            node //= 2
+
+    def find(self, lower: int, upper: int, threshold) -> List[int]:
+        # 先把 [lower, upper) 分解成 O(log n) 个子树，再只下探最大值不小于阈值的子树，
+        # 代价与找到的元素数成正比（每个乘以树高）
+        tree, size = self.tree, self.size
+        stack = []
+        lower, upper = lower + size, upper + size
+        while lower < upper:
+            if lower & 1:
+                stack.append(lower)
+                lower += 1
+            if upper & 1:
+                upper -= 1
+                stack.append(upper)
+            lower //= 2
+            upper //= 2
+        found = []
+        while stack:
+            node = stack.pop()
+            if tree[node] < threshold:
+                continue
+            if node >= size:
+                found.append(node - size)
+            else:
+                stack.append(2 * node)
+                stack.append(2 * node + 1)
+        return found
+
+
+class _Remaining:
+    """
+    一个连通分量中尚未分组的区间。区间各按下界和上界排好序建树，树中记录区间在分量中的位置，
+    取出一个区间只需把它在每棵树里的叶子置为已移除，不需要重新扫描剩余列表。
+    """
+
+    def __init__(self, intervals: Sequence[Interval]):
+        self.intervals = intervals
+        self.alive = [True] * len(intervals)
+        self.next_seed = 0
+        # 相同区间在输入中的位置，旧实现的 list.remove 总是删掉其中最靠前的一个
+        self.slots: Dict[Interval, Deque[int]] = defaultdict(deque)
+        for position, interval in enumerate(intervals):
+            self.slots[interval].append(position)
+
+        by_start = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+        by_end = sorted(range(len(intervals)), key=lambda i: intervals[i][1])
+        self.starts = [intervals[i][0] for i in by_start]
+        self.ends = [intervals[i][1] for i in by_end]
+        self.start_rank = [0] * len(intervals)
+        self.end_rank = [0] * len(intervals)
+        for rank, position in enumerate(by_start):
+            self.start_rank[position] = rank
+        for rank, position in enumerate(by_end):
+            self.end_rank[position] = rank
+        self.position_by_start = _MaxTree(by_start)
+        self.end_by_start = _MaxTree([intervals[i][1] for i in by_start])
+        self.position_by_end = _MaxTree(by_end)
+
+    def _set(self, position: int, alive: bool) -> None:
+        self.alive[position] = alive
+        start_rank, end_rank = self.start_rank[position], self.end_rank[position]
+        self.position_by_start.set(start_rank, position if alive else _REMOVED)
+        self.end_by_start.set(start_rank, self.intervals[position][1] if alive else _REMOVED)
+        self.position_by_end.set(end_rank, position if alive else _REMOVED)
+
+    def _take(self, tree: _MaxTree, ranks: List[int]) -> List[int]:
+        positions = [tree.tree[tree.size + rank] for rank in ranks]
+        for position in positions:
+            self._set(position, False)
+        return positions
+
+    def pop_seed(self) -> Optional[int]:
+        """取出输入位置最靠前的剩余区间，没有剩余区间时返回None。"""
+        while self.next_seed < len(self.alive) and not self.alive[self.next_seed]:
+            self.next_seed += 1
+        if self.next_seed == len(self.alive):
+            return None
+        seed = self.next_seed
+        self.slots[self.intervals[seed]].popleft()
+        self._set(seed, False)
+        return seed
+
+    def join(self, position: int) -> None:
+        """
+        记录 position 处的区间入组。旧实现从剩余列表中删除第一个相等的区间：若之前跳过的相同区间
+        仍在剩余中，出组的是那一个，position 留给之后的组。
+        """
+        first = self.slots[self.intervals[position]].popleft()
+        if first != position:
+            self._set(first, False)
+            self._set(position, True)
+
+    def overlapping(self, lower: int, upper: int) -> List[int]:
+        """取出与 [lower, upper] 重叠的全部区间，即下界不超过 upper、上界不小于 lower 的区间。"""
+        ranks = self.end_by_start.find(0, bisect_right(self.starts, upper), lower)
+        return self._take(self.position_by_start, ranks)
+
+    def extend_upper(self, upper: int, new_upper: int, after: int) -> List[int]:
+        """并集上界从 upper 扩到 new_upper 时，取出下界落在 (upper, new_upper] 且位于 after 之后的区间。"""
+        ranks = self.position_by_start.find(
+            bisect_right(self.starts, upper), bisect_right(self.starts, new_upper), after + 1
+        )
+        return self._take(self.position_by_start, ranks)
+
+    def extend_lower(self, lower: int, new_lower: int, after: int) -> List[int]:
+        """并集下界从 lower 扩到 new_lower 时，取出上界落在 [new_lower, lower) 且位于 after 之后的区间。"""
+        ranks = self.position_by_end.find(
+            bisect_left(self.ends, new_lower), bisect_left(self.ends, lower), after + 1
+        )
+        return self._take(self.position_by_end, ranks)
+
+
+def _components(intervals: Sequence[Interval]) -> List[List[int]]:
+    """
+    按下界排序后一次扫描，把相互重叠（可传递）的区间分到同一个连通分量。
+
+    返回:
+        List[List[int]]: 每个分量内区间在输入中的位置，按位置升序排列；空区间单独成组。
+    """
+    order = sorted(range(len(intervals)), key=lambda i: intervals[i][0])
+    components = []
+    current, upper = [], None
+    for position in order:
+        start, end = intervals[position]
+        if start > end:
+            components.append([position])
+            continue
+        if current and start <= upper:
+            current.append(position)
+            upper = max(upper, end)
+        else:
+            if current:
+                components.append(current)
+            current, upper = [position], end
+    if current:
+        components.append(current)
+    return [sorted(component) for component in components]
+
+
+class _Group:
+    """
+    按入组顺序记录的一组区间。组内区间通过重叠相连，并集是连续区间 [lower, upper]，
+    与组内某个区间重叠等价于与并集重叠。
+    """
+
+    def __init__(self, seed: Interval):
+        self.members = [seed]
+        self.subset_interval: Optional[Interval] = None
+        self.lower, self.upper = seed
+        # 每加入一个区间后前缀并集的上下界，上界单调不减、下界单调不增
+        self._uppers, self._negated_lowers = [self.upper], [-self.lower]
+
+    def overlaps(self, interval: Interval) -> bool:
+        return interval[0] <= self.upper and self.lower <= interval[1]
+
+    def add(self, interval: Interval) -> None:
+        """
+        加入一个与并集重叠的区间。旧实现按入组顺序找第一个与之重叠的组内区间，判断是否包含它；
+        这个区间就是前缀并集第一次与之重叠时加入的区间，用二分查找定位。
+        """
+        start, end = interval
+        first = max(bisect_left(self._uppers, start), bisect_left(self._negated_lowers, -end))
+        s, e = self.members[first]
+        if s <= start and end <= e:
+            self.subset_interval = interval
+        self.members.append(interval)
+        self.lower, self.upper = min(self.lower, start), max(self.upper, end)
+        self._uppers.append(self.upper)
+        self._negated_lowers.append(-self.lower)
+
+
+def _scan_groups(intervals: Sequence[Interval]) -> List[Tuple[int, _Group]]:
+    # 小分量直接按输入顺序逐轮扫描，省去建树的开销
+    slots: Dict[Interval, Deque[int]] = defaultdict(deque)
+    for position, interval in enumerate(intervals):
+        slots[interval].append(position)
+    groups, remaining = [], list(range(len(intervals)))
+    while remaining:
+        seed = remaining[0]
+        slots[intervals[seed]].popleft()
+        group, rest, left = _Group(intervals[seed]), [], set()
+        for position in remaining[1:]:
+            interval = intervals[position]
+            if not group.overlaps(interval):
+                rest.append(position)
+                continue
+            group.add(interval)
+            first = slots[interval].popleft()
+            if first != position:
+                left.add(first)
+                rest.append(position)
+        groups.append((seed, group))
+        remaining = [position for position in rest if position not in left]
+    return groups
+
+
+def _swept_groups(intervals: Sequence[Interval]) -> List[Tuple[int, _Group]]:
+    remaining = _Remaining(intervals)
+    groups = []
+    while True:
+        seed = remaining.pop_seed()
+        if seed is None:
+            return groups
+        group = _Group(intervals[seed])
+        pending = remaining.overlapping(group.lower, group.upper)
+        heapq.heapify(pending)
+        while pending:
+            position = heapq.heappop(pending)
+            lower, upper = group.lower, group.upper
+            group.add(intervals[position])
+            remaining.join(position)
+            if group.upper > upper:
+                for found in remaining.extend_upper(upper, group.upper, position):
+                    heapq.heappush(pending, found)
+            if group.lower < lower:
+                for found in remaining.extend_lower(lower, group.lower, position):
+                    heapq.heappush(pending, found)
+        groups.append((seed, group))
+
+
+# 区间数不超过该值的分量逐轮扫描，更大的分量用线段树
+_SCAN_LIMIT = 32
+
+
+def _greedy_groups(intervals: Sequence[Interval]) -> List[Tuple[int, _Group]]:
+    """
+    在一个连通分量内按输入顺序分组：每组以第一个未分组的区间开始，顺序扫描其余区间，
+    与组内任一区间重叠即加入。
+
+    并集只会扩大，与它重叠的区间之后一直重叠。因此大分量不必每组都扫描全部剩余区间：
+    并集每扩大一次，就从按下界、上界排序的树中取出新进入并集范围、且位于当前扫描位置之后的区间，
+    放进按位置排序的堆，堆中的区间按位置顺序依次入组；位于扫描位置之前的区间留给后面的组，
+    本轮不再访问。每个区间只在入组时从树中取出一次，总耗时 O(n log n)。
+
+    参数:
+        intervals (Sequence[Interval]): 一个连通分量中的非空区间，按输入顺序排列。
+
+    返回:
+        List[Tuple[int, _Group]]: 按首个区间位置排列的 (首个区间在分量中的位置, 组)。
+    """
+    if len(intervals) == 1:
+        return [(0, _Group(intervals[0]))]
+    if len(intervals) <= _SCAN_LIMIT:
+        return _scan_groups(intervals)
+    return _swept_groups(intervals)
+
+
+def _group_centroid(group: _Group) -> List[int]:
+    subset_interval, group = group.subset_interval, group.members
+    if subset_interval:
+        return [math.ceil((subset_interval[0] + subset_interval[1]) / 2)]
+    if len(group) > 2:
+        # 前两个区间交集的最大值，到最后两个区间交集的最小值
+        first_overlap = min(group[0][1], group[1][1])
+        last_lower = max(group[-1][0], group[-2][0])
+        last_upper = min(group[-1][1], group[-2][1])
+        last_overlap = last_lower if last_lower <= last_upper else first_overlap
+        step = 1 if first_overlap <= last_overlap else -1
+        return list(range(first_overlap, last_overlap + step, step))
+    return [round(sum(math.ceil((s + e) / 2) for s, e in group) / len(group))]
+
+
+def window_centroids(intervals: Sequence[Interval]) -> List[int]:
+    """
+    把窗口区间分组并计算每组的中心窗口编号。
+
+    先按下界排序扫描得到连通分量，再在每个分量内按检索顺序分组。分组、中心和输出顺序与逐对比较
+    set(range(s, e + 1)) 的旧实现完全一致，但只对区间上下界做算术比较：每个区间只在入组时从树中
+    取出一次，总耗时 O(n log n)。
+
+    参数:
+        intervals (Sequence[Interval]): 按检索排名排列的 (下界, 上界) 闭区间。
+
+    返回:
+        List[int]: 各组中心窗口编号，按每组第一个区间在输入中的位置排列。
+    """
+    groups = []
+    for positions in _components(intervals):
+        for seed, group in _greedy_groups([intervals[p] for p in positions]):
+            groups.append((positions[seed], group))
+    groups.sort(key=lambda item: item[0])
+
+    centroids = []
+    for _, group in groups:
+        centroids.extend(_group_centroid(group))
+    return centroids
@@ -0,0 +1,283 @@
+import json
+import time
+import pickle
+import logging
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+from langchain.vectorstores.chroma import Chroma
+
+from retrivers import MyRetriever
+from chunk_store import ChunkStore
+from embedding_pipeline import get_embedding_client
+from vector_index import QueryVectorCache, VectorIndex
+from retrieval_cache import RetrievalCache, cache_version, corpus_version
+from utils import DocIndexer
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+def load_embedding(store_name, embedding, suffix, path):
+    """加载chroma嵌入"""
+    vector_store = Chroma(
+        persist_directory=f"{path}/chroma_{store_name}_{suffix}",
+        embedding_function=embedding,
+    )
+    return vector_store
+
+
+def load_pickle(prefix, suffix, path):
+    """从pickle文件加载数据"""
+    with open(f"{path}/{prefix}_{suffix}.pkl", "rb") as file:
+        return pickle.load(file)
+
+
+@lru_cache(maxsize=None)
+def get_query_vectors(name: str = EMBEDDING_CLIENT) -> QueryVectorCache:
+    """
+    获取进程级共享的查询向量缓存。查询向量只取决于查询和嵌入客户端，与语料无关，
+    所有语料的向量索引共用一份，同一查询只嵌入一次。
+
+    参数:
+        name (str): 嵌入客户端名称。
+
+    返回:
+        QueryVectorCache: 查询向量缓存。
+    """
+    return QueryVectorCache(get_embedding_client(name))
+
+
+def load_doc_indexer(documents, suffix: str, version: str, path: str = DB_DIR) -> DocIndexer:
+    """
+    读取保存的 DocIndexer，不存在或已失效时重新构建并保存，下次启动直接读取。
+
+    参数:
+        documents (ChunkStore): 索引对应的文档块存储。
+        suffix (str): 文件名后缀，例如 "small_chunks"。
+        version (str): 当前的语料版本。
+        path (str): 数据库目录。
+
+    返回:
+        DocIndexer: 文档索引。
+    """
+    file_path = f"{path}/doc_indexer_{suffix}.pkl"
+    docs_index = DocIndexer.load(file_path, documents, version)
+    if docs_index is None:
+        docs_index = DocIndexer(documents)
+        docs_index.save(file_path, version)
+    return docs_index
+
+
+class ServiceLoader:
+    """
+    在后台线程中加载问答服务需要的数据库和索引，并记录各阶段耗时。
+
+    相互独立的数据（两个 Chroma 库、文档块存储、BM25 索引、向量、文件名和入库清单）并行加载，
+    DocIndexer 在文档块存储打开后读取保存的结构或在后台构建，全部完成后创建检索器。
+
+    状态依次为 starting、loading，最后为 ready 或 failed，可以通过 status 或健康检查端口查询。
+
+    属性:
+        llm: 语言模型，传给检索器。
+        path (str): 数据库目录。
+        max_workers (int): 并行加载的线程数。
+        state (str): 当前状态。
+        phases (Dict[str, float]): 已完成阶段的耗时（秒），total 为总耗时。
+        retriever (MyRetriever): 加载完成后的检索器。
+        file_names (list): 入库的文件名。
+        retrieval_cache (RetrievalCache): 检索结果缓存，未启用时为 None。
+    """
+
+    def __init__(self, llm, path: str = DB_DIR, max_workers: int = LOADER_MAX_WORKERS):
+        self.llm = llm
+        self.path = path
+        self.max_workers = max_workers
+        self.state = "starting"
+        self.phases: Dict[str, float] = {}
+        self.error: Optional[BaseException] = None
+        self.retriever = None
+        self.file_names = None
+        self.retrieval_cache = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def retrieval_settings(self) -> dict:
+        """返回影响检索结果的配置，用于计算检索结果缓存的版本。"""
+        return {
+            "model": getattr(self.llm, "model_name", type(self.llm).__name__),
+            "embedding_client": EMBEDDING_CLIENT,
+            "first_retrieval_k": FIRST_RETRIEVAL_K,
+            "second_retrieval_k": SECOND_RETRIEVAL_K,
+            "num_windows": NUM_WINDOWS,
+            "retriever_weights": RETRIEVER_WEIGHTS,
+            "reranker": RERANKER,
+            "rerank_lexical_weight": RERANK_LEXICAL_WEIGHT,
+            "rerank_max_files": RERANK_MAX_FILES,
+            "rerank_min_score_ratio": RERANK_MIN_SCORE_RATIO,
+            "max_llm_context": MAX_LLM_CONTEXT,
+            "base_chunk_size": BASE_CHUNK_SIZE,
+            "chunk_scale": CHUNK_SCALE,
+        }
+
+    def start(self) -> "ServiceLoader":
+        """在后台线程中开始加载，立即返回。"""
+        threading.Thread(target=self._load, name="service-loader", daemon=True).start()
+        return self
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待加载结束。
+
+        参数:
+            timeout (float, 可选): 最长等待时间（秒），为 None 时一直等待。
+
+        返回:
+            bool: 是否已就绪；加载失败时抛出 RuntimeError。
+        """
+        self._done.wait(timeout)
+        if self.state == "failed":
+            raise RuntimeError(f"加载失败: {self.error}") from self.error
+        return self.state == "ready"
+
+    def status(self) -> Dict[str, Any]:
+        """返回当前状态、已完成阶段的耗时和错误信息。"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "phases": dict(self.phases),
+                "error": None if self.error is None else str(self.error),
+            }
+
+    def _timed(self, name: str, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        with self._lock:
+            self.phases[name] = time.perf_counter() - start
+        return result
+
+    def _load(self):
+        start = time.perf_counter()
+        self.state = "loading"
+        try:
+            self._load_resources()
+            with self._lock:
+                self.phases["total"] = time.perf_counter() - start
+            self.state = "ready"
+            logger.info("service ready, startup phases: %s", self.phases)
+        except BaseException as e:
+            logger.exception("service loading failed")
+            self.error = e
+            self.state = "failed"
+        finally:
+            self._done.set()
+
+    def _load_resources(self):
+        path = self.path
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+
+            def submit(name, func, *args, **kwargs):
+                return executor.submit(self._timed, name, func, *args, **kwargs)
+
+            chroma_small = submit(
+                "chroma_small", load_embedding, "openAIEmbeddings", get_embedding_client(), "small_chunks", path
+            )
+            chroma_medium = submit(
+                "chroma_medium", load_embedding, "openAIEmbeddings", get_embedding_client(), "medium_chunks", path
+            )
+            store_small = submit("chunk_store_small", ChunkStore.open, f"{path}/docs_store_small_chunks")
+            store_medium = submit("chunk_store_medium", ChunkStore.open, f"{path}/docs_store_medium_chunks")
+            bm25_small = submit("bm25_small", load_pickle, "bm25_pickle", "small_chunks", path)
+            bm25_medium = submit("bm25_medium", load_pickle, "bm25_pickle", "medium_chunks", path)
+            query_vectors = get_query_vectors()
+            vectors_small = submit(
+                "vectors_small", VectorIndex.load, f"{path}/vectors_small_chunks.npy", query_vectors
+            )
+            vectors_medium = submit(
+                "vectors_medium", VectorIndex.load, f"{path}/vectors_medium_chunks.npy", query_vectors
+            )
+            file_names = submit("file_names", load_pickle, "file", "names", path)
+            manifest = submit("manifest", load_pickle, "ingest", "manifest", path)
+
+            # DocIndexer 依赖文档块存储和语料版本，其余数据仍在并行加载
+            version = corpus_version(manifest.result())
+            index_small = submit(
+                "doc_indexer_small", load_doc_indexer, store_small.result(), "small_chunks", version, path
+            )
+            index_medium = submit(
+                "doc_indexer_medium", load_doc_indexer, store_medium.result(), "medium_chunks", version, path
+            )
+
+            if RETRIEVAL_CACHE_SIZE:
+                self.retrieval_cache = self._timed(
+                    "retrieval_cache",
+                    RetrievalCache,
+                    path=f"{path}/retrieval_cache.sqlite",
+                    corpus_version=cache_version(version, self.retrieval_settings()),
+                    max_entries=RETRIEVAL_CACHE_SIZE,
+                    ttl=RETRIEVAL_CACHE_TTL,
+                    embedding=get_embedding_client() if RETRIEVAL_CACHE_SIMILARITY else None,
+                    similarity_threshold=RETRIEVAL_CACHE_SIMILARITY or 1.0,
+                )
+            self.file_names = file_names.result()
+            self.retriever = self._timed(
+                "retriever",
+                MyRetriever,
+                llm=self.llm,
+                embedding_chunks_small=chroma_small.result(),
+                embedding_chunks_medium=chroma_medium.result(),
+                docs_chunks_small=store_small.result(),
+                docs_chunks_medium=store_medium.result(),
+                first_retrieval_k=FIRST_RETRIEVAL_K,
+                second_retrieval_k=SECOND_RETRIEVAL_K,
+                num_windows=NUM_WINDOWS,
+                retriever_weights=RETRIEVER_WEIGHTS,
+                bm25_index_small=bm25_small.result(),
+                bm25_index_medium=bm25_medium.result(),
+                cache=self.retrieval_cache,
+                vector_index_small=vectors_small.result(),
+                vector_index_medium=vectors_medium.result(),
+                docs_index_small=index_small.result(),
+                docs_index_medium=index_medium.result(),
+            )
+
+
+def serve_health(loader: ServiceLoader, port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    在后台线程中启动健康检查端口。
+
+    GET /healthz 在进程存活时返回 200；GET /readyz 在加载完成后返回 200，加载中返回 503，
+    响应体均为 ServiceLoader.status() 的 JSON。
+
+    参数:
+        loader (ServiceLoader): 服务加载器。
+        port (int): 端口。
+        host (str): 监听地址。
+
+    返回:
+        ThreadingHTTPServer: 已启动的服务器，可调用 shutdown 停止。
+    """
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/healthz", "/readyz"):
+                self.send_error(404)
+                return
+            status = loader.status()
+            code = 200 if self.path == "/healthz" or status["state"] == "ready" else 503
+            body = json.dumps(status).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    server = ThreadingHTTPServer((host, port), HealthHandler)
+    threading.Thread(target=server.serve_forever, name="health-server", daemon=True).start()
+    return server
@@ -1,15 +1,12 @@
 import re
 import time
 import logging
-import pickle
 
 from langchain.chat_models import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
 from langchain.memory import ConversationTokenBufferMemory
-from langchain.vectorstores.chroma import Chroma
 from conversation import ConversationRetrievalChain
 
-from retrivers import MyRetriever
+from loader import ServiceLoader, serve_health
 from config import *
 
 # 设置日志记录器
@@ -17,55 +14,15 @@ logger = logging.getLogger(__name__)
 # 初始化语言模型
 llm = ChatOpenAI(model=MODEL_NAME, temperature=0, max_tokens=1200)
 
-def load_embedding(store_name, embedding, suffix, path):
-    """加载chroma嵌入"""
-    vector_store = Chroma(
-        persist_directory=f"{path}/chroma_{store_name}_{suffix}",
-        embedding_function=embedding,
-    )
-    return vector_store
+# 在后台并行加载检索数据库和索引，加载期间健康检查端口即可报告就绪状态
+loader = ServiceLoader(llm).start()
+health_server = serve_health(loader, HEALTH_PORT) if HEALTH_PORT else None
+loader.wait()
+print(f"启动耗时: {loader.phases}")
 
-# 加载检索数据库
-db_embedding_chunks_small = load_embedding(
-    store_name="openAIEmbeddings",
-    embedding=OpenAIEmbeddings(),
-    suffix="chunks_small",
-    path=DB_DIR,
-)
-db_embedding_chunks_medium = load_embedding(
-    store_name="openAIEmbeddings",
-    embedding=OpenAIEmbeddings(),
-    suffix="chunks_medium",
-    path=DB_DIR,
-)
-
-def load_pickle(prefix, suffix, path):
-    """从pickle文件加载数据"""
-    with open(f"{path}/{prefix}_{suffix}.pkl", "rb") as file:
-        return pickle.load(file)
-
-# 加载文档块
-db_docs_chunks_small = load_pickle(
-    prefix="docs_pickle", suffix="small_chunks", path=DB_DIR
-)
-db_docs_chunks_medium = load_pickle(
-    prefix="docs_pickle", suffix="medium_chunks", path=DB_DIR
-)
-# 加载文件名
-file_names = load_pickle(prefix="file", suffix="names", path=DB_DIR)
-
-# 初始化检索器
-my_retriever = MyRetriever(
-    llm=llm,
-    embedding_chunks_small=db_embedding_chunks_small,
-    embedding_chunks_medium=db_embedding_chunks_medium,
-    docs_chunks_small=db_docs_chunks_small,
-    docs_chunks_medium=db_docs_chunks_medium,
-    first_retrieval_k=FIRST_RETRIEVAL_K,
-    second_retrieval_k=SECOND_RETRIEVAL_K,
-    num_windows=NUM_WINDOWS,
-    retriever_weights=RETRIEVER_WEIGHTS,
-)
+my_retriever = loader.retriever
+file_names = loader.file_names
+retrieval_cache = loader.retrieval_cache
 
 # 初始化内存
 memory = ConversationTokenBufferMemory(
@@ -83,6 +40,7 @@ qa = ConversationRetrievalChain.from_llm(
     my_retriever,
     file_names=file_names,
     memory=memory,
+    max_concurrency=MAX_RETRIEVAL_CONCURRENCY,
     return_source_documents=False,
     return_generated_question=False,
 )
@@ -99,4 +57,6 @@ if __name__ == "__main__":
         print(f"AI:{resp['answer']}")
         # 输出处理时间
         print(f"耗时: {time.time() - start_time}")
+        if retrieval_cache is not None:
+            print(f"检索缓存: {retrieval_cache.stats()}")
         print("=" * 66)
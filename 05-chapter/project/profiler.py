@@ -0,0 +1,207 @@
+"""
+检索流程的分阶段计时与计数。
+
+代码中用 stage("阶段名", 计数=值) 包住一个阶段，阶段可以嵌套，嵌套关系通过 contextvars 传递，
+asyncio 并发的子问题各自记录在正确的父阶段下。在 profile() 的范围内运行时，阶段记录保存到
+当前的 Profile；通过 add_stage_listener 注册的回调会收到每一条阶段记录。两者都没有时只有一次计时的开销。
+
+回放查询文件并打印各阶段耗时分解和分位数：
+
+    python profiler.py queries.txt --repeat 3
+"""
+
+import time
+import json
+import logging
+import argparse
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import *
+
+logger = logging.getLogger(__name__)
+
+_current_profile = contextvars.ContextVar("retrieval_profile", default=None)
+_current_path = contextvars.ContextVar("retrieval_stage_path", default=())
+_listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+
+class Profile:
+    """
+    一次运行（例如一个问题）中各阶段的记录。
+
+    属性:
+        records (List[Dict[str, Any]]): 按结束顺序排列的阶段记录，每条包含 path（以 / 连接的阶段路径）、
+            seconds（耗时）和 counters（计数）。
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def add(self, record: Dict[str, Any]):
+        self.records.append(record)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """
+        按阶段路径汇总耗时和计数。
+
+        返回:
+            Dict[str, Dict[str, Any]]: 阶段路径 -> {"seconds": 总耗时, "calls": 次数, 以及各计数之和}。
+        """
+        summary = {}
+        for record in self.records:
+            item = summary.setdefault(record["path"], {"seconds": 0.0, "calls": 0})
+            item["seconds"] += record["seconds"]
+            item["calls"] += 1
+            for key, value in record["counters"].items():
+                item[key] = item.get(key, 0) + value
+        return summary
+
+
+def add_stage_listener(callback: Callable[[Dict[str, Any]], None]):
+    """注册阶段回调，每个阶段结束时以阶段记录调用。"""
+    _listeners.append(callback)
+
+
+def remove_stage_listener(callback: Callable[[Dict[str, Any]], None]):
+    """取消注册阶段回调。"""
+    _listeners.remove(callback)
+
+
+@contextmanager
+def profile():
+    """
+    在范围内收集阶段记录。
+
+    返回:
+        Profile: 收集到的阶段记录。
+    """
+    current = Profile()
+    token = _current_profile.set(current)
+    try:
+        yield current
+    finally:
+        _current_profile.reset(token)
+
+
+@contextmanager
+def stage(name: str, **counters):
+    """
+    计时一个阶段。
+
+    参数:
+        name (str): 阶段名，嵌套时路径为 父阶段/阶段名。
+        counters: 阶段开始时已知的计数（例如输入候选数），阶段内还可以向返回的字典中添加计数。
+
+    返回:
+        Dict[str, Any]: 计数字典。
+    """
+    path = _current_path.get() + (name,)
+    token = _current_path.set(path)
+    start = time.perf_counter()
+    try:
+        yield counters
+    finally:
+        seconds = time.perf_counter() - start
+        _current_path.reset(token)
+        current = _current_profile.get()
+        if current is not None or _listeners:
+            record = {"path": "/".join(path), "seconds": seconds, "counters": counters}
+            if current is not None:
+                current.add(record)
+            for callback in _listeners:
+                callback(record)
+
+
+def run_with_context(func: Callable, *args):
+    """
+    返回在当前上下文副本中调用 func 的函数，用于提交到线程池，使线程中的阶段记录到调用方的 Profile 和父阶段下。
+    """
+    context = contextvars.copy_context()
+    return lambda: context.run(func, *args)
+
+
+def format_breakdown(summaries: List[Dict[str, Dict[str, Any]]]) -> str:
+    """
+    把多次运行的汇总格式化为按阶段路径缩进的耗时分解，条形长度表示占总耗时的比例。
+    同一阶段的多次调用耗时相加，并发执行的子阶段（例如多个子问题的检索）占比可能超过 100%。
+
+    参数:
+        summaries (List[Dict[str, Dict[str, Any]]]): 每次运行的 Profile.summary()。
+
+    返回:
+        str: 每行一个阶段：平均耗时、占比、p50/p95/最大耗时和平均计数。
+    """
+    paths = sorted({path for summary in summaries for path in summary})
+    roots = [path for path in paths if "/" not in path]
+    total = sum(np.mean([summary.get(path, {}).get("seconds", 0.0) for summary in summaries]) for path in roots)
+    lines = [f"{'阶段':<48}{'平均ms':>9}{'占比':>7}  {'p50':>8}{'p95':>8}{'max':>8}  计数"]
+    for path in paths:
+        seconds = np.asarray([summary.get(path, {}).get("seconds", 0.0) for summary in summaries]) * 1000
+        share = seconds.mean() / (total * 1000) if total else 0.0
+        counters = {}
+        for summary in summaries:
+            for key, value in summary.get(path, {}).items():
+                if key not in ("seconds", "calls"):
+                    counters[key] = counters.get(key, 0) + value / len(summaries)
+        calls = np.mean([summary.get(path, {}).get("calls", 0) for summary in summaries])
+        name = "  " * path.count("/") + path.split("/")[-1]
+        bar = "#" * min(20, int(round(share * 20)))
+        lines.append(
+            f"{name:<48}{seconds.mean():>9.1f}{share:>7.0%}  "
+            f"{np.percentile(seconds, 50):>8.1f}{np.percentile(seconds, 95):>8.1f}{seconds.max():>8.1f}  "
+            f"{bar:<20} calls={calls:.1f} "
+            + " ".join(f"{key}={value:.1f}" for key, value in counters.items())
+        )
+    return "\n".join(lines)
+
+
+def read_queries(path: str) -> List[str]:
+    """读取查询文件：每行一个问题，或每行一个包含 question 的 JSON 对象。"""
+    queries = []
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            line = line.strip()
+            if not line:
+                continue
+            queries.append(json.loads(line)["question"] if line.startswith("{") else line)
+    return queries
+
+
+def replay(queries: List[str], repeat: int = 1, chain: Optional[Any] = None) -> List[Dict[str, Dict[str, Any]]]:
+    """
+    逐个回放查询并记录各阶段，每个查询都不带历史对话。
+
+    参数:
+        queries (List[str]): 查询。
+        repeat (int): 每个查询回放的次数。
+        chain (ConversationRetrievalChain, 可选): 问答链，为 None 时使用 main 中加载的数据库新建不带记忆的链。
+
+    返回:
+        List[Dict[str, Dict[str, Any]]]: 每次回放的 Profile.summary()。
+    """
+    if chain is None:
+        from conversation import ConversationRetrievalChain
+        from main import llm, my_retriever, file_names
+
+        chain = ConversationRetrievalChain.from_llm(
+            llm, my_retriever, file_names=file_names, max_concurrency=MAX_RETRIEVAL_CONCURRENCY
+        )
+    summaries = []
+    for _ in range(repeat):
+        for query in queries:
+            with profile() as current:
+                chain({"question": query, "chat_history": []})
+            summaries.append(current.summary())
+    return summaries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回放查询并统计检索流程各阶段的耗时")
+    parser.add_argument("queries", help="查询文件，每行一个问题或一个包含 question 的 JSON 对象")
+    parser.add_argument("--repeat", type=int, default=1, help="每个查询回放的次数")
+    args = parser.parse_args()
+    print(format_breakdown(replay(read_queries(args.queries), args.repeat)))
@@ -0,0 +1,84 @@
+import heapq
+from operator import itemgetter
+from typing import Hashable, List, Optional, Sequence, Tuple
+
+from langchain.schema import Document
+
+
+def weighted_reciprocal_rank_fusion(
+    rank_lists: Sequence[Sequence[Hashable]],
+    weights: Sequence[float],
+    c: int = 60,
+    k: Optional[int] = None,
+) -> List[Tuple[Hashable, float]]:
+    """
+    对任意数量检索器的排序结果做加权倒数排名融合（RRF）。
+    详见 https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+
+    参数:
+        rank_lists (Sequence[Sequence[Hashable]]): 每个检索器按排名排列的块ID，
+            可以是列表、元组或 numpy 数组（例如 BM25Index 的行号），不会被复制。
+        weights (Sequence[float]): 每个检索器的权重。
+        c (int): RRF 平滑常数。
+        k (int, 可选): 只返回得分最高的 k 个结果，使用堆做部分选择；为 None 时返回全部。
+
+    返回:
+        List[Tuple[Hashable, float]]: 按得分降序排列的 (块ID, 得分)，得分相同时按首次出现的顺序排列。
+    """
+    if len(rank_lists) != len(weights):
+        raise ValueError("Number of rank lists must be equal to the number of weights.")
+
+    scores = {}
+    for ranked_ids, weight in zip(rank_lists, weights):
+        for rank, chunk_id in enumerate(ranked_ids, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + weight / (rank + c)
+
+    if k is None:
+        return sorted(scores.items(), key=itemgetter(1), reverse=True)
+    return heapq.nlargest(k, scores.items(), key=itemgetter(1))
+
+
+def fuse_documents(
+    doc_lists: Sequence[Sequence[Document]],
+    weights: Sequence[float],
+    c: int = 60,
+    k: Optional[int] = None,
+    id_key: str = "page_content_md5",
+) -> List[Tuple[Document, float]]:
+    """
+    按块ID融合多个检索器返回的文档，不修改检索器返回的 Document 对象。
+
+    参数:
+        doc_lists (Sequence[Sequence[Document]]): 每个检索器按排名排列的文档。
+        weights (Sequence[float]): 每个检索器的权重。
+        c (int): RRF 平滑常数。
+        k (int, 可选): 只返回得分最高的 k 个结果。
+        id_key (str): 作为块ID的元数据键。
+
+    返回:
+        List[Tuple[Document, float]]: (文档, 得分) 列表。返回的是新的 Document，page_content 为
+            元数据中保存的原始文本，元数据中增加 rrf_score。
+    """
+    representatives = {}
+    rank_lists = []
+    for doc_list in doc_lists:
+        ranked_ids = []
+        for doc in doc_list:
+            chunk_id = doc.metadata[id_key]
+            representatives.setdefault(chunk_id, doc)
+            ranked_ids.append(chunk_id)
+        rank_lists.append(ranked_ids)
+
+    fused = []
+    for chunk_id, score in weighted_reciprocal_rank_fusion(rank_lists, weights, c=c, k=k):
+        doc = representatives[chunk_id]
+        fused.append(
+            (
+                Document(
+                    page_content=doc.metadata["page_content"],
+                    metadata={**doc.metadata, "rrf_score": score},
+                ),
+                score,
+            )
+        )
+    return fused
@@ -0,0 +1,214 @@
+import re
+import ast
+import logging
+from typing import List, Optional
+
+import numpy as np
+from langchain.chains import LLMChain
+from langchain.schema import Document
+
+from bm25_index import BM25Index
+from utils import clean_text, DocIndexer
+from vector_index import VectorIndex
+from config import *
+
+logger = logging.getLogger(__name__)
+
+
+class Reranker:
+    """
+    第一阶段检索之后的重排序阶段：从候选小块中选出相关的块，
+    入选块所在的文件（source_md5）进入第二阶段检索。
+
+    子类实现 select，需要异步调用外部服务的子类再覆盖 aselect。
+    """
+
+    def select(self, docs: List[Document], query: str) -> List[int]:
+        """
+        选出相关的候选块。
+
+        参数:
+            docs (List[Document]): 第一阶段检索到的候选小块。
+            query (str): 查询。
+
+        返回:
+            List[int]: 相关块在 docs 中的下标，按相关性从高到低排列。
+        """
+        raise NotImplementedError
+
+    async def aselect(self, docs: List[Document], query: str) -> List[int]:
+        """select 的异步版本，默认直接调用 select。"""
+        return self.select(docs, query)
+
+
+class LLMReranker(Reranker):
+    """
+    由语言模型选择相关块：把候选块编号后写入提示词，从回答中解析出编号列表。
+    每次选择需要一次额外的语言模型调用。
+
+    属性:
+        llm: 语言模型。
+    """
+
+    def __init__(self, llm):
+        self.llm = llm
+
+    def _build_chain(self, docs: List[Document]):
+        snippets = "\n\n\n".join(
+            [
+                f"Context {idx}:\n{{{doc.page_content}}}. {{source: {doc.metadata['source']}}}"
+                for idx, doc in enumerate(docs)
+            ]
+        )
+        id_chain = LLMChain(
+            llm=self.llm,
+            prompt=PromptTemplates().get_docs_selection_template(),
+            output_key="IDs",
+        )
+        return id_chain, snippets
+
+    @staticmethod
+    def parse_ids(ids: str) -> List[int]:
+        """
+        从语言模型的回答中解析编号列表。
+
+        参数:
+            ids (str): 语言模型的回答。
+
+        返回:
+            List[int]: 编号列表，没有找到时为空列表。
+        """
+        logger.info("relevant doc ids: %s", ids)
+        pattern = r"\[\s*\d+\s*(?:,\s*\d+\s*)*\]"
+        match = re.search(pattern, ids)
+        if match:
+            return ast.literal_eval(match.group(0))
+        else:
+            return []
+
+    def select(self, docs: List[Document], query: str) -> List[int]:
+        id_chain, snippets = self._build_chain(docs)
+        return self.parse_ids(id_chain.run({"query": query, "snippets": snippets}))
+
+    async def aselect(self, docs: List[Document], query: str) -> List[int]:
+        id_chain, snippets = self._build_chain(docs)
+        return self.parse_ids(await id_chain.arun({"query": query, "snippets": snippets}))
+
+
+def _min_max(scores: np.ndarray) -> np.ndarray:
+    # 缩放到 [0, 1]，得分全部相同时视为同等相关
+    low, high = scores.min(), scores.max()
+    if high - low <= 0:
+        return np.ones_like(scores)
+    return (scores - low) / (high - low)
+
+
+class LocalReranker(Reranker):
+    """
+    在本地对候选块做词项与向量的交叉打分，不调用语言模型。
+
+    候选块通过 page_content_md5 找到它在小块存储中的行号，BM25 得分用入库时构建的索引按全量
+    统计量计算，向量相似度直接读取入库时缓存的向量，两者都只对候选行做一次向量化计算。
+    两种得分分别缩放到 [0, 1] 后加权求和，每个文件取其最高分的块作为代表，
+    保留得分不低于最高分 min_score_ratio 倍的文件，最多 max_files 个。
+
+    属性:
+        docs_index (DocIndexer): 小块的文档索引，用于按 page_content_md5 查找行号。
+        bm25_index (BM25Index): 小块的 BM25 索引。
+        vector_index (VectorIndex, 可选): 与小块按行对齐的向量，为 None 时只用 BM25 得分。
+        lexical_weight (float): BM25 得分的权重，向量相似度的权重为 1 - lexical_weight。
+        max_files (int): 进入第二阶段的文件数上限。
+        min_score_ratio (float): 文件入选的最低得分（相对最高分的比例）。
+    """
+
+    def __init__(
+        self,
+        docs_index: DocIndexer,
+        bm25_index: BM25Index,
+        vector_index: Optional[VectorIndex] = None,
+        lexical_weight: float = RERANK_LEXICAL_WEIGHT,
+        max_files: int = RERANK_MAX_FILES,
+        min_score_ratio: float = RERANK_MIN_SCORE_RATIO,
+    ):
+        self.docs_index = docs_index
+        self.bm25_index = bm25_index
+        self.vector_index = vector_index
+        self.lexical_weight = lexical_weight
+        self.max_files = max_files
+        self.min_score_ratio = min_score_ratio
+
+    def _row_ids(self, docs: List[Document]) -> List[Optional[int]]:
+        rows = self.docs_index.index.get("page_content_md5", {})
+        return [
+            rows[doc.metadata["page_content_md5"]][0]
+            if doc.metadata.get("page_content_md5") in rows
+            else None
+            for doc in docs
+        ]
+
+    def score(self, docs: List[Document], query: str) -> np.ndarray:
+        """
+        计算候选块的交叉得分。
+
+        参数:
+            docs (List[Document]): 候选小块。
+            query (str): 查询。
+
+        返回:
+            np.ndarray: 与 docs 一一对应的 [0, 1] 得分，不在小块存储中的块得分为 0。
+        """
+        row_ids = self._row_ids(docs)
+        found = np.asarray([row is not None for row in row_ids])
+        scores = np.zeros(len(docs))
+        if not found.any():
+            return scores
+        rows = np.asarray([row for row in row_ids if row is not None], dtype=np.int64)
+        lexical = _min_max(self.bm25_index.score_rows(clean_text(query).split(), rows))
+        if self.vector_index is None:
+            scores[found] = lexical
+            return scores
+        query_vector = self.vector_index.query_vectors(query)
+        semantic = _min_max(np.asarray(self.vector_index.vectors[rows]) @ query_vector)
+        scores[found] = self.lexical_weight * lexical + (1 - self.lexical_weight) * semantic
+        return scores
+
+    def select(self, docs: List[Document], query: str) -> List[int]:
+        if not docs:
+            return []
+        scores = self.score(docs, query)
+        # 每个文件只保留得分最高的块，按得分从高到低排列，得分相同时保持检索顺序
+        best = {}
+        for idx in np.argsort(-scores, kind="stable").tolist():
+            best.setdefault(docs[idx].metadata["source_md5"], idx)
+        selected = list(best.values())[: max(1, self.max_files)]
+        threshold = scores[selected[0]] * self.min_score_ratio
+        selected = [idx for idx in selected if scores[idx] >= threshold]
+        logger.info("reranked doc ids: %s, scores: %s", selected, scores[selected].tolist())
+        return selected
+
+
+def get_reranker(
+    name: str,
+    llm=None,
+    docs_index: Optional[DocIndexer] = None,
+    bm25_index: Optional[BM25Index] = None,
+    vector_index: Optional[VectorIndex] = None,
+) -> Reranker:
+    """
+    根据名称创建重排序器。
+
+    参数:
+        name (str): "local" 使用 LocalReranker，"llm" 使用 LLMReranker。
+        llm: 语言模型，"llm" 时需要。
+        docs_index (DocIndexer, 可选): 小块的文档索引，"local" 时需要。
+        bm25_index (BM25Index, 可选): 小块的 BM25 索引，"local" 时需要。
+        vector_index (VectorIndex, 可选): 小块的向量索引。
+
+    返回:
+        Reranker: 重排序器。
+    """
+    if name == "llm":
+        return LLMReranker(llm)
+    if name == "local":
+        return LocalReranker(docs_index, bm25_index, vector_index)
+    raise ValueError(f"不支持的重排序器 {name}")
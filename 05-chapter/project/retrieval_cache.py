@@ -0,0 +1,235 @@
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Optional, Tuple
+
+import numpy as np
+
+
+def corpus_version(manifest: dict) -> str:
+    """
+    根据入库清单中每个源文件的哈希计算语料版本，任何文件的增删改都会得到新版本。
+
+    参数:
+        manifest (dict): doc2db.py 写入的入库清单 {文件路径: 条目}。
+
+    返回:
+        str: 语料版本（MD5）。
+    """
+    file_md5s = sorted(entry["file_md5"] for entry in manifest.values())
+    return hashlib.md5("|".join(file_md5s).encode("utf-8")).hexdigest()
+
+
+def cache_version(corpus_version: str, settings: dict) -> str:
+    """
+    把语料版本和影响检索结果的配置合成缓存版本，检索数量、权重、重排序器或上下文预算等配置
+    改变后得到新版本，旧配置下缓存的结果不会再被命中。
+
+    参数:
+        corpus_version (str): corpus_version() 计算的语料版本。
+        settings (dict): 检索配置 {名称: 取值}，取值需要可以转换为 JSON。
+
+    返回:
+        str: 缓存版本（MD5）。
+    """
+    raw = json.dumps(settings, sort_keys=True, default=str)
+    return hashlib.md5(f"{corpus_version}|{raw}".encode("utf-8")).hexdigest()
+
+
+def normalize_query(query: str) -> str:
+    # 精确匹配使用的查询归一化：小写并合并空白字符
+    return " ".join(query.lower().split())
+
+
+class RetrievalCache:
+    """
+    MyRetriever 检索结果缓存，持久化在本地 SQLite 文件中。
+
+    - 精确匹配：以 (缓存版本, num_query, 归一化查询) 为键，缓存版本由 cache_version 根据语料版本和检索配置计算。
+    - 语义匹配（可选）：提供 embedding 时，同一缓存版本和 num_query 下，与已缓存查询的
+      余弦相似度不低于 similarity_threshold 即视为命中。
+    - 淘汰：超过 ttl 秒的条目失效，条目数超过 max_entries 时淘汰最久未访问的条目。
+    - 失效：语料（由入库清单中的文件哈希计算）或检索配置变化后，旧版本的条目全部删除。
+
+    属性:
+        hits (int): 精确匹配命中次数。
+        semantic_hits (int): 语义匹配命中次数。
+        misses (int): 未命中次数。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        corpus_version: str,
+        max_entries: int = 1000,
+        ttl: Optional[float] = 24 * 3600,
+        embedding: Any = None,
+        similarity_threshold: float = 0.95,
+    ):
+        self.path = path
+        self.corpus_version = corpus_version
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embedding = embedding
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS retrieval_cache (
+                    key TEXT PRIMARY KEY,
+                    corpus_version TEXT NOT NULL,
+                    num_query INTEGER NOT NULL,
+                    embedding BLOB,
+                    value BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "DELETE FROM retrieval_cache WHERE corpus_version != ?", (corpus_version,)
+            )
+
+    def _key(self, query: str, num_query: int) -> str:
+        raw = f"{self.corpus_version}|{num_query}|{normalize_query(query)}"
+        return hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+    def _embed(self, query: str) -> Optional[np.ndarray]:
+        if self.embedding is None:
+            return None
+        vector = np.asarray(self.embedding.embed_query(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def lookup(self, query: str, num_query: int) -> Tuple[Optional[Any], Optional[np.ndarray]]:
+        """
+        查找缓存的检索结果。
+
+        参数:
+            query (str): 查询。
+            num_query (int): 本轮拆分出的子问题数量，影响第三阶段的检索数量。
+
+        返回:
+            tuple: (缓存的检索结果或 None, 查询向量或 None)，查询向量在写入缓存时复用。
+        """
+        key = self._key(query, num_query)
+        now = time.time()
+        min_created_at = now - self.ttl if self.ttl else 0.0
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM retrieval_cache WHERE key = ? AND created_at >= ?",
+                (key, min_created_at),
+            ).fetchone()
+            if row is not None:
+                self._touch(key, now)
+                self.hits += 1
+                return pickle.loads(row[0]), None
+
+        vector = self._embed(query)
+        if vector is not None:
+            with self._lock:
+                rows = self._conn.execute(
+                    """
+                    SELECT key, embedding FROM retrieval_cache
+                    WHERE corpus_version = ? AND num_query = ? AND created_at >= ?
+                    AND embedding IS NOT NULL
+                    """,
+                    (self.corpus_version, num_query, min_created_at),
+                ).fetchall()
+                if rows:
+                    matrix = np.stack([np.frombuffer(emb, dtype=np.float32) for _, emb in rows])
+                    similarities = matrix @ vector
+                    best = int(np.argmax(similarities))
+                    if similarities[best] >= self.similarity_threshold:
+                        best_key = rows[best][0]
+                        value = self._conn.execute(
+                            "SELECT value FROM retrieval_cache WHERE key = ?", (best_key,)
+                        ).fetchone()[0]
+                        self._touch(best_key, now)
+                        self.semantic_hits += 1
+                        return pickle.loads(value), vector
+
+        with self._lock:
+            self.misses += 1
+        return None, vector
+
+    def get(self, query: str, num_query: int) -> Optional[Any]:
+        """查找缓存的检索结果，未命中时返回 None。"""
+        return self.lookup(query, num_query)[0]
+
+    def set(self, query: str, num_query: int, value: Any, vector: Optional[np.ndarray] = None):
+        """
+        写入检索结果，并按容量淘汰最久未访问的条目。
+
+        参数:
+            query (str): 查询。
+            num_query (int): 本轮拆分出的子问题数量。
+            value (Any): 检索结果，需要可以被 pickle。
+            vector (np.ndarray, 可选): lookup 返回的查询向量，避免重复计算。
+        """
+        if vector is None and self.embedding is not None:
+            vector = self._embed(query)
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO retrieval_cache
+                (key, corpus_version, num_query, embedding, value, created_at, accessed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    self._key(query, num_query),
+                    self.corpus_version,
+                    num_query,
+                    vector.tobytes() if vector is not None else None,
+                    pickle.dumps(value),
+                    now,
+                    now,
+                ),
+            )
+            if self.ttl:
+                self._conn.execute(
+                    "DELETE FROM retrieval_cache WHERE created_at < ?", (now - self.ttl,)
+                )
+            self._conn.execute(
+                """
+                DELETE FROM retrieval_cache WHERE key IN (
+                    SELECT key FROM retrieval_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+    def _touch(self, key: str, now: float):
+        with self._conn:
+            self._conn.execute(
+                "UPDATE retrieval_cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+
+    def close(self):
+        """关闭 SQLite 连接。"""
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> dict:
+        """
+        返回命中统计。
+
+        返回:
+            dict: 命中次数、语义命中次数、未命中次数和命中率。
+        """
+        with self._lock:
+            total = self.hits + self.semantic_hits + self.misses
+            return {
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.semantic_hits) / total if total else 0.0,
+            }
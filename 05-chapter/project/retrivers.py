@@ -1,12 +1,10 @@
-import re
-import ast
-import copy
-import math
+import asyncio
 import logging
-from typing import Dict, List, Optional
-from langchain.chains import LLMChain
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from typing import Any, Dict, List, Optional, Sequence, Tuple
 from langchain.schema import BaseRetriever, Document
-from langchain.retrievers import BM25Retriever, EnsembleRetriever
+from langchain.retrievers import EnsembleRetriever
 from langchain.callbacks.manager import (
     AsyncCallbackManagerForRetrieverRun,
     CallbackManagerForRetrieverRun,
@@ -14,17 +12,95 @@ from langchain.callbacks.manager import (
     CallbackManagerForChainRun,
 )
 
+from bm25_index import BM25Index
+from interval_groups import window_centroids
+from profiler import run_with_context, stage
+from rank_fusion import fuse_documents
+from rerankers import Reranker, get_reranker
+from retrieval_cache import RetrievalCache
 from utils import clean_text, DocIndexer, IndexerOperator
+from vector_index import VectorIndex
 from config import *
 
 logger = logging.getLogger(__name__)
 
+
+class PrebuiltBM25Retriever(BaseRetriever):
+    """
+    BM25 retriever backed by a prebuilt BM25Index, optionally restricted to a row subset.
+
+    ``docs`` is any sequence of Documents indexed by row (a list or a ChunkStore). It is
+    typed ``Any`` so pydantic does not validate, copy or materialize the whole corpus
+    every time a retriever is built.
+    """
+
+    index: BM25Index
+    docs: Any
+    row_ids: Optional[Any] = None
+    k: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        top_rows = self.index.get_top_n(query.split(), self.k, row_ids=self.row_ids)
+        return [self.docs[row] for row in top_rows]
+
+
+class PrebuiltVectorRetriever(BaseRetriever):
+    """
+    Embedding retriever backed by a VectorIndex aligned with ``docs``, restricted to a row subset.
+
+    Only the vectors of ``row_ids`` (one file or a few windows) are scored, so the cost of a
+    filtered search does not depend on the size of the whole collection.
+    """
+
+    index: VectorIndex
+    docs: Any
+    row_ids: Optional[Any] = None
+    k: int = 4
+    search_type: str = "mmr"
+    fetch_k: int = 20
+    lambda_mult: float = 0.5
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        top_rows = self.index.search(
+            query,
+            k=self.k,
+            row_ids=self.row_ids,
+            search_type=self.search_type,
+            fetch_k=self.fetch_k,
+            lambda_mult=self.lambda_mult,
+        )
+        return [self.docs[row] for row in top_rows]
+
+
+@lru_cache(maxsize=None)
+def get_bm25_executor() -> ThreadPoolExecutor:
+    """
+    Get the process-wide thread pool for async BM25 scoring, created on first use.
+
+    Returns:
+        ThreadPoolExecutor: A pool with BM25_MAX_WORKERS threads.
+    """
+    return ThreadPoolExecutor(max_workers=BM25_MAX_WORKERS, thread_name_prefix="bm25")
+
+
 class MyEnsembleRetriever(EnsembleRetriever):
     """
     Custom retriever for BM24 and Chroma Embeddings
     """
 
     retrievers: Dict[str, BaseRetriever]
+    top_k: Optional[int] = None
+    retriever_timeout: Optional[float] = None
 
     def rank_fusion(
         self, query: str, run_manager: CallbackManagerForRetrieverRun
@@ -73,26 +149,72 @@ class MyEnsembleRetriever(EnsembleRetriever):
             A list of reranked documents.
         """
 
-        # Get the results of all retrievers.
-        retriever_docs = []
-        for key, retriever in self.retrievers.items():
-            if key == "bm25":
-                res = retriever.get_relevant_documents(
-                    clean_text(query),
-                    callbacks=run_manager.get_child(tag=f"retriever_{key}"),
-                )
-                retriever_docs.append(res)
-            else:
-                res = await retriever.aget_relevant_documents(
-                    query, callbacks=run_manager.get_child(tag=f"retriever_{key}")
-                )
-                retriever_docs.append(res)
+        # Run all retrievers concurrently; cancel the rest if one fails or we are cancelled.
+        tasks = [
+            asyncio.ensure_future(self._aretrieve(key, retriever, query, run_manager))
+            for key, retriever in self.retrievers.items()
+        ]
+        try:
+            retriever_docs = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
 
         # apply rank fusion
         fused_documents = self.weighted_reciprocal_rank(retriever_docs)
 
         return fused_documents
 
+    async def _aretrieve(
+        self,
+        key: str,
+        retriever: BaseRetriever,
+        query: str,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+    ) -> List[Document]:
+        """
+        Get the results of one retriever without blocking the event loop.
+
+        BM25 scoring is CPU bound, so it runs in the dedicated BM25 executor. A retriever
+        that does not answer within retriever_timeout contributes no documents. Timed-out
+        BM25 scoring that is still queued is cancelled, but scoring that has already started
+        cannot be interrupted and keeps one BM25 thread busy until it finishes.
+
+        Args:
+            key: The retriever name in self.retrievers.
+            retriever: The retriever.
+            query: The query to search for.
+            run_manager: The callback manager of the ensemble run.
+
+        Returns:
+            The retriever's documents, empty if it timed out.
+        """
+        callbacks = run_manager.get_child(tag=f"retriever_{key}")
+        if key == "bm25":
+            call = partial(retriever.get_relevant_documents, clean_text(query), callbacks=callbacks)
+            coro = asyncio.get_running_loop().run_in_executor(
+                get_bm25_executor(), run_with_context(call)
+            )
+        else:
+            coro = retriever.aget_relevant_documents(query, callbacks=callbacks)
+        with stage(f"{key}_search") as counters:
+            try:
+                docs = await asyncio.wait_for(coro, self.retriever_timeout)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    "retriever %s timed out after %ss, fusing the other results%s",
+                    key,
+                    self.retriever_timeout,
+                    " (BM25 scoring that already started keeps running in the background)"
+                    if key == "bm25"
+                    else "",
+                )
+                counters["timeouts"] = 1
+                return []
+            counters["candidates_out"] = len(docs)
+        return docs
+
     def weighted_reciprocal_rank(
         self, doc_lists: List[List[Document]]
     ) -> List[Document]:
@@ -108,47 +230,25 @@ class MyEnsembleRetriever(EnsembleRetriever):
             list: The final aggregated list of items sorted by their weighted RRF
                     scores in descending order.
         """
-        if len(doc_lists) != len(self.weights):
-            raise ValueError(
-                "Number of rank lists must be equal to the number of weights."
-            )
+        return [doc for doc, _ in self.weighted_reciprocal_rank_with_scores(doc_lists)]
 
-        # replace the page_content with the original uncleaned page_content
-        doc_lists_ = copy.copy(doc_lists)
-        for doc_list in doc_lists_:
-            for doc in doc_list:
-                doc.page_content = doc.metadata["page_content"]
-                # doc.metadata["page_content"] = None
-
-        # Create a union of all unique documents in the input doc_lists
-        all_documents = set()
-        for doc_list in doc_lists_:
-            for doc in doc_list:
-                all_documents.add(doc.page_content)
-
-        # Initialize the RRF score dictionary for each document
-        rrf_score_dic = {doc: 0.0 for doc in all_documents}
-
-        # Calculate RRF scores for each document
-        for doc_list, weight in zip(doc_lists_, self.weights):
-            for rank, doc in enumerate(doc_list, start=1):
-                rrf_score = weight * (1 / (rank + self.c))
-                rrf_score_dic[doc.page_content] += rrf_score
-
-        # Sort documents by their RRF scores in descending order
-        sorted_documents = sorted(
-            rrf_score_dic.keys(), key=lambda x: rrf_score_dic[x], reverse=True
-        )
+    def weighted_reciprocal_rank_with_scores(
+        self, doc_lists: List[List[Document]]
+    ) -> List[Tuple[Document, float]]:
+        """
+        Fuse the rank lists keyed by page_content_md5 and keep the RRF scores.
 
-        # Map the sorted page_content back to the original document objects
-        page_content_to_doc_map = {
-            doc.page_content: doc for doc_list in doc_lists_ for doc in doc_list
-        }
-        sorted_docs = [
-            page_content_to_doc_map[page_content] for page_content in sorted_documents
-        ]
+        The retrievers' Document objects are left untouched; each result is a new
+        Document holding the original uncleaned page_content and an "rrf_score"
+        metadata entry. Only the top_k results are selected when top_k is set.
+
+        Args:
+            doc_lists: A list of rank lists, where each rank list contains unique items.
 
-        return sorted_docs
+        Returns:
+            list: (document, score) pairs sorted by score in descending order.
+        """
+        return fuse_documents(doc_lists, self.weights, c=self.c, k=self.top_k)
 
 
 class MyRetriever:
@@ -161,12 +261,20 @@ class MyRetriever:
         llm,
         embedding_chunks_small: List[Document],
         embedding_chunks_medium: List[Document],
-        docs_chunks_small: DocIndexer,
-        docs_chunks_medium: DocIndexer,
+        docs_chunks_small: Sequence[Document],
+        docs_chunks_medium: Sequence[Document],
         first_retrieval_k: int,
         second_retrieval_k: int,
         num_windows: int,
         retriever_weights: List[float],
+        bm25_index_small: Optional[BM25Index] = None,
+        bm25_index_medium: Optional[BM25Index] = None,
+        cache: Optional[RetrievalCache] = None,
+        vector_index_small: Optional[VectorIndex] = None,
+        vector_index_medium: Optional[VectorIndex] = None,
+        reranker: Optional[Reranker] = None,
+        docs_index_small: Optional[DocIndexer] = None,
+        docs_index_medium: Optional[DocIndexer] = None,
     ):
         """
         Initialize the MyRetriever class.
@@ -175,58 +283,153 @@ class MyRetriever:
             llm: Language model for retrieval.
             embedding_chunks_small (List[Document]): List of small embedding chunks.
             embedding_chunks_medium (List[Document]): List of medium embedding chunks.
-            docs_chunks_small (DocIndexer): Document indexer for small chunks.
-            docs_chunks_medium (DocIndexer): Document indexer for medium chunks.
+            docs_chunks_small (Sequence[Document]): Small chunks (a list or a ChunkStore),
+                indexed by a DocIndexer.
+            docs_chunks_medium (Sequence[Document]): Medium chunks (a list or a ChunkStore),
+                indexed by a DocIndexer.
             first_retrieval_k (int): Number of top documents to retrieve in first retrieval.
             second_retrieval_k (int): Number of top documents to retrieve in second retrieval.
             num_windows (int): Number of overlapping windows to consider.
             retriever_weights (List[float]): Weights for ensemble retrieval.
+            bm25_index_small (Optional[BM25Index]): Prebuilt BM25 index over docs_chunks_small.
+                Built here once if not given.
+            bm25_index_medium (Optional[BM25Index]): Prebuilt BM25 index over docs_chunks_medium.
+                Built here once if not given.
+            cache (Optional[RetrievalCache]): Cache for the results of get_relevant_documents.
+                Retrieval is not cached if not given.
+            vector_index_small (Optional[VectorIndex]): Vectors aligned with docs_chunks_small,
+                used for the filtered 2nd retrieval instead of the Chroma collection.
+            vector_index_medium (Optional[VectorIndex]): Vectors aligned with docs_chunks_medium,
+                used for the filtered 3rd retrieval instead of the Chroma collection.
+            reranker (Optional[Reranker]): Selects which files of the 1st retrieval go to the
+                2nd retrieval. Created from the RERANKER setting if not given.
+            docs_index_small (Optional[DocIndexer]): Prebuilt DocIndexer over docs_chunks_small.
+                Built here if not given.
+            docs_index_medium (Optional[DocIndexer]): Prebuilt DocIndexer over docs_chunks_medium.
+                Built here if not given.
         """
         self.llm = llm
         self.embedding_chunks_small = embedding_chunks_small
         self.embedding_chunks_medium = embedding_chunks_medium
-        self.docs_index_small = DocIndexer(docs_chunks_small)
-        self.docs_index_medium = DocIndexer(docs_chunks_medium)
+        self.docs_index_small = docs_index_small or DocIndexer(docs_chunks_small)
+        self.docs_index_medium = docs_index_medium or DocIndexer(docs_chunks_medium)
+        self.bm25_index_small = self._check_bm25_index(
+            bm25_index_small, docs_chunks_small
+        )
+        self.bm25_index_medium = self._check_bm25_index(
+            bm25_index_medium, docs_chunks_medium
+        )
 
         self.first_retrieval_k = first_retrieval_k
         self.second_retrieval_k = second_retrieval_k
         self.num_windows = num_windows
         self.retriever_weights = retriever_weights
+        self.cache = cache
+        self.vector_index_small = self._check_vector_index(
+            vector_index_small, docs_chunks_small
+        )
+        self.vector_index_medium = self._check_vector_index(
+            vector_index_medium, docs_chunks_medium
+        )
+        self.reranker = reranker or get_reranker(
+            RERANKER,
+            llm=llm,
+            docs_index=self.docs_index_small,
+            bm25_index=self.bm25_index_small,
+            vector_index=self.vector_index_small,
+        )
+
+    @staticmethod
+    def _check_bm25_index(bm25_index: Optional[BM25Index], docs_chunks: Sequence[Document]):
+        """
+        Make sure a BM25 index exists and its rows line up with the document chunks.
+
+        Args:
+            bm25_index (Optional[BM25Index]): The prebuilt index, if any.
+            docs_chunks (Sequence[Document]): The document chunks the index rows refer to.
+
+        Returns:
+            BM25Index: The checked or freshly built index.
+        """
+        if bm25_index is None:
+            return BM25Index.from_documents(docs_chunks)
+        if len(bm25_index) != len(docs_chunks):
+            raise ValueError(
+                f"BM25 index has {len(bm25_index)} rows but there are "
+                f"{len(docs_chunks)} document chunks, please re-run doc2db.py."
+            )
+        return bm25_index
+
+    @staticmethod
+    def _check_vector_index(vector_index: Optional[VectorIndex], docs_chunks: Sequence[Document]):
+        """
+        Make sure the rows of a vector index line up with the document chunks.
+
+        Args:
+            vector_index (Optional[VectorIndex]): The prebuilt vector index, if any.
+            docs_chunks (Sequence[Document]): The document chunks the index rows refer to.
+
+        Returns:
+            Optional[VectorIndex]: The checked index, None to search the Chroma collections.
+        """
+        if vector_index is not None and len(vector_index) != len(docs_chunks):
+            raise ValueError(
+                f"Vector index has {len(vector_index)} rows but there are "
+                f"{len(docs_chunks)} document chunks, please re-run doc2db.py."
+            )
+        return vector_index
 
     def get_retriever(
         self,
+        bm25_index,
         docs_chunks,
         emb_chunks,
+        row_ids=None,
         emb_filter=None,
         k=2,
         weights=(0.5, 0.5),
+        top_k=None,
+        vector_index=None,
     ):
         """
         Initialize and return a retriever instance with specified parameters.
 
         Args:
-            docs_chunks: The document chunks for the BM25 retriever.
+            bm25_index: The prebuilt BM25 index over docs_chunks.
+            docs_chunks: The document chunks the BM25 index rows refer to.
             emb_chunks: The document chunks for the Embedding retriever.
+            row_ids: Rows of docs_chunks the BM25 retriever is restricted to, None for all.
             emb_filter: A filter for embedding retriever.
             k (int): The number of top documents to return.
             weights (list): Weights for ensemble retrieval.
+            top_k (int): Keep only the top_k fused documents, None to keep all.
+            vector_index: Vectors aligned with docs_chunks. When given together with row_ids,
+                the embedding retriever only searches those rows instead of filtering emb_chunks.
 
         Returns:
             MyEnsembleRetriever: An instance of MyEnsembleRetriever.
         """
-        bm25_retriever = BM25Retriever.from_documents(docs_chunks)
-        bm25_retriever.k = k
-
-        emb_retriever = emb_chunks.as_retriever(
-            search_kwargs={
-                "filter": emb_filter,
-                "k": k,
-                "search_type": "mmr",
-            }
+        bm25_retriever = PrebuiltBM25Retriever(
+            index=bm25_index, docs=docs_chunks, row_ids=row_ids, k=k
         )
+
+        if vector_index is not None and row_ids is not None:
+            emb_retriever = PrebuiltVectorRetriever(
+                index=vector_index, docs=docs_chunks, row_ids=row_ids, k=k
+            )
+        else:
+            emb_retriever = emb_chunks.as_retriever(
+                search_kwargs={
+                    "filter": emb_filter,
+                    "k": k,
+                    "search_type": "mmr",
+                }
+            )
         return MyEnsembleRetriever(
             retrievers={"bm25": bm25_retriever, "chroma": emb_retriever},
             weights=weights,
+            top_k=top_k,
+            retriever_timeout=RETRIEVER_TIMEOUT,
         )
 
     def find_overlaps(self, doc: List[Document]):
@@ -237,7 +440,7 @@ class MyRetriever:
             doc (Document): A document object to find overlaps in.
 
         Returns:
-            list: A list of overlapping intervals.
+            list: The centroid window of each group of overlapping intervals.
         """
         intervals = []
         for item in doc:
@@ -247,55 +450,7 @@ class MyRetriever:
                     item.metadata["large_chunks_index_upper_bound"],
                 )
             )
-        remaining_intervals, grouped_intervals, centroids = intervals.copy(), [], []
-
-        while remaining_intervals:
-            curr_interval = remaining_intervals.pop(0)
-            curr_group = [curr_interval]
-            subset_interval = None
-
-            for start, end in remaining_intervals.copy():
-                for s, e in curr_group:
-                    overlap = set(range(s, e + 1)) & set(range(start, end + 1))
-                    if overlap:
-                        curr_group.append((start, end))
-                        remaining_intervals.remove((start, end))
-                        if set(range(start, end + 1)).issubset(set(range(s, e + 1))):
-                            subset_interval = (start, end)
-                        break
-
-            if subset_interval:
-                centroid = [math.ceil((subset_interval[0] + subset_interval[1]) / 2)]
-            elif len(curr_group) > 2:
-                first_overlap = max(
-                    set(range(curr_group[0][0], curr_group[0][1] + 1))
-                    & set(range(curr_group[1][0], curr_group[1][1] + 1))
-                )
-                last_overlap_set = set(
-                    range(curr_group[-1][0], curr_group[-1][1] + 1)
-                ) & set(range(curr_group[-2][0], curr_group[-2][1] + 1))
-
-                if not last_overlap_set:
-                    last_overlap = first_overlap  # Fallback if no overlap
-                else:
-                    last_overlap = min(last_overlap_set)
-
-                step = 1 if first_overlap <= last_overlap else -1
-                centroid = list(range(first_overlap, last_overlap + step, step))
-            else:
-                centroid = [
-                    round(
-                        sum([math.ceil((s + e) / 2) for s, e in curr_group])
-                        / len(curr_group)
-                    )
-                ]
-
-            grouped_intervals.append(
-                curr_group if len(curr_group) > 1 else curr_group[0]
-            )
-            centroids.extend(centroid)
-
-        return centroids
+        return window_centroids(intervals)
 
     def get_filter(self, top_k: int, file_md5: str, doc: List[Document]):
         """
@@ -309,7 +464,9 @@ class MyRetriever:
         Returns:
             tuple: A tuple of containing dictionary filters for DocIndexer and Chroma retrievers.
         """
-        overlaps = self.find_overlaps(doc)
+        with stage("find_overlaps", intervals=len(doc)) as counters:
+            overlaps = self.find_overlaps(doc)
+            counters["windows"] = len(overlaps)
         if len(overlaps) < 1:
             raise ValueError("No overlapping intervals found.")
 
@@ -356,7 +513,7 @@ class MyRetriever:
 
     def get_relevant_doc_ids(self, docs: List[Document], query: str):
         """
-        Get relevant document IDs given a query using an LLM.
+        Get relevant document IDs given a query using the reranker.
 
         Args:
             docs (List[Document]): List of document objects to find relevant IDs in.
@@ -365,25 +522,20 @@ class MyRetriever:
         Returns:
             list: A list of relevant document IDs.
         """
-        snippets = "\n\n\n".join(
-            [
-                f"Context {idx}:\n{{{doc.page_content}}}. {{source: {doc.metadata['source']}}}"
-                for idx, doc in enumerate(docs)
-            ]
-        )
-        id_chain = LLMChain(
-            llm=self.llm,
-            prompt=PromptTemplates().get_docs_selection_template(),
-            output_key="IDs",
-        )
-        ids = id_chain.run({"query": query, "snippets": snippets})
-        logger.info("relevant doc ids: %s", ids)
-        pattern = r"\[\s*\d+\s*(?:,\s*\d+\s*)*\]"
-        match = re.search(pattern, ids)
-        if match:
-            return ast.literal_eval(match.group(0))
-        else:
-            return []
+        return self.reranker.select(docs, query)
+
+    async def aget_relevant_doc_ids(self, docs: List[Document], query: str):
+        """
+        Asynchronous version of get_relevant_doc_ids method.
+
+        Args:
+            docs (List[Document]): List of document objects to find relevant IDs in.
+            query (str): The query string.
+
+        Returns:
+            list: A list of relevant document IDs.
+        """
+        return await self.reranker.aselect(docs, query)
 
     def get_relevant_documents(
         self,
@@ -391,7 +543,38 @@ class MyRetriever:
         num_query: int,
         *,
         run_manager: Optional[CallbackManagerForChainRun] = None,
-    ) -> List[Document]:
+    ) -> Dict[str, List[Document]]:
+        """
+        Get relevant documents, served from the retrieval cache when possible.
+
+        Args:
+            query (str): The query string.
+            num_query (int): Number of queries.
+            run_manager (Optional[CallbackManagerForChainRun], optional): Callback manager for chain run.
+
+        Returns:
+            Dict[str, List[Document]]: Relevant documents grouped by file name.
+        """
+        with stage("retrieve", num_query=num_query):
+            if self.cache is None:
+                return self._get_relevant_documents(query, num_query, run_manager=run_manager)
+            with stage("cache_lookup") as counters:
+                qa_chunks, vector = self.cache.lookup(query, num_query)
+                counters["hits"] = int(qa_chunks is not None)
+            if qa_chunks is not None:
+                logger.info("retrieval cache hit: %s", self.cache.stats())
+                return qa_chunks
+            qa_chunks = self._get_relevant_documents(query, num_query, run_manager=run_manager)
+            self.cache.set(query, num_query, qa_chunks, vector)
+            return qa_chunks
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        num_query: int,
+        *,
+        run_manager: Optional[CallbackManagerForChainRun] = None,
+    ) -> Dict[str, List[Document]]:
         """
         Perform multi-stage retrieval to get relevant documents.
 
@@ -401,21 +584,27 @@ class MyRetriever:
             run_manager (Optional[CallbackManagerForChainRun], optional): Callback manager for chain run.
 
         Returns:
-            List[Document]: A list of relevant documents.
+            Dict[str, List[Document]]: Relevant documents grouped by file name.
         """
         first_retriever = self.get_retriever(
+            bm25_index=self.bm25_index_small,
             docs_chunks=self.docs_index_small.documents,
             emb_chunks=self.embedding_chunks_small,
             emb_filter=None,
             k=self.first_retrieval_k,
             weights=self.retriever_weights,
         )
-        first = first_retriever.get_relevant_documents(
-            query, callbacks=run_manager.get_child()
-        )
-        for doc in first:
-            logger.info("----1st retrieval----: %s", doc)
-        ids_clean = self.get_relevant_doc_ids(first, query)
+        with stage("stage1_search") as counters:
+            first = first_retriever.get_relevant_documents(
+                query, callbacks=run_manager.get_child()
+            )
+            counters["candidates_out"] = len(first)
+        if LOG_CHUNK_CONTENTS:
+            for doc in first:
+                logger.info("----1st retrieval----: %s", doc)
+        with stage("rerank", candidates_in=len(first)) as counters:
+            ids_clean = self.get_relevant_doc_ids(first, query)
+            counters["selected"] = len(ids_clean)
         logger.info("relevant cleaned doc ids: %s", ids_clean)
         qa_chunks = {}
         if ids_clean and isinstance(ids_clean, list):
@@ -446,48 +635,64 @@ class MyRetriever:
                 logger.info(
                     "selected_docs_at_1st_retrieval: %s", docs[0].metadata["source"]
                 )
-                second_docs_chunks = self.docs_index_small.retrieve_metadata(
-                    {
-                        "source_md5": (IndexerOperator.EQ, source_md5),
-                    }
-                )
-                second_retriever = self.get_retriever(
-                    docs_chunks=second_docs_chunks,
-                    emb_chunks=self.embedding_chunks_small,
-                    emb_filter={"source_md5": source_md5},
-                    k=self.second_retrieval_k,
-                    weights=self.retriever_weights,
-                )
-                second = second_retriever.get_relevant_documents(
-                    query, callbacks=run_manager.get_child()
-                )
-                for doc in second:
-                    logger.info("----2nd retrieval----: %s", doc)
+                with stage("stage2_filter") as counters:
+                    second_row_ids = self.docs_index_small.retrieve_row_ids(
+                        {
+                            "source_md5": (IndexerOperator.EQ, source_md5),
+                        }
+                    )
+                    counters["rows"] = len(second_row_ids)
+                with stage("stage2_search", rows=len(second_row_ids)) as counters:
+                    second_retriever = self.get_retriever(
+                        bm25_index=self.bm25_index_small,
+                        docs_chunks=self.docs_index_small.documents,
+                        emb_chunks=self.embedding_chunks_small,
+                        row_ids=second_row_ids,
+                        emb_filter={"source_md5": source_md5},
+                        k=self.second_retrieval_k,
+                        weights=self.retriever_weights,
+                        vector_index=self.vector_index_small,
+                    )
+                    second = second_retriever.get_relevant_documents(
+                        query, callbacks=run_manager.get_child()
+                    )
+                    counters["candidates_out"] = len(second)
+                if LOG_CHUNK_CONTENTS:
+                    for doc in second:
+                        logger.info("----2nd retrieval----: %s", doc)
                 docs.extend(second)
-                docindexer_filter, chroma_filter = self.get_filter(
-                    self.num_windows, source_md5, docs
-                )
-                third_docs_chunks = self.docs_index_medium.retrieve_metadata(
-                    docindexer_filter
-                )
-                third_retriever = self.get_retriever(
-                    docs_chunks=third_docs_chunks,
-                    emb_chunks=self.embedding_chunks_medium,
-                    emb_filter=chroma_filter,
-                    k=third_num_k,
-                    weights=self.retriever_weights,
-                )
-                third_temp = third_retriever.get_relevant_documents(
-                    query, callbacks=run_manager.get_child()
-                )
-                third = third_temp[:third_num_k]
-                for doc in third:
-                    logger.info(
-                        "----3rd retrieval----page_content: %s", [doc.page_content]
+                with stage("stage3_filter") as counters:
+                    docindexer_filter, chroma_filter = self.get_filter(
+                        self.num_windows, source_md5, docs
+                    )
+                    third_row_ids = self.docs_index_medium.retrieve_row_ids(
+                        docindexer_filter
+                    )
+                    counters["rows"] = len(third_row_ids)
+                with stage("stage3_search", rows=len(third_row_ids)) as counters:
+                    third_retriever = self.get_retriever(
+                        bm25_index=self.bm25_index_medium,
+                        docs_chunks=self.docs_index_medium.documents,
+                        emb_chunks=self.embedding_chunks_medium,
+                        row_ids=third_row_ids,
+                        emb_filter=chroma_filter,
+                        k=third_num_k,
+                        weights=self.retriever_weights,
+                        top_k=third_num_k,
+                        vector_index=self.vector_index_medium,
                     )
-                    mtdata = doc.metadata
-                    mtdata["page_content"] = None
-                    logger.info("----3rd retrieval----metadata: %s", mtdata)
+                    third_temp = third_retriever.get_relevant_documents(
+                        query, callbacks=run_manager.get_child()
+                    )
+                    third = third_temp[:third_num_k]
+                    counters["candidates_out"] = len(third)
+                if LOG_CHUNK_CONTENTS:
+                    for doc in third:
+                        logger.info(
+                            "----3rd retrieval----page_content: %s", [doc.page_content]
+                        )
+                        mtdata = {**doc.metadata, "page_content": None}
+                        logger.info("----3rd retrieval----metadata: %s", mtdata)
                 file_name = third[0].metadata["source"].split("/")[-1]
                 if file_name not in qa_chunks:
                     qa_chunks[file_name] = third
@@ -502,7 +707,7 @@ class MyRetriever:
         num_query: int,
         *,
         run_manager: AsyncCallbackManagerForChainRun,
-    ) -> List[Document]:
+    ) -> Dict[str, List[Document]]:
         """
         Asynchronous version of get_relevant_documents method.
 
@@ -512,21 +717,68 @@ class MyRetriever:
             run_manager (AsyncCallbackManagerForChainRun): Callback manager for asynchronous chain run.
 
         Returns:
-            List[Document]: A list of relevant documents.
+            Dict[str, List[Document]]: Relevant documents grouped by file name.
+        """
+        with stage("retrieve", num_query=num_query):
+            if self.cache is None:
+                return await self._aget_relevant_documents(
+                    query, num_query, run_manager=run_manager
+                )
+            # The cache may embed the query, so keep SQLite and the embedding call off the event loop
+            loop = asyncio.get_running_loop()
+            with stage("cache_lookup") as counters:
+                qa_chunks, vector = await loop.run_in_executor(
+                    None, self.cache.lookup, query, num_query
+                )
+                counters["hits"] = int(qa_chunks is not None)
+            if qa_chunks is not None:
+                logger.info("retrieval cache hit: %s", self.cache.stats())
+                return qa_chunks
+            qa_chunks = await self._aget_relevant_documents(
+                query, num_query, run_manager=run_manager
+            )
+            await loop.run_in_executor(
+                None, self.cache.set, query, num_query, qa_chunks, vector
+            )
+            return qa_chunks
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        num_query: int,
+        *,
+        run_manager: AsyncCallbackManagerForChainRun,
+    ) -> Dict[str, List[Document]]:
+        """
+        Asynchronous version of _get_relevant_documents method.
+
+        Args:
+            query (str): The query string.
+            num_query (int): Number of queries.
+            run_manager (AsyncCallbackManagerForChainRun): Callback manager for asynchronous chain run.
+
+        Returns:
+            Dict[str, List[Document]]: Relevant documents grouped by file name.
         """
         first_retriever = self.get_retriever(
+            bm25_index=self.bm25_index_small,
             docs_chunks=self.docs_index_small.documents,
             emb_chunks=self.embedding_chunks_small,
             emb_filter=None,
             k=self.first_retrieval_k,
             weights=self.retriever_weights,
         )
-        first = await first_retriever.aget_relevant_documents(
-            query, callbacks=run_manager.get_child()
-        )
-        for doc in first:
-            logger.info("----1st retrieval----: %s", doc)
-        ids_clean = self.get_relevant_doc_ids(first, query)
+        with stage("stage1_search") as counters:
+            first = await first_retriever.aget_relevant_documents(
+                query, callbacks=run_manager.get_child()
+            )
+            counters["candidates_out"] = len(first)
+        if LOG_CHUNK_CONTENTS:
+            for doc in first:
+                logger.info("----1st retrieval----: %s", doc)
+        with stage("rerank", candidates_in=len(first)) as counters:
+            ids_clean = await self.aget_relevant_doc_ids(first, query)
+            counters["selected"] = len(ids_clean)
         logger.info("relevant doc ids: %s", ids_clean)
         qa_chunks = {}
         if ids_clean and isinstance(ids_clean, list):
@@ -557,48 +809,64 @@ class MyRetriever:
                 logger.info(
                     "selected_docs_at_1st_retrieval: %s", docs[0].metadata["source"]
                 )
-                second_docs_chunks = self.docs_index_small.retrieve_metadata(
-                    {
-                        "source_md5": (IndexerOperator.EQ, source_md5),
-                    }
-                )
-                second_retriever = self.get_retriever(
-                    docs_chunks=second_docs_chunks,
-                    emb_chunks=self.embedding_chunks_small,
-                    emb_filter={"source_md5": source_md5},
-                    k=self.second_retrieval_k,
-                    weights=self.retriever_weights,
-                )
-                second = await second_retriever.aget_relevant_documents(
-                    query, callbacks=run_manager.get_child()
-                )
-                for doc in second:
-                    logger.info("----2nd retrieval----: %s", doc)
+                with stage("stage2_filter") as counters:
+                    second_row_ids = self.docs_index_small.retrieve_row_ids(
+                        {
+                            "source_md5": (IndexerOperator.EQ, source_md5),
+                        }
+                    )
+                    counters["rows"] = len(second_row_ids)
+                with stage("stage2_search", rows=len(second_row_ids)) as counters:
+                    second_retriever = self.get_retriever(
+                        bm25_index=self.bm25_index_small,
+                        docs_chunks=self.docs_index_small.documents,
+                        emb_chunks=self.embedding_chunks_small,
+                        row_ids=second_row_ids,
+                        emb_filter={"source_md5": source_md5},
+                        k=self.second_retrieval_k,
+                        weights=self.retriever_weights,
+                        vector_index=self.vector_index_small,
+                    )
+                    second = await second_retriever.aget_relevant_documents(
+                        query, callbacks=run_manager.get_child()
+                    )
+                    counters["candidates_out"] = len(second)
+                if LOG_CHUNK_CONTENTS:
+                    for doc in second:
+                        logger.info("----2nd retrieval----: %s", doc)
                 docs.extend(second)
-                docindexer_filter, chroma_filter = self.get_filter(
-                    self.num_windows, source_md5, docs
-                )
-                third_docs_chunks = self.docs_index_medium.retrieve_metadata(
-                    docindexer_filter
-                )
-                third_retriever = self.get_retriever(
-                    docs_chunks=third_docs_chunks,
-                    emb_chunks=self.embedding_chunks_medium,
-                    emb_filter=chroma_filter,
-                    k=third_num_k,
-                    weights=self.retriever_weights,
-                )
-                third_temp = await third_retriever.aget_relevant_documents(
-                    query, callbacks=run_manager.get_child()
-                )
-                third = third_temp[:third_num_k]
-                for doc in third:
-                    logger.info(
-                        "----3rd retrieval----page_content: %s", [doc.page_content]
+                with stage("stage3_filter") as counters:
+                    docindexer_filter, chroma_filter = self.get_filter(
+                        self.num_windows, source_md5, docs
+                    )
+                    third_row_ids = self.docs_index_medium.retrieve_row_ids(
+                        docindexer_filter
+                    )
+                    counters["rows"] = len(third_row_ids)
+                with stage("stage3_search", rows=len(third_row_ids)) as counters:
+                    third_retriever = self.get_retriever(
+                        bm25_index=self.bm25_index_medium,
+                        docs_chunks=self.docs_index_medium.documents,
+                        emb_chunks=self.embedding_chunks_medium,
+                        row_ids=third_row_ids,
+                        emb_filter=chroma_filter,
+                        k=third_num_k,
+                        weights=self.retriever_weights,
+                        top_k=third_num_k,
+                        vector_index=self.vector_index_medium,
                     )
-                    mtdata = doc.metadata
-                    mtdata["page_content"] = None
-                    logger.info("----3rd retrieval----metadata: %s", mtdata)
+                    third_temp = await third_retriever.aget_relevant_documents(
+                        query, callbacks=run_manager.get_child()
+                    )
+                    third = third_temp[:third_num_k]
+                    counters["candidates_out"] = len(third)
+                if LOG_CHUNK_CONTENTS:
+                    for doc in third:
+                        logger.info(
+                            "----3rd retrieval----page_content: %s", [doc.page_content]
+                        )
+                        mtdata = {**doc.metadata, "page_content": None}
+                        logger.info("----3rd retrieval----metadata: %s", mtdata)
                 file_name = third[0].metadata["source"].split("/")[-1]
                 if file_name not in qa_chunks:
                     qa_chunks[file_name] = third
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 项目模块位于上一级目录，直接以模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,94 @@
+"""window_centroids 与优化前 find_overlaps 的一致性测试，使用固定种子的随机区间。"""
+
+import math
+import random
+
+import pytest
+
+from interval_groups import _SCAN_LIMIT, window_centroids
+
+
+def legacy_find_overlaps(intervals):
+    # 优化前 MyRetriever.find_overlaps 的实现：逐对比较区间展开后的集合
+    remaining_intervals, centroids = list(intervals), []
+
+    while remaining_intervals:
+        curr_interval = remaining_intervals.pop(0)
+        curr_group = [curr_interval]
+        subset_interval = None
+
+        for start, end in remaining_intervals.copy():
+            for s, e in curr_group:
+                overlap = set(range(s, e + 1)) & set(range(start, end + 1))
+                if overlap:
+                    curr_group.append((start, end))
+                    remaining_intervals.remove((start, end))
+                    if set(range(start, end + 1)).issubset(set(range(s, e + 1))):
+                        subset_interval = (start, end)
+                    break
+
+        if subset_interval:
+            centroid = [math.ceil((subset_interval[0] + subset_interval[1]) / 2)]
+        elif len(curr_group) > 2:
+            first_overlap = max(
+                set(range(curr_group[0][0], curr_group[0][1] + 1))
+                & set(range(curr_group[1][0], curr_group[1][1] + 1))
+            )
+            last_overlap_set = set(
+                range(curr_group[-1][0], curr_group[-1][1] + 1)
+            ) & set(range(curr_group[-2][0], curr_group[-2][1] + 1))
+            last_overlap = min(last_overlap_set) if last_overlap_set else first_overlap
+            step = 1 if first_overlap <= last_overlap else -1
+            centroid = list(range(first_overlap, last_overlap + step, step))
+        else:
+            centroid = [
+                round(sum([math.ceil((s + e) / 2) for s, e in curr_group]) / len(curr_group))
+            ]
+        centroids.extend(centroid)
+    return centroids
+
+
+def random_intervals(rng, n, span, max_width, duplicates=0.1):
+    """随机生成 n 个闭区间，包含重复、嵌套以及下界大于上界的空区间。"""
+    intervals = []
+    while len(intervals) < n:
+        if intervals and rng.random() < duplicates:
+            intervals.append(rng.choice(intervals))
+            continue
+        start = rng.randint(0, span)
+        intervals.append((start, start + rng.randint(-1, max_width)))
+    return intervals
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_small_random_intervals(seed):
+    rng = random.Random(seed)
+    for _ in range(1000):
+        intervals = random_intervals(
+            rng, rng.randint(0, 14), span=rng.randint(1, 40), max_width=rng.randint(0, 10)
+        )
+        assert window_centroids(intervals) == legacy_find_overlaps(intervals), intervals
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_dense_random_intervals(seed):
+    # 区间密集时连通分量超过 _SCAN_LIMIT，走线段树分组
+    rng = random.Random(seed)
+    for _ in range(20):
+        n = rng.randint(_SCAN_LIMIT + 1, 200)
+        intervals = random_intervals(
+            rng, n, span=rng.randint(n // 4, n), max_width=rng.randint(1, 12), duplicates=0.2
+        )
+        assert window_centroids(intervals) == legacy_find_overlaps(intervals), intervals
+
+
+def test_interleaved_chain():
+    # 每组只有两个区间、其余区间都被跳过：旧实现每组重新扫描全部剩余区间
+    m = 50
+    intervals = [(2 * i, 2 * i + 1) for i in range(m)] + [(2 * i + 1, 2 * i + 2) for i in range(m)]
+    assert window_centroids(intervals) == legacy_find_overlaps(intervals)
+
+
+def test_edge_cases():
+    for intervals in ([], [(3, 2)], [(1, 1), (1, 1)], [(0, 5), (5, 4), (2, 3), (0, 5)]):
+        assert window_centroids(intervals) == legacy_find_overlaps(intervals)
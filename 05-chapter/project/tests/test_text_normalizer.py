@@ -0,0 +1,80 @@
+"""TextNormalizer 与优化前 clean_text 的一致性测试，使用固定的语料。"""
+
+import re
+import string
+
+import pytest
+
+nltk = pytest.importorskip("nltk")
+from nltk.corpus import stopwords
+from nltk.stem import WordNetLemmatizer
+from nltk.tokenize import word_tokenize
+
+from utils import TextNormalizer, clean_text
+
+
+def legacy_clean_text(text):
+    # 优化前 utils.clean_text 的实现：每次调用都重新加载停用词、标点表和词形还原器
+    text = text.replace("[SEP]", "")
+    tokens = word_tokenize(text)
+    tokens = [w.lower() for w in tokens]
+    table = str.maketrans("", "", string.punctuation)
+    stripped = [w.translate(table) for w in tokens]
+    words = [
+        word
+        for word in stripped
+        if word.isalpha()
+        or word.isdigit()
+        or (re.search(r"\d", word) and re.search("[a-zA-Z]", word))
+    ]
+    stop_words = set(stopwords.words("english"))
+    words = [w for w in words if w not in stop_words]
+    lemmatizer = WordNetLemmatizer()
+    lemmatized = [lemmatizer.lemmatize(w) for w in words]
+    return " ".join(lemmatized)
+
+
+CORPUS = [
+    "",
+    "The cars were parked near the houses, and the children's toys lay everywhere.",
+    "GPT-3.5 was released in 2023; v2 of the API (see below) supports e.g. streaming.",
+    "第一部分[SEP]The U.S.A. has 50 states[SEP] and it's a large country.",
+    "Mixed tokens like abc123, 42, x86_64 and COVID-19 should be kept.",
+    "Punctuation!!! ... --- ??? should disappear, leaving the geese and mice.",
+    "Stop words such as the, a, an, of, and, or are removed; lemmas remain.",
+] * 20
+
+
+@pytest.fixture(scope="module")
+def expected():
+    try:
+        return [legacy_clean_text(text) for text in CORPUS]
+    except LookupError:
+        pytest.skip("缺少 NLTK 数据（punkt、stopwords、wordnet）")
+
+
+def test_clean_matches_legacy(expected):
+    normalizer = TextNormalizer()
+    assert [normalizer.clean(text) for text in CORPUS] == expected
+    assert [clean_text(text) for text in CORPUS] == expected
+
+
+def test_clean_many_matches_legacy(expected):
+    normalizer = TextNormalizer(lemma_cache_size=16)
+    assert normalizer.clean_many(CORPUS) == expected
+    assert normalizer.clean_many(CORPUS, max_workers=2, chunksize=8) == expected
+    with normalizer.process_pool(max_workers=2) as executor:
+        assert normalizer.clean_many(CORPUS, chunksize=8, executor=executor) == expected
+        assert normalizer.clean_many(CORPUS[:5], executor=executor) == expected[:5]
+
+
+def test_process_pool_uses_instance_config():
+    normalizer = TextNormalizer(lemma_cache_size=3)
+    with normalizer.process_pool(max_workers=1) as executor:
+        assert executor.submit(_worker_cache_size).result() == 3
+
+
+def _worker_cache_size():
+    import utils
+
+    return utils._worker_normalizer.lemma_cache_size
@@ -0,0 +1,139 @@
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import List
+
+import tiktoken
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+from config import MODEL_NAME
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model_name: str = MODEL_NAME):
+    """
+    获取模型对应的 tiktoken 编码器，同一进程内只创建一次。
+
+    参数:
+        model_name (str): 模型名称。
+
+    返回:
+        tiktoken.Encoding: 编码器。
+    """
+    return tiktoken.get_encoding(tiktoken.encoding_for_model(model_name).name)
+
+
+class TokenCounter:
+    """
+    带缓存的令牌计数器：复用进程级编码器，批量编码未见过的文本，并用有界 LRU 记住
+    重复出现的分隔符和文本片段的长度。
+
+    计数方式与 encoder.encode(text, disallowed_special=()) 相同，特殊标记按普通文本处理。
+
+    属性:
+        model_name (str): 模型名称。
+        maxsize (int): 缓存的文本数量上限。
+    """
+
+    def __init__(self, model_name: str = MODEL_NAME, maxsize: int = 100_000):
+        self.model_name = model_name
+        self.maxsize = maxsize
+        self.encoder = get_encoder(model_name)
+        self._lengths = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        """
+        计算单个文本的令牌数。
+
+        参数:
+            text (str): 需要计数的文本。
+
+        返回:
+            int: 令牌数。
+        """
+        with self._lock:
+            if text in self._lengths:
+                self._lengths.move_to_end(text)
+                return self._lengths[text]
+        length = len(self.encoder.encode_ordinary(text))
+        self._remember(text, length)
+        return length
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        """
+        批量计算文本的令牌数，只对缓存中没有的文本做一次批量编码。
+
+        参数:
+            texts (List[str]): 需要计数的文本列表。
+
+        返回:
+            List[int]: 与 texts 一一对应的令牌数。
+        """
+        with self._lock:
+            missing = list(dict.fromkeys(t for t in texts if t not in self._lengths))
+        if missing:
+            encoded = self.encoder.encode_ordinary_batch(missing)
+            for text, tokens in zip(missing, encoded):
+                self._remember(text, len(tokens))
+        return [self.count(text) for text in texts]
+
+    def _remember(self, text: str, length: int):
+        with self._lock:
+            self._lengths[text] = length
+            self._lengths.move_to_end(text)
+            while len(self._lengths) > self.maxsize:
+                self._lengths.popitem(last=False)
+
+    def __call__(self, text: str) -> int:
+        return self.count(text)
+
+
+@lru_cache(maxsize=None)
+def get_token_counter(model_name: str = MODEL_NAME) -> TokenCounter:
+    """
+    获取进程级共享的令牌计数器。
+
+    参数:
+        model_name (str): 模型名称。
+
+    返回:
+        TokenCounter: 令牌计数器。
+    """
+    return TokenCounter(model_name)
+
+
+class CachedTokenTextSplitter(RecursiveCharacterTextSplitter):
+    """
+    以令牌数为长度的递归文本切分器，length_function 是带缓存的 TokenCounter。
+
+    切分每段文本之前，先按每一级分隔符把整段文本切开，把所有片段交给 TokenCounter 一次批量编码；
+    之后父类逐个检查片段长度时基本都命中缓存，没有预热到的片段照常单独编码。切分逻辑完全由父类完成，
+    结果与使用相同 length_function 的 RecursiveCharacterTextSplitter 一致。
+    """
+
+    def __init__(self, token_counter: TokenCounter = None, **kwargs):
+        token_counter = token_counter or get_token_counter()
+        super().__init__(length_function=token_counter, **kwargs)
+        self._token_counter = token_counter
+
+    def _candidate_pieces(self, text: str) -> List[str]:
+        pieces = []
+        for separator in self._separators:
+            if separator == "":
+                continue
+            pattern = separator if self._is_separator_regex else re.escape(separator)
+            if self._keep_separator:
+                # 分隔符留在后一个片段的开头，与父类的切分方式一致
+                parts = re.split(f"({pattern})", text)
+                pieces.append(parts[0])
+                pieces.extend(parts[i] + parts[i + 1] for i in range(1, len(parts) - 1, 2))
+            else:
+                pieces.append(separator)
+                pieces.extend(re.split(pattern, text))
+        return [piece for piece in pieces if piece]
+
+    def split_text(self, text: str) -> List[str]:
+        self._token_counter.count_many(self._candidate_pieces(text))
+        return super().split_text(text)
@@ -1,10 +1,126 @@
+import os
 import re
+import bisect
+import pickle
 import string
 from enum import Enum
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from nltk.stem import WordNetLemmatizer
 from nltk.tokenize import word_tokenize
 from nltk.corpus import stopwords
-from langchain.schema import Document
+
+class TextNormalizer:
+    """
+    文本清洗器：将文本转换为小写，去除标点符号和停用词，并进行词形还原。
+
+    停用词表、标点删除表和词形还原器只在创建时加载一次，正则表达式预先编译，
+    词形还原的结果保存在有界 LRU 缓存中。
+
+    属性:
+        stop_words (frozenset): 英文停用词。
+        lemma_cache_size (int): 词形还原缓存的词数上限。
+    """
+
+    _digit_pattern = re.compile(r"\d")
+    _alpha_pattern = re.compile(r"[a-zA-Z]")
+
+    def __init__(self, lemma_cache_size: int = 100_000):
+        self.stop_words = frozenset(stopwords.words("english"))
+        self.punctuation_table = str.maketrans("", "", string.punctuation)
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemma_cache_size = lemma_cache_size
+        self._lemmatize = lru_cache(maxsize=lemma_cache_size)(self.lemmatizer.lemmatize)
+
+    def clean(self, text):
+        """
+        清洗单个文本。
+
+        参数:
+            text (str): 要清洗的文本。
+
+        返回:
+            str: 清洗和词形还原后的文本。
+        """
+        # 删除文本中的 [SEP] 标记后分词
+        lemmatized = []
+        for token in word_tokenize(text.replace("[SEP]", "")):
+            # 转换为小写并去除标点符号
+            word = token.lower().translate(self.punctuation_table)
+            # 保留字母、数字或同时包含字母和数字的单词
+            if not (
+                word.isalpha()
+                or word.isdigit()
+                or (self._digit_pattern.search(word) and self._alpha_pattern.search(word))
+            ):
+                continue
+            # 去除停用词后进行词形还原
+            if word not in self.stop_words:
+                lemmatized.append(self._lemmatize(word))
+
+        return " ".join(lemmatized)
+
+    def process_pool(self, max_workers=None):
+        """
+        创建用于批量清洗的进程池，每个子进程启动时按本实例的配置创建自己的清洗器。
+
+        参数:
+            max_workers (int, 可选): 进程数，为 None 时使用全部 CPU 核。
+
+        返回:
+            ProcessPoolExecutor: 可以传给 clean_many 反复使用的进程池。
+        """
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            initializer=_init_worker_normalizer,
+            initargs=(self.lemma_cache_size,),
+        )
+
+    def clean_many(self, texts, max_workers=1, chunksize=64, executor=None):
+        """
+        批量清洗文本，可以在多个进程中并行执行。
+
+        参数:
+            texts (List[str]): 要清洗的文本列表。
+            max_workers (int, 可选): 进程数，为 1 时在当前进程中执行，为 None 时使用全部 CPU 核。
+            chunksize (int, 可选): 每次发送给子进程的文本数量。
+            executor (ProcessPoolExecutor, 可选): 由本实例 process_pool 创建的进程池，
+                多次调用时复用同一个进程池，此时忽略 max_workers。
+
+        返回:
+            List[str]: 与 texts 一一对应的清洗结果。
+        """
+        if executor is not None:
+            return list(executor.map(_clean_in_worker, texts, chunksize=chunksize))
+        if max_workers == 1 or len(texts) <= chunksize:
+            return [self.clean(text) for text in texts]
+        with self.process_pool(max_workers) as executor:
+            return list(executor.map(_clean_in_worker, texts, chunksize=chunksize))
+
+
+# 进程池子进程中的清洗器，由 TextNormalizer.process_pool 的初始化函数按父进程实例的配置创建
+_worker_normalizer = None
+
+
+def _init_worker_normalizer(lemma_cache_size):
+    global _worker_normalizer
+    _worker_normalizer = TextNormalizer(lemma_cache_size=lemma_cache_size)
+
+
+def _clean_in_worker(text):
+    return _worker_normalizer.clean(text)
+
+
+@lru_cache(maxsize=None)
+def get_text_normalizer():
+    """
+    获取进程级共享的文本清洗器。
+
+    返回:
+        TextNormalizer: 文本清洗器。
+    """
+    return TextNormalizer()
+
 
 def clean_text(text):
     """
@@ -16,33 +132,7 @@ def clean_text(text):
     返回:
         str: 清洗和词形还原后的文本。
     """
-    # 删除文本中的 [SEP] 标记
-    text = text.replace("[SEP]", "")
-    # 分词
-    tokens = word_tokenize(text)
-    # 转换为小写
-    tokens = [w.lower() for w in tokens]
-    # 去除标点符号
-    table = str.maketrans("", "", string.punctuation)
-    stripped = [w.translate(table) for w in tokens]
-    # 保留字母、数字或同时包含字母和数字的单词
-    words = [
-        word
-        for word in stripped
-        if word.isalpha()
-        or word.isdigit()
-        or (re.search("\d", word) and re.search("[a-zA-Z]", word))
-    ]
-    # 去除停用词
-    stop_words = set(stopwords.words("english"))
-    words = [w for w in words if w not in stop_words]
-    # 词形还原
-    lemmatizer = WordNetLemmatizer()
-    lemmatized = [lemmatizer.lemmatize(w) for w in words]
-    # 将词列表转换回字符串
-    lemmatized_ = " ".join(lemmatized)
-
-    return lemmatized_
+    return get_text_normalizer().clean(text)
 
 
 class IndexerOperator(Enum):
@@ -68,34 +158,175 @@ class DocIndexer:
     """
     文档索引处理类：用于处理文档的索引和搜索。
 
+    文档只在 documents 中保存一份，索引中只保存行号（文档在列表中的位置）：
+    等值查询使用 值 -> 行号列表 的哈希索引，范围查询使用按值排序的数值列做二分查找，
+    AND/OR 在行号集合上求交集/并集，最终直接返回原始的 Document 对象。
+
+    窗口查询（同一文件中 下界 <= c <= 上界 的块）使用区间索引：每个文件的块按下界排序，
+    并记录该文件最宽的区间，命中的块下界一定落在 [c - 最大宽度, c] 内，二分查找后只检查这一段，
+    耗时为 O(log n + 窗口内的块数)，与文件的总块数无关。区间索引的键由 INTERVAL_KEYS 指定。
+
+    documents 也可以是 ChunkStore：建索引和逐行过滤时只读取元数据列，不构造 Document，
+    此时原始文本（元数据中的 page_content）不参与索引。
+
     属性:
-        documents (List[Document]): 需要索引的文档列表。
+        documents (List[Document] | ChunkStore): 需要索引的文档列表。
     """
 
-    def __init__(self, documents):
+    # (分组键, 下界键, 上界键)
+    INTERVAL_KEYS = (
+        ("source_md5", "large_chunks_index_lower_bound", "large_chunks_index_upper_bound"),
+    )
+
+    def __init__(self, documents, index=None, sorted_columns=None, intervals=None):
         self.documents = documents
-        self.index = self.build_index(documents)
+        if hasattr(documents, "iter_metadata"):
+            self._row_metadata = documents.metadata
+        else:
+            self._row_metadata = lambda row: documents[row].metadata
+        self.index = self.build_index(documents) if index is None else index
+        self.sorted_columns = (
+            self.build_sorted_columns(self.index) if sorted_columns is None else sorted_columns
+        )
+        self.intervals = self.build_intervals(self.index) if intervals is None else intervals
+
+    def save(self, path: str, version: str):
+        """
+        把构建好的索引保存到 pickle 文件，重启时用 load 读取，不必重新遍历元数据。
+
+        参数:
+            path (str): 文件路径。
+            version (str): 语料版本（例如入库清单的 corpus_version），读取时版本不一致则视为失效。
+        """
+        state = {
+            "version": version,
+            "num_rows": len(self.documents),
+            "index": self.index,
+            "sorted_columns": self.sorted_columns,
+            "intervals": self.intervals,
+        }
+        with open(f"{path}.tmp", "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    @classmethod
+    def load(cls, path: str, documents, version: str):
+        """
+        读取 save 保存的索引。
+
+        参数:
+            path (str): 文件路径。
+            documents (List[Document] | ChunkStore): 索引对应的文档。
+            version (str): 当前的语料版本。
+
+        返回:
+            DocIndexer: 文件不存在、版本或行数与当前文档不一致、或由没有区间索引的旧版本保存时返回 None。
+        """
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            state = pickle.load(file)
+        if (
+            state["version"] != version
+            or state["num_rows"] != len(documents)
+            or "intervals" not in state
+        ):
+            return None
+        return cls(
+            documents,
+            index=state["index"],
+            sorted_columns=state["sorted_columns"],
+            intervals=state["intervals"],
+        )
 
     def build_index(self, documents):
         """
-        为给定的文档列表构建索引。
+        为给定的文档列表构建等值索引。
 
         参数:
-            documents (List[Document]): 需要被索引的文档列表。
+            documents (List[Document] | ChunkStore): 需要被索引的文档列表。
 
         返回:
-            dict: 构建的索引。
+            dict: 构建的索引，形如 {key: {value: [行号, ...]}}，行号升序。
         """
+        if hasattr(documents, "iter_metadata"):
+            metadata_rows = documents.iter_metadata()
+        else:
+            metadata_rows = (doc.metadata for doc in documents)
         index = {}
-        for doc in documents:
-            for key, value in doc.metadata.items():
+        for row, metadata in enumerate(metadata_rows):
+            for key, value in metadata.items():
                 if key not in index:
                     index[key] = {}
                 if value not in index[key]:
                     index[key][value] = []
-                index[key][value].append(doc)
+                index[key][value].append(row)
         return index
 
+    def build_sorted_columns(self, index):
+        """
+        为数值型元数据构建按值排序的列，用于范围查询。
+
+        参数:
+            index (dict): build_index 构建的等值索引。
+
+        返回:
+            dict: 形如 {key: (有序值列表, 对应的行号列表)}。
+        """
+        sorted_columns = {}
+        for key, value_rows in index.items():
+            pairs = sorted(
+                (value, row)
+                for value, rows in value_rows.items()
+                if _is_number(value)
+                for row in rows
+            )
+            if pairs:
+                sorted_columns[key] = (
+                    [value for value, _ in pairs],
+                    [row for _, row in pairs],
+                )
+        return sorted_columns
+
+    def build_intervals(self, index):
+        """
+        为 INTERVAL_KEYS 中的每组键构建区间索引。
+
+        参数:
+            index (dict): build_index 构建的等值索引。
+
+        返回:
+            dict: 形如 {(分组键, 下界键, 上界键): {分组值: (有序下界列表, 对应上界列表, 对应行号列表, 最大宽度)}}。
+        """
+        intervals = {}
+        for group_key, lower_key, upper_key in self.INTERVAL_KEYS:
+            if group_key not in index or lower_key not in index or upper_key not in index:
+                continue
+            lower_of, upper_of = {}, {}
+            for bounds, key in ((lower_of, lower_key), (upper_of, upper_key)):
+                for value, rows in index[key].items():
+                    if _is_number(value):
+                        for row in rows:
+                            bounds[row] = value
+            groups = {}
+            for group_value, rows in index[group_key].items():
+                entries = sorted(
+                    (lower_of[row], row)
+                    for row in rows
+                    if row in lower_of and row in upper_of
+                )
+                if not entries:
+                    continue
+                uppers = [upper_of[row] for _, row in entries]
+                groups[group_value] = (
+                    [lower for lower, _ in entries],
+                    uppers,
+                    [row for _, row in entries],
+                    max(upper - lower for (lower, _), upper in zip(entries, uppers)),
+                )
+            intervals[(group_key, lower_key, upper_key)] = groups
+        return intervals
+
     def retrieve_metadata(self, search_dict):
         """
         根据提供的 search_dict 中的搜索条件检索文档。
@@ -104,8 +335,23 @@ class DocIndexer:
             search_dict (dict): 指定搜索条件的字典。可以包含 "AND" 或 "OR" 运算符进行复杂查询。
 
         返回:
-            List[Document]: 符合搜索条件的文档列表。
+            List[Document]: 符合搜索条件的原始文档对象列表，按行号排序。
+        """
+        return [self.documents[row] for row in self.retrieve_row_ids(search_dict)]
+
+    def retrieve_row_ids(self, search_dict):
+        """
+        根据搜索条件检索文档的行号。
+
+        参数:
+            search_dict (dict): 指定搜索条件的字典。可以包含 "AND" 或 "OR" 运算符进行复杂查询。
+
+        返回:
+            List[int]: 升序排列的行号列表。
         """
+        return sorted(self._retrieve_row_set(search_dict))
+
+    def _retrieve_row_set(self, search_dict):
         if "AND" in search_dict:
             return self._handle_and(search_dict["AND"])
         elif "OR" in search_dict:
@@ -114,57 +360,121 @@ class DocIndexer:
             return self._handle_single(search_dict)
 
     def _handle_and(self, search_dicts):
-        # 使用 "AND" 条件进行复杂查询的处理
-        results = [self.retrieve_metadata(sd) for sd in search_dicts]
+        # 使用 "AND" 条件进行复杂查询的处理：对行号集合取交集
+        results = [self._retrieve_row_set(sd) for sd in search_dicts]
         if results:
-            # 取交集
-            intersection = set.intersection(
-                *[set(map(self._hash_doc, r)) for r in results]
-            )
-            return [self._unhash_doc(h) for h in intersection]
+            return set.intersection(*results)
         else:
-            return []
+            return set()
 
     def _handle_or(self, search_dicts):
-        # 使用 "OR" 条件进行复杂查询的处理
-        results = [self.retrieve_metadata(sd) for sd in search_dicts]
-        union = set.union(*[set(map(self._hash_doc, r)) for r in results])
-        return [self._unhash_doc(h) for h in union]
+        # 使用 "OR" 条件进行复杂查询的处理：对行号集合取并集
+        return set().union(*[self._retrieve_row_set(sd) for sd in search_dicts])
 
     def _handle_single(self, search_dict):
-        # 处理单一搜索条件
-        unions = []
-        for key, query in search_dict.items():
-            operator, value = query
-            union = set()
-            # 根据不同的操作符来过滤数据
-            if operator == IndexerOperator.EQ:
-                if key in self.index and value in self.index[key]:
-                    union.update(map(self._hash_doc, self.index[key][value]))
-            else:
-                if key in self.index:
-                    for k, v in self.index[key].items():
-                        if (
-                            (operator == IndexerOperator.GT and k > value)
-                            or (operator == IndexerOperator.GTE and k >= value)
-                            or (operator == IndexerOperator.LT and k < value)
-                            or (operator == IndexerOperator.LTE and k <= value)
-                        ):
-                            union.update(map(self._hash_doc, v))
-            if union:
-                unions.append(union)
-
-        if unions:
-            intersection = set.intersection(*unions)
-            return [self._unhash_doc(h) for h in intersection]
-        else:
-            return []
+        # 处理单一搜索条件：窗口条件走区间索引；否则先取命中行数最少的条件，再用其余条件逐行过滤
+        if not search_dict:
+            return set()
+        rows, remaining = self._match_interval(search_dict)
+        if rows is None:
+            predicates = sorted(
+                search_dict.items(), key=lambda item: self._estimate(item[0], *item[1])
+            )
+            key, (operator, value) = predicates[0]
+            rows = self._rows_for(key, operator, value)
+            remaining = predicates[1:]
+        for key, (operator, value) in remaining:
+            if not rows:
+                break
+            rows = [
+                row
+                for row in rows
+                for metadata in (self._row_metadata(row),)
+                if key in metadata and _compare(metadata[key], operator, value)
+            ]
+        return set(rows)
+
+    def _match_interval(self, search_dict):
+        # 条件中含有 分组键 == g、下界键 <=/< a、上界键 >=/> b 时，用区间索引求出同时满足这三个条件的行，
+        # 返回 (行号列表, 其余条件)；不适用时返回 (None, None)
+        for keys, groups in self.intervals.items():
+            group_key, lower_key, upper_key = keys
+            group = search_dict.get(group_key)
+            lower = search_dict.get(lower_key)
+            upper = search_dict.get(upper_key)
+            if (
+                group is None
+                or lower is None
+                or upper is None
+                or group[0] != IndexerOperator.EQ
+                or lower[0] not in (IndexerOperator.LT, IndexerOperator.LTE)
+                or upper[0] not in (IndexerOperator.GT, IndexerOperator.GTE)
+                or not (_is_number(lower[1]) and _is_number(upper[1]))
+            ):
+                continue
+            remaining = [item for item in search_dict.items() if item[0] not in keys]
+            entry = groups.get(group[1])
+            if entry is None:
+                return [], remaining
+            lowers, uppers, rows, max_width = entry
+            # 上界 >= b 且 上界 - 下界 <= 最大宽度，所以 下界 >= b - 最大宽度
+            start = bisect.bisect_left(lowers, upper[1] - max_width)
+            end = (bisect.bisect_right if lower[0] == IndexerOperator.LTE else bisect.bisect_left)(
+                lowers, lower[1]
+            )
+            return [
+                rows[i] for i in range(start, end) if _compare(uppers[i], upper[0], upper[1])
+            ], remaining
+        return None, None
+
+    def _range_bounds(self, key, operator, value):
+        # 在有序数值列上二分查找范围查询对应的切片
+        values, _ = self.sorted_columns[key]
+        if operator == IndexerOperator.GT:
+            return bisect.bisect_right(values, value), len(values)
+        if operator == IndexerOperator.GTE:
+            return bisect.bisect_left(values, value), len(values)
+        if operator == IndexerOperator.LT:
+            return 0, bisect.bisect_left(values, value)
+        return 0, bisect.bisect_right(values, value)
+
+    def _estimate(self, key, operator, value):
+        # 估计单个条件命中的行数，O(1) 或 O(log n)；没有有序数值列的范围条件只能逐行过滤，估计为全部行
+        if operator == IndexerOperator.EQ:
+            return len(self.index.get(key, {}).get(value, ()))
+        if key not in self.sorted_columns or not _is_number(value):
+            return len(self.documents)
+        start, end = self._range_bounds(key, operator, value)
+        return end - start
+
+    def _rows_for(self, key, operator, value):
+        # 返回单个条件命中的行号
+        if operator == IndexerOperator.EQ:
+            return self.index.get(key, {}).get(value, [])
+        if key not in self.sorted_columns or not _is_number(value):
+            return [
+                row
+                for row in range(len(self.documents))
+                for metadata in (self._row_metadata(row),)
+                if key in metadata and _compare(metadata[key], operator, value)
+            ]
+        start, end = self._range_bounds(key, operator, value)
+        return self.sorted_columns[key][1][start:end]
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
 
-    def _hash_doc(self, doc):
-        # 为文档创建哈希值，以便在集合操作中使用
-        return (doc.page_content, frozenset(doc.metadata.items()))
 
-    def _unhash_doc(self, hashed_doc):
-        # 从哈希值重构文档对象
-        page_content, metadata = hashed_doc
-        return Document(page_content=page_content, metadata=dict(metadata))
+def _compare(actual, operator, value):
+    # 逐行过滤时使用的比较，范围比较只对数值生效，与有序数值列保持一致
+    if operator == IndexerOperator.EQ:
+        return actual == value
+    if not (_is_number(actual) and _is_number(value)):
+        return False
+    return (
+        (operator == IndexerOperator.GT and actual > value)
+        or (operator == IndexerOperator.GTE and actual >= value)
+        or (operator == IndexerOperator.LT and actual < value)
+        or (operator == IndexerOperator.LTE and actual <= value)
+    )
@@ -0,0 +1,241 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional
+
+import numpy as np
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """把向量按行做 L2 归一化并转换为 float32，零向量保持不变。"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def maximal_marginal_relevance(
+    query_vector: np.ndarray,
+    candidate_vectors: np.ndarray,
+    k: int = 4,
+    lambda_mult: float = 0.5,
+) -> List[int]:
+    """
+    向量化的最大边际相关（MMR）选择，选择顺序与 langchain 的 maximal_marginal_relevance 一致。
+
+    每选出一个候选只做一次矩阵-向量乘法，更新各候选与已选集合的最大相似度，
+    不再重复计算两两相似度矩阵。
+
+    参数:
+        query_vector (np.ndarray): 归一化的查询向量。
+        candidate_vectors (np.ndarray): 归一化的候选向量，每行一个。
+        k (int): 选择的数量。
+        lambda_mult (float): 相关性与多样性的权衡，1 为只看相关性。
+
+    返回:
+        List[int]: 选中的候选下标，按选择顺序排列。
+    """
+    k = min(k, len(candidate_vectors))
+    if k <= 0:
+        return []
+    similarity = candidate_vectors @ query_vector
+    selected = [int(np.argmax(similarity))]
+    redundancy = candidate_vectors @ candidate_vectors[selected[0]]
+    available = np.ones(len(candidate_vectors), dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < k:
+        scores = lambda_mult * similarity - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, candidate_vectors @ candidate_vectors[best], out=redundancy)
+    return selected
+
+
+class QueryVectorCache:
+    """
+    带 LRU 缓存的查询嵌入：同一查询在多个检索阶段、多个向量索引之间只嵌入一次。
+
+    属性:
+        embedding (Embeddings): 嵌入客户端，必须与入库时一致。
+        maxsize (int): 缓存的查询数量上限。
+    """
+
+    def __init__(self, embedding: Any, maxsize: int = 256):
+        self.embedding = embedding
+        self.maxsize = maxsize
+        self._vectors = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, query: str) -> np.ndarray:
+        """
+        计算归一化的查询向量。
+
+        参数:
+            query (str): 查询。
+
+        返回:
+            np.ndarray: 归一化的查询向量。
+        """
+        with self._lock:
+            if query in self._vectors:
+                self._vectors.move_to_end(query)
+                return self._vectors[query]
+        vector = normalize_rows(self.embedding.embed_query(query))[0]
+        with self._lock:
+            self._vectors[query] = vector
+            while len(self._vectors) > self.maxsize:
+                self._vectors.popitem(last=False)
+        return vector
+
+
+class VectorFileWriter:
+    """
+    逐批追加向量行的 .npy 文件写入器。行先追加到临时的原始数据文件，close 时再按块复制成 .npy 文件并替换旧文件，
+    写入过程中不需要把整个矩阵放在内存中。作为上下文管理器使用时，发生异常会删除临时文件、保留旧文件。
+
+    参数:
+        path (str): .npy 文件路径。
+        copy_rows (int): close 时每次复制的行数。
+    """
+
+    def __init__(self, path: str, copy_rows: int = 1000):
+        self.path = path
+        self.copy_rows = copy_rows
+        self.num_rows = 0
+        self.dim = None
+        self._rows_path = f"{path}.rows.tmp"
+        self._file = open(self._rows_path, "wb")
+
+    def append(self, vectors):
+        """追加若干行向量，行数为 0 时忽略。"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            return
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        self._file.write(np.ascontiguousarray(vectors).tobytes())
+        self.num_rows += len(vectors)
+
+    def close(self):
+        """把追加的行写成 (行数, 维度) 的 float32 .npy 文件，没有任何行时保存 (0, 0) 矩阵。"""
+        self._file.close()
+        tmp_path = f"{os.path.splitext(self.path)[0]}.tmp.npy"
+        if self.num_rows:
+            shape = (self.num_rows, self.dim)
+            rows = np.memmap(self._rows_path, dtype=np.float32, mode="r", shape=shape)
+            output = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=shape)
+            for start in range(0, self.num_rows, self.copy_rows):
+                output[start : start + self.copy_rows] = rows[start : start + self.copy_rows]
+            output.flush()
+            del rows, output
+        else:
+            np.save(tmp_path, np.zeros((0, 0), dtype=np.float32))
+        os.replace(tmp_path, self.path)
+        os.remove(self._rows_path)
+
+    def abort(self):
+        """放弃写入，删除临时文件。"""
+        self._file.close()
+        os.remove(self._rows_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class VectorIndex:
+    """
+    与文档块存储按行对齐的归一化向量矩阵，在行号子集上做相似度检索或 MMR。
+
+    过滤后的检索只读取子集的向量：同一文件的块在入库时连续存放，按 source_md5 或窗口
+    过滤得到的行号通常是连续区间，此时直接取矩阵切片而不复制，检索耗时只与子集大小有关，
+    不随语料总量增长。
+
+    属性:
+        vectors (np.ndarray): 归一化的 float32 向量矩阵（可以是内存映射），第 i 行对应第 i 个块。
+        query_vectors (QueryVectorCache): 计算查询向量，可以在多个索引之间共享。
+    """
+
+    def __init__(self, vectors, query_vectors: QueryVectorCache):
+        self.vectors = vectors
+        self.query_vectors = query_vectors
+
+    @classmethod
+    def load(cls, path: str, query_vectors: QueryVectorCache) -> "VectorIndex":
+        """
+        内存映射入库时保存的 .npy 向量文件。
+
+        参数:
+            path (str): 向量文件路径。
+            query_vectors (QueryVectorCache): 计算查询向量。
+
+        返回:
+            VectorIndex: 向量索引。
+        """
+        return cls(np.load(path, mmap_mode="r"), query_vectors)
+
+    def close(self):
+        """释放向量矩阵的内存映射，之后不能再检索；已经取出的子集持有各自的引用，不受影响。"""
+        self.vectors = np.zeros((0, self.vectors.shape[1]), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _subset(self, row_ids):
+        # 连续的行号直接取切片，否则按行号取出子集
+        if row_ids is None:
+            return np.arange(len(self.vectors)), self.vectors
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        if len(row_ids) and row_ids[-1] - row_ids[0] == len(row_ids) - 1:
+            return row_ids, self.vectors[row_ids[0] : row_ids[-1] + 1]
+        return row_ids, self.vectors[row_ids]
+
+    def search(
+        self,
+        query: str,
+        k: int = 4,
+        row_ids: Optional[List[int]] = None,
+        search_type: str = "similarity",
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+    ) -> List[int]:
+        """
+        在全部行或升序的行号子集上检索。
+
+        参数:
+            query (str): 查询。
+            k (int): 返回的数量。
+            row_ids (List[int], 可选): 升序的行号子集，为 None 时检索全部行。
+            search_type (str): "similarity" 按余弦相似度排序，"mmr" 先取 fetch_k 个最相似的候选再做 MMR。
+            fetch_k (int): MMR 的候选数量。
+            lambda_mult (float): MMR 中相关性与多样性的权衡。
+
+        返回:
+            List[int]: 行号列表。
+        """
+        rows, vectors = self._subset(row_ids)
+        if len(rows) == 0 or k <= 0:
+            return []
+        query_vector = self.query_vectors(query)
+        similarity = vectors @ query_vector
+        num_candidates = min(fetch_k if search_type == "mmr" else k, len(rows))
+        if num_candidates < len(rows):
+            candidates = np.argpartition(-similarity, num_candidates - 1)[:num_candidates]
+        else:
+            candidates = np.arange(len(rows))
+        candidates = candidates[np.argsort(-similarity[candidates], kind="stable")]
+        if search_type == "mmr":
+            selected = maximal_marginal_relevance(
+                query_vector, np.asarray(vectors[candidates]), k=k, lambda_mult=lambda_mult
+            )
+            candidates = candidates[selected]
+        else:
+            candidates = candidates[:k]
+        return rows[candidates].tolist()
@@ -1,10 +1,14 @@
+import threading
+import weakref
+from collections import OrderedDict
+
 from langchain.chat_models import ChatOpenAI
 from langchain.agents import AgentExecutor, ZeroShotAgent
 from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.memory.chat_message_histories import FileChatMessageHistory
+from langchain.memory import ConversationTokenBufferMemory
 
 
+from agent.history import AppendOnlyChatMessageHistory
 from agent.tools.image import GenerateImageTool
 from agent.tools.search import SearchTool
 from agent.tools.speech import GenerateVoiceTool
@@ -27,14 +31,73 @@ prompt = ZeroShotAgent.create_prompt(
 llm_chain = LLMChain(llm=llm, prompt=prompt)
 agent = ZeroShotAgent(llm_chain=llm_chain, tools=tools, verbose=True)
 
+# 会话缓存：每个用户的代理执行器和记忆常驻内存，超过上限时淘汰最久未使用的会话
+MAX_SESSIONS = 256
+# 提示词中的历史对话最多包含的消息条数和令牌数
+HISTORY_MAX_MESSAGES = 40
+HISTORY_MAX_TOKENS = 2000
+
+
+class AgentSession:
+    def __init__(self, user, lock):
+        history = AppendOnlyChatMessageHistory(file_cache_dir/user, max_messages=HISTORY_MAX_MESSAGES)
+        self.memory = ConversationTokenBufferMemory(
+            llm=llm, memory_key="chat_history", chat_memory=history, max_token_limit=HISTORY_MAX_TOKENS
+        )
+        # 读取的最近消息超过令牌上限时从最早的消息开始丢弃，之后每轮对话保存时由记忆组件裁剪
+        messages = history.messages
+        while messages and llm.get_num_tokens_from_messages(messages) > HISTORY_MAX_TOKENS:
+            messages.pop(0)
+        self.agent_chain = AgentExecutor.from_agent_and_tools(
+            agent=agent, tools=tools, verbose=True, memory=self.memory
+        )
+        # 同一用户的消息可能在不同频道同时处理，执行器、记忆和历史文件不能并发使用；
+        # 锁按用户共享，会话被淘汰后重新创建的会话仍使用同一把锁
+        self.lock = lock
+
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+# 每个用户一把可重入锁，独立于会话缓存：只要有会话或正在进行的对话引用它就不会被回收，
+# 会话在对话进行中被淘汰时，新建的会话仍与旧会话互斥
+_user_locks = weakref.WeakValueDictionary()
+
+
+def _user_lock(user):
+    with _sessions_lock:
+        lock = _user_locks.get(user)
+        if lock is None:
+            lock = _user_locks[user] = threading.RLock()
+        return lock
+
+
+def get_session(user):
+    with _sessions_lock:
+        session = _sessions.get(user)
+        if session is not None:
+            _sessions.move_to_end(user)
+            return session
+    # 在用户锁内创建会话：读取历史时不阻塞其他用户，同一用户只创建一次，
+    # 也不会在旧会话写入历史文件时迁移或修复同一份文件
+    lock = _user_lock(user)
+    with lock:
+        with _sessions_lock:
+            session = _sessions.get(user)
+        if session is None:
+            session = AgentSession(user, lock)
+        with _sessions_lock:
+            _sessions[user] = session
+            _sessions.move_to_end(user)
+            while len(_sessions) > MAX_SESSIONS:
+                _sessions.popitem(last=False)  # 历史已经逐条写入文件，淘汰时不需要保存
+    return session
+
+
 def langchain_agent(user, query):
-    # 创建具有记忆的代理执行器
-    message_history = FileChatMessageHistory(file_cache_dir/user)
-    memory = ConversationBufferMemory(memory_key="chat_history", chat_memory=message_history)   
-    agent_chain = AgentExecutor.from_agent_and_tools(
-        agent=agent, tools=tools, verbose=True, memory=memory
-    )
-    return agent_chain.run(query)
+    # 复用用户的代理执行器和记忆
+    session = get_session(user)
+    with session.lock:
+        return session.agent_chain.run(query)
 
 
 if __name__ == "__main__":
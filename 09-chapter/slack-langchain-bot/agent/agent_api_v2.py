@@ -1,30 +1,60 @@
 import re
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import AsyncIterator, Awaitable, Optional, TypeVar
+from langchain_core.messages import AIMessageChunk, trim_messages
 from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableConfig, RunnableLambda
 from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_deepseek import ChatDeepSeek
+from langgraph.checkpoint.memory import MemorySaver
 from langgraph.constants import END, START
 from langgraph.graph import MessagesState, StateGraph
 from langgraph.prebuilt import ToolNode
-from tools_v2 import generate_image, generate_voice
+from agent.tools_v2 import generate_image, generate_voice
 
 
 tools = [generate_voice, generate_image, TavilySearchResults(max_results=1)]
 
-# 处理对话并使用LLM生成回应
-def agent(state: MessagesState) -> MessagesState:
-    prompt = ChatPromptTemplate.from_messages([
-        (
-            "system",
-            "与人类对话，尽可能回答问题，你可以使用工具"
-        ),
-        ("placeholder", "{messages}"),
-    ])
-    model = ChatDeepSeek(model="deepseek-chat", temperature=0.3)
-    model_with_tools = model.bind_tools(tools)
-    bound = prompt | model_with_tools
-    prediction = bound.invoke({
-        "messages": state["messages"]
-    })
+# 每轮对话送入模型的历史消息条数上限，完整历史仍保存在检查点中
+HISTORY_MAX_MESSAGES = 40
+
+# 提示模板、模型客户端和绑定工具后的调用链在模块加载时创建一次，
+# 所有会话和图的每一步共用同一个模型客户端及其 HTTP 连接池
+prompt = ChatPromptTemplate.from_messages([
+    (
+        "system",
+        "与人类对话，尽可能回答问题，你可以使用工具"
+    ),
+    ("placeholder", "{messages}"),
+])
+model = ChatDeepSeek(model="deepseek-chat", temperature=0.3)
+model_with_tools = model.bind_tools(tools)
+bound = prompt | model_with_tools
+
+
+def _recent_messages(state: MessagesState):
+    # 只保留最近的消息，并从一条用户消息开始，避免工具调用与工具结果被截断成两半
+    return trim_messages(
+        state["messages"],
+        max_tokens=HISTORY_MAX_MESSAGES,
+        token_counter=len,
+        strategy="last",
+        start_on="human",
+    )
+
+
+# 处理对话并使用LLM生成回应，config 向下传递，流式输出时才能收到模型的令牌
+def agent(state: MessagesState, config: RunnableConfig) -> MessagesState:
+    prediction = bound.invoke({"messages": _recent_messages(state)}, config)
+    return {
+        "messages": [prediction],
+    }
+
+
+async def aagent(state: MessagesState, config: RunnableConfig) -> MessagesState:
+    prediction = await bound.ainvoke({"messages": _recent_messages(state)}, config)
     return {
         "messages": [prediction],
     }
@@ -42,8 +72,8 @@ def route_tools(state: MessagesState):
 # 初始化状态图
 builder = StateGraph(MessagesState)  
 
-# 添加节点
-builder.add_node(agent)
+# 添加节点：同步调用时使用 agent，异步调用时使用 aagent
+builder.add_node("agent", RunnableLambda(agent, afunc=aagent))
 builder.add_node("tools", ToolNode(tools))  
 
 
@@ -60,21 +90,88 @@ builder.add_conditional_edges(
 # tools -> agent: 工具调用完成后返回代理处理
 builder.add_edge("tools", "agent")
 
-graph = builder.compile()
+# 图只编译一次，检查点按 thread_id 保存每个会话的消息。
+# MemorySaver 把所有会话保存在进程内存中，每个 Slack 消息串一个会话，不清理会一直增长，
+# 因此按最近使用顺序最多保留 MAX_THREADS 个会话，淘汰的会话从检查点中删除；需要跨重启保留时换成持久化的检查点
+MAX_THREADS = 1000
+checkpointer = MemorySaver()
+graph = builder.compile(checkpointer=checkpointer)
+
+_threads = OrderedDict()
+_threads_lock = threading.Lock()
+
+
+def _touch_thread(thread_id: str) -> None:
+    with _threads_lock:
+        _threads[thread_id] = None
+        _threads.move_to_end(thread_id)
+        evicted = []
+        while len(_threads) > MAX_THREADS:
+            evicted.append(_threads.popitem(last=False)[0])
+    for old_thread_id in evicted:
+        checkpointer.delete_thread(old_thread_id)
 
 
-def langchain_agent(user, query):
-    config = {"configurable": {"user_id": user, "thread_id": "1"}}
-    response = graph.invoke({"messages": [("user", query)]}, 
-            config=config)
+# 模型客户端的异步 HTTP 连接池绑定在打开连接的事件循环上，每次用 asyncio.run 新建事件循环时，
+# 上一个循环中建立的连接就不能再用。所有异步调用都提交到同一个常驻在后台线程中的事件循环
+T = TypeVar("T")
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="agent-event-loop", daemon=True).start()
+    return _loop
+
+
+def run_async(coro: Awaitable[T]) -> T:
+    """在常驻的事件循环中运行协程，阻塞调用线程直到得到结果，可以在多个线程中同时调用。"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
+# 每个 Slack 用户的每个消息串是一个独立的会话；thread_ts 应为消息串根消息的 ts
+# （事件中的 thread_ts，顶层消息取自身的 ts），同一消息串中的回复才能落在同一个会话中
+def thread_config(user: str, thread_ts: Optional[str] = None) -> RunnableConfig:
+    thread_id = f"{user}:{thread_ts}" if thread_ts else user
+    _touch_thread(thread_id)
+    return {"configurable": {"user_id": user, "thread_id": thread_id}}
+
+
+def langchain_agent(user, query, thread_ts=None):
+    response = graph.invoke({"messages": [("user", query)]},
+            config=thread_config(user, thread_ts))
     return response["messages"][-1].content
 
+
+# 异步流式调用：模型生成回答时逐段返回文本，工具调用的中间步骤不返回
+async def astream_agent(user: str, query: str, thread_ts: Optional[str] = None) -> AsyncIterator[str]:
+    async for message, metadata in graph.astream(
+        {"messages": [("user", query)]},
+        config=thread_config(user, thread_ts),
+        stream_mode="messages",
+    ):
+        if metadata.get("langgraph_node") == "agent" and isinstance(message, AIMessageChunk) and message.content:
+            yield message.content
+
+
+async def _print_stream(user, query):
+    async for text in astream_agent(user, query):
+        print(text, end="", flush=True)
+    print()
+
+
+# 在项目根目录运行：python -m agent.agent_api_v2
 if __name__ == "__main__":
     
     while True:
         user_input = input("人类: ")
         # 处理用户输入
         user_query = re.sub(r"^人类: ", "", user_input)
-        # 运行代理
-        print(f"AI: {langchain_agent('1', user_query)}")
-        print("=" * 30)
\ No newline at end of file
+        # 运行代理，边生成边输出
+        print("AI: ", end="")
+        run_async(_print_stream("1", user_query))
+        print("=" * 30)
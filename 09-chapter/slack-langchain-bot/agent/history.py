@@ -0,0 +1,107 @@
+import json
+import struct
+import logging
+from pathlib import Path
+from typing import List
+
+from langchain.schema import BaseChatMessageHistory
+from langchain.schema.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+logger = logging.getLogger(__name__)
+
+# 索引文件中每条消息的起始偏移，8 字节小端无符号整数
+_OFFSET = struct.Struct("<Q")
+
+
+class AppendOnlyChatMessageHistory(BaseChatMessageHistory):
+    """
+    只追加写入的聊天记录：每条消息是 .jsonl 文件中的一行，.idx 文件按顺序记录每行的起始偏移。
+
+    打开时通过索引定位并只读取最后 max_messages 条消息，写入时在两个文件末尾各追加一条，
+    读写量与历史总长度无关。messages 只保存已读取的最近消息，可以被记忆组件从头部裁剪，
+    裁剪不影响文件中的完整记录。
+
+    旧版 FileChatMessageHistory 的 JSON 文件（与用户同名、不带扩展名）在第一次打开时转换为新格式，
+    原文件重命名为 .migrated。
+    """
+
+    def __init__(self, file_path: Path, max_messages: int = 40):
+        self.file_path = Path(file_path)
+        self.data_path = self.file_path.with_name(self.file_path.name + ".jsonl")
+        self.index_path = self.file_path.with_name(self.file_path.name + ".idx")
+        self.max_messages = max_messages
+        if not self.index_path.exists() and self.file_path.is_file():
+            self._migrate()
+        self._repair()
+        self.messages: List[BaseMessage] = self.load_tail(max_messages)
+
+    def _migrate(self):
+        items = json.loads(self.file_path.read_text() or "[]")
+        self._append(messages_from_dict(items))
+        self.file_path.rename(self.file_path.with_name(self.file_path.name + ".migrated"))
+        logger.info("migrated %d messages from %s", len(items), self.file_path)
+
+    def _repair(self):
+        # 写入中断时：索引截断到完整的偏移，数据文件补上换行，半行记录在读取时跳过
+        if self.index_path.exists():
+            size = self.index_path.stat().st_size
+            if size % _OFFSET.size:
+                with open(self.index_path, "r+b") as f:
+                    f.truncate(size - size % _OFFSET.size)
+        if self.data_path.exists() and self.data_path.stat().st_size:
+            with open(self.data_path, "rb") as f:
+                f.seek(-1, 2)
+                complete = f.read(1) == b"\n"
+            if not complete:
+                with open(self.data_path, "ab") as f:
+                    f.write(b"\n")
+
+    def __len__(self):
+        return self.index_path.stat().st_size // _OFFSET.size if self.index_path.exists() else 0
+
+    def load_tail(self, n: int) -> List[BaseMessage]:
+        """从文件中读取最后 n 条消息。"""
+        count = len(self)
+        n = min(n, count)
+        if n <= 0:
+            return []
+        with open(self.index_path, "rb") as f:
+            f.seek((count - n) * _OFFSET.size)
+            (start,) = _OFFSET.unpack(f.read(_OFFSET.size))
+        with open(self.data_path, "rb") as f:
+            f.seek(start)
+            lines = f.read().splitlines()
+        items = []
+        for line in lines:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                logger.warning("skip broken history record in %s", self.data_path)
+        return messages_from_dict(items[-n:])
+
+    def _append(self, messages: List[BaseMessage]):
+        records = [
+            (json.dumps(item, ensure_ascii=False) + "\n").encode("utf-8") for item in messages_to_dict(messages)
+        ]
+        offsets = []
+        with open(self.data_path, "ab") as f:
+            offset = f.seek(0, 2)
+            for record in records:
+                offsets.append(_OFFSET.pack(offset))
+                offset += len(record)
+            f.write(b"".join(records))
+        with open(self.index_path, "ab") as f:
+            f.write(b"".join(offsets))
+
+    def add_message(self, message: BaseMessage) -> None:
+        """在文件末尾追加一条消息，内存中只保留最近 max_messages 条。"""
+        self._append([message])
+        self.messages.append(message)
+        if len(self.messages) > self.max_messages:
+            del self.messages[: len(self.messages) - self.max_messages]
+
+    def clear(self) -> None:
+        """清空文件和内存中的记录。"""
+        for path in (self.data_path, self.index_path):
+            path.write_bytes(b"")
+        self.messages.clear()
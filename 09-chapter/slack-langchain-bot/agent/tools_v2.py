@@ -12,8 +12,8 @@ from langchain_core.tools import tool
 from azure.cognitiveservices.speech import SpeechConfig, SpeechSynthesizer, ResultReason, CancellationReason, SpeechSynthesisOutputFormat
 from azure.cognitiveservices.speech.audio import AudioOutputConfig
 
-from tools.utils import voice_cache_dir
-from tools.utils import file_cache_dir
+from agent.tools.utils import voice_cache_dir
+from agent.tools.utils import file_cache_dir
 
 
 # 获取环境变量中的 API 密钥
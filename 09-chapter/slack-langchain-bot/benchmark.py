@@ -0,0 +1,133 @@
+"""
+Slack 机器人的微基准测试，不依赖 Slack 和模型服务：
+
+    python benchmark.py usage --users 100000 --requests 1000000
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+import multiprocessing
+from typing import Dict, List
+
+from libs.cache import KeyValueStore
+from libs.usage import RateLimiter
+
+
+class LegacyRateLimiter:
+    """改动前的 RateLimiter，时间改为参数传入，便于用模拟时钟对比。"""
+
+    def __init__(self, limit: int = 10, period: int = 3600):
+        self.limit = limit
+        self.period = period
+        self.users: Dict[str, List[float]] = {}
+
+    def allow_request(self, user_id: str, now: float) -> bool:
+        user_requests = self.users.get(user_id, [])
+        user_requests = [req for req in user_requests if req > now - self.period]
+        if len(user_requests) < self.limit:
+            user_requests.append(now)
+            self.users[user_id] = user_requests
+            return True
+        return False
+
+
+def request_stream(users: int, requests: int, duration: float, seed: int = 0):
+    """模拟请求流：时间均匀推进，1% 的活跃用户发出一半的请求。"""
+    rng = random.Random(seed)
+    hot = max(1, users // 100)
+    step = duration / requests
+    return [
+        (f"U{rng.randrange(hot) if rng.random() < 0.5 else rng.randrange(users)}", i * step)
+        for i in range(requests)
+    ]
+
+
+def bench_limiter(stream, limit: int, period: int):
+    results = {}
+    for name, limiter in (
+        ("before", LegacyRateLimiter(limit, period)),
+        ("after", RateLimiter(limit, period)),
+    ):
+        tracemalloc.start()
+        start = time.perf_counter()
+        decisions = [limiter.allow_request(user, now) for user, now in stream]
+        seconds = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results[name] = decisions
+        print(
+            f"{name:>6}: {seconds / len(stream) * 1e6:.2f} us/请求, 放行 {sum(decisions)}, "
+            f"结束时保存的用户 {len(limiter.users)}, 内存峰值 {peak / 1024 / 1024:.1f} MB"
+        )
+    print(f"判断一致: {results['before'] == results['after']}")
+
+
+def _increment_worker(path: str, keys: List[str], rounds: int):
+    store = KeyValueStore(path)
+    for _ in range(rounds):
+        for key in keys:
+            store.increment(key, "message_count", default={"message_count": 0, "message_limit": 10})
+
+
+def bench_store(users: int, processes: int):
+    with tempfile.TemporaryDirectory() as path:
+        store = KeyValueStore(path)
+        start = time.perf_counter()
+        for i in range(users):
+            store.increment(f"U{i}", "message_count", default={"message_count": 0, "message_limit": 10})
+        seconds = time.perf_counter() - start
+        print(f"单进程 increment: {users} 个用户, {seconds / users * 1e6:.1f} us/次")
+
+        start = time.perf_counter()
+        for i in range(users):
+            store.get(f"U{i}")
+        seconds = time.perf_counter() - start
+        print(f"单进程 get: {seconds / users * 1e6:.1f} us/次")
+
+        # 多个进程同时累加同一批键，检查没有丢失更新
+        keys, rounds = [f"U{i}" for i in range(50)], 20
+        workers = [
+            multiprocessing.Process(target=_increment_worker, args=(path, keys, rounds))
+            for _ in range(processes)
+        ]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        seconds = time.perf_counter() - start
+        expected = 1 + processes * rounds
+        counts = [store.get(key)["message_count"] for key in keys]
+        print(
+            f"{processes} 个进程并发 increment: {processes * rounds * len(keys)} 次, {seconds:.2f} s, "
+            f"计数正确: {all(count == expected for count in counts)}"
+        )
+        print(f"数据库大小: {sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)) / 1024 / 1024:.1f} MB")
+
+
+def bench_usage(users: int, requests: int, limit: int, period: int, processes: int):
+    """用模拟时钟对比新旧频率限制器的判断、耗时和内存，并测试键值存储的吞吐量和多进程计数。"""
+    # 模拟时长为三个时间段，前期活跃、后期不再出现的用户应当被淘汰
+    stream = request_stream(users, requests, duration=3 * period)
+    print(f"频率限制: {users} 个用户, {requests} 次请求, limit={limit}, period={period}s")
+    bench_limiter(stream, limit, period)
+    bench_store(users, processes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Slack 机器人的微基准测试")
+    subparsers = parser.add_subparsers(dest="name", required=True)
+    usage = subparsers.add_parser("usage", help="频率限制器与使用量存储的耗时、内存与一致性")
+    usage.add_argument("--users", type=int, default=100000)
+    usage.add_argument("--requests", type=int, default=1000000)
+    usage.add_argument("--limit", type=int, default=10)
+    usage.add_argument("--period", type=int, default=3600)
+    usage.add_argument("--processes", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.name == "usage":
+        bench_usage(args.users, args.requests, args.limit, args.period, args.processes)
@@ -0,0 +1,147 @@
+"""
+基于 SQLite 的键值存储，值为可以 JSON 序列化的字典。
+
+数据库使用 WAL 模式，读写可以并发，多个工作进程打开同一个目录即可共享数据；
+update 和 increment 在一个 IMMEDIATE 事务中完成读改写，多个进程同时修改同一个键时不会丢失更新。
+"""
+
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+
+class KeyValueStore:
+    def __init__(self, cache_dir: str, filename: str = "store.sqlite", timeout: float = 30.0):
+        """打开（或创建）一个键值存储。
+
+        Args:
+            cache_dir (str): 数据库所在的目录，不存在时自动创建。
+            filename (str): 数据库文件名。
+            timeout (float): 等待其他进程释放写锁的最长时间（秒）。
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = self.cache_dir / filename
+        self.timeout = timeout
+        self._local = threading.local()  # sqlite3 连接不能跨线程使用，每个线程一个连接
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None：由代码显式控制事务，单条语句自动提交
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取键对应的值。
+
+        Args:
+            key (str): 键。
+
+        Returns:
+            Optional[Dict[str, Any]]: 值，键不存在时为None。
+        """
+        row = self._connection().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set(self, key: str, value: Dict[str, Any]) -> None:
+        """写入键值，已存在时覆盖。
+
+        Args:
+            key (str): 键。
+            value (Dict[str, Any]): 值。
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value))
+        )
+
+    def setdefault(self, key: str, value: Dict[str, Any]) -> Dict[str, Any]:
+        """键不存在时写入 value，已存在时保持不变，判断和写入在一条语句中完成。
+
+        Args:
+            key (str): 键。
+            value (Dict[str, Any]): 键不存在时写入的值。
+
+        Returns:
+            Dict[str, Any]: 键当前的值。
+        """
+        conn = self._connection()
+        conn.execute("INSERT OR IGNORE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        return self.get(key)
+
+    def delete(self, key: str) -> bool:
+        """删除键。
+
+        Args:
+            key (str): 键。
+
+        Returns:
+            bool: 键存在并被删除则为True，否则为False。
+        """
+        return self._connection().execute("DELETE FROM kv WHERE key = ?", (key,)).rowcount > 0
+
+    def update(
+        self,
+        key: str,
+        func: Callable[[Dict[str, Any]], Dict[str, Any]],
+        default: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """原子地读取、修改并写回一个键。
+
+        事务以 BEGIN IMMEDIATE 开始，先取得写锁再读取，其他进程的修改要么在读取之前完成，
+        要么等本事务提交之后才开始。
+
+        Args:
+            key (str): 键。
+            func (Callable[[Dict[str, Any]], Dict[str, Any]]): 根据旧值返回新值的函数。
+            default (Optional[Dict[str, Any]]): 键不存在时作为旧值，为None时使用空字典。
+
+        Returns:
+            Dict[str, Any]: 写入的新值。
+        """
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+            value = func(json.loads(row[0]) if row is not None else dict(default or {}))
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return value
+
+    def increment(
+        self, key: str, field: str, amount: int = 1, default: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """原子地给一个键的某个字段加上 amount。
+
+        Args:
+            key (str): 键。
+            field (str): 字段名，不存在时从 0 开始。
+            amount (int): 增量。
+            default (Optional[Dict[str, Any]]): 键不存在时的初始值。
+
+        Returns:
+            int: 字段更新后的值。
+        """
+
+        def add(value: Dict[str, Any]) -> Dict[str, Any]:
+            value[field] = value.get(field, 0) + amount
+            return value
+
+        return self.update(key, add, default)[field]
+
+    def close(self) -> None:
+        """关闭当前线程的连接。"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -1,10 +1,12 @@
 """
 这段代码的主要目的是通过 UsageTracker 类来跟踪和限制用户的消息使用情况，
 并通过 RateLimiter 类来限制用户在给定时间段内的请求频率。
+消息计数保存在 SQLite 键值存储中，多个工作进程共享；频率限制在进程内存中判断。
 使用了 Pydantic 的 BaseModel 来定义 UsageEntry，这为消息使用情况提供了结构化的表示。代
 码中充分考虑了类型注解，以增强代码的可读性和可维护性。
 """
 
+from collections import OrderedDict
 from typing import Optional, Dict, List
 from pydantic import BaseModel
 from libs.cache import KeyValueStore
@@ -16,9 +18,23 @@ class UsageEntry(BaseModel):
     message_limit: int = 0  # 用户的消息限额
 
 
+class _UserWindow:
+    __slots__ = ("times", "head", "last")
+
+    def __init__(self):
+        self.times: List[float] = []  # 环形缓冲区，保存最近 limit 次放行的时间，写满之前按顺序追加
+        self.head = 0  # 写满之后最早一次放行所在的位置
+        self.last = float("-inf")  # 最近一次放行的时间
+
+
 class RateLimiter:
     def __init__(self, limit: int = 10, period: int = 3600):
-        """初始化一个请求频率限制器。
+        """初始化一个请求频率限制器（滑动窗口）。
+
+        每个用户用长度为 limit 的环形缓冲区记录最近 limit 次放行的时间，缓冲区中最早的时间
+        早于 period 之前即可放行，判断和记录都是 O(1)。
+        用户按最近放行时间排列，最近一次放行也已超出时间段的用户不再影响判断，
+        每次请求时从最久未活跃的一端淘汰，均摊 O(1)，内存只与活跃用户数有关。
 
         Args:
             limit (int): 时间段内允许的最大请求次数。
@@ -26,25 +42,54 @@ class RateLimiter:
         """
         self.limit = limit
         self.period = period
-        self.users: Dict[str, List[float]] = {}  # 存储用户请求时间戳的字典
+        self.users: "OrderedDict[str, _UserWindow]" = OrderedDict()  # 按最近放行时间排列的活跃用户
 
-    def allow_request(self, user_id: str) -> bool:
+    def allow_request(self, user_id: str, now: Optional[float] = None) -> bool:
         """判断给定用户的请求是否允许。
 
         Args:
             user_id (str): 用户ID。
+            now (Optional[float]): 当前时间（秒），默认为 time.monotonic()。
 
         Returns:
             bool: 如果允许请求则为True，否则为False。
         """
-        now = time.time()
-        user_requests = self.users.get(user_id, [])
-        user_requests = [req for req in user_requests if req > now - self.period]
-        if len(user_requests) < self.limit:
-            user_requests.append(now)
-            self.users[user_id] = user_requests
-            return True
-        return False
+        if now is None:
+            now = time.monotonic()
+        self.evict_idle(now)
+        window = self.users.get(user_id)
+        if window is None:
+            window = self.users[user_id] = _UserWindow()
+        if len(window.times) < self.limit:
+            window.times.append(now)
+        elif window.times[window.head] > now - self.period:
+            return False
+        else:
+            window.times[window.head] = now
+            window.head = (window.head + 1) % self.limit
+        window.last = now
+        self.users.move_to_end(user_id)
+        return True
+
+    def evict_idle(self, now: Optional[float] = None) -> int:
+        """淘汰最近一次放行已超出时间段的用户。
+
+        Args:
+            now (Optional[float]): 当前时间（秒），默认为 time.monotonic()。
+
+        Returns:
+            int: 淘汰的用户数。
+        """
+        if now is None:
+            now = time.monotonic()
+        evicted = 0
+        while self.users:
+            window = next(iter(self.users.values()))
+            if window.last > now - self.period:
+                break
+            self.users.popitem(last=False)
+            evicted += 1
+        return evicted
 
 
 class UsageTracker:
@@ -67,9 +112,11 @@ class UsageTracker:
         Returns:
             UsageEntry: 用户的消息使用情况。
         """
-        if not self.user_exists(chat_id):
-            self.add_user(chat_id)
-        return UsageEntry(**self.kv_store.get(chat_id))
+        usage_entry = self.kv_store.get(chat_id)
+        if usage_entry is None:
+            # 新用户的记录只在不存在时写入，不会覆盖其他进程同时写入的计数
+            usage_entry = self.kv_store.setdefault(chat_id, self._new_usage().dict())
+        return UsageEntry(**usage_entry)
 
     def set_usage(self, chat_id: str, usage: UsageEntry) -> None:
         """设置指定用户的消息使用情况。
@@ -89,19 +136,22 @@ class UsageTracker:
         Returns:
             bool: 如果超出限额则为True，否则为False。
         """
-        usage_entry = self.kv_store.get(chat_id)
+        usage_entry = self.get_usage(chat_id)
         return (
-            usage_entry["message_limit"] > 0 and
-            usage_entry["message_count"] >= usage_entry["message_limit"]
+            usage_entry.message_limit > 0 and
+            usage_entry.message_count >= usage_entry.message_limit
         )
 
     def add_user(self, chat_id: str) -> None:
-        """为新用户添加消息使用情况记录。
+        """为新用户添加消息使用情况记录，用户已存在时不做修改。
 
         Args:
             chat_id (str): 用户的聊天ID。
         """
-        self.set_usage(chat_id, UsageEntry(message_limit=self.n_free_messages))
+        self.kv_store.setdefault(chat_id, self._new_usage().dict())
+
+    def _new_usage(self) -> UsageEntry:
+        return UsageEntry(message_limit=self.n_free_messages)
 
     def user_exists(self, chat_id: str) -> bool:
         """检查指定用户是否已有消息使用情况记录。
@@ -128,10 +178,10 @@ class UsageTracker:
             Exception: 如果用户超出了频率限制。
         """
         if self.rate_limiter.allow_request(chat_id):
-            usage_entry = self.get_usage(chat_id)
-            usage_entry.message_count += n_messages
-            self.set_usage(chat_id, usage_entry)
-            return usage_entry.message_count
+            # 在存储中原子地累加，多个工作进程同时计数时不会丢失
+            return self.kv_store.increment(
+                chat_id, "message_count", n_messages, default=self._new_usage().dict()
+            )
         else:
             raise Exception("超出频率限制")
 
@@ -142,6 +192,4 @@ class UsageTracker:
             chat_id (str): 用户的聊天ID。
             n_messages (int): 要增加的消息限额。
         """
-        usage_entry = self.get_usage(chat_id)
-        usage_entry.message_limit += n_messages
-        self.set_usage(chat_id, usage_entry)
+        self.kv_store.increment(chat_id, "message_limit", n_messages, default=self._new_usage().dict())
@@ -6,6 +6,7 @@ from slack_bolt import App, BoltResponse
 from slack_bolt.error import BoltUnhandledRequestError
 
 from slack.slack_api import SlackAPIHandler
+from slack.event_queue import EventPipeline
 from slack.article_push import schedule_articles
 from dotenv import load_dotenv
 
@@ -23,6 +24,11 @@ slack_app = App(
 
 slack_handler = SlackRequestHandler(slack_app)  # 创建一个Slack请求处理器
 slack_api_handler = SlackAPIHandler(slack_app)  # 创建一个处理Slack API事件的处理器
+# 事件在后台线程池中处理，请求处理器只负责去重和入队，保证 3 秒内确认
+event_pipeline = EventPipeline(
+    num_workers=int(os.environ.get("SLACK_EVENT_WORKERS", 4)),
+    max_pending=int(os.environ.get("SLACK_EVENT_QUEUE_SIZE", 1000)),
+)
 
 @app.route("/webhook/events", methods=["POST"])  # 定义一个路由来处理来自Slack的事件
 def slack_events():
@@ -37,17 +43,26 @@ def handle_errors(error):
         return BoltResponse(status=500, body="出错了！")  # 其他错误
     
 @slack_app.event(event="message")
-def handle_message(event, say, logger):
-    slack_api_handler.process_event(event, say, logger)  # 处理收到的消息事件
+def handle_message(body, event, say, logger):
+    # 入队后立即返回，处理收到的消息事件在工作线程中完成
+    event_pipeline.submit(
+        body.get("event_id"), event, lambda: slack_api_handler.process_event(event, say, logger)
+    )
     
 # @slack_app.event("app_mention")
-# def handle_mentions(event, say, logger):
-#     slack_api_handler.process_event(event, say, logger)  # 处理收到的消息事件
+# def handle_mentions(body, event, say, logger):
+#     event_pipeline.submit(
+#         body.get("event_id"), event, lambda: slack_api_handler.process_event(event, say, logger)
+#     )
 
 @app.route('/ping')
 def ping():
     return jsonify({'message': 'pong'})
 
+@app.route('/metrics')
+def metrics():
+    return jsonify(event_pipeline.metrics())  # 队列深度和处理延迟
+
 # scheduler = APScheduler()
 # scheduler.api_enabled = True
 # scheduler.init_app(app)
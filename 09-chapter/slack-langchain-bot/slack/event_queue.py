@@ -0,0 +1,208 @@
+"""
+Slack 事件的队列化处理：收到事件后只做去重和入队，HTTP 请求立即返回，
+由固定数量的工作线程在后台处理。同一频道的事件按到达顺序串行处理，不同频道之间并行。
+
+Slack 在 3 秒内没有收到确认时会重发事件（event_id 相同），同一条消息也可能以不同的
+事件类型重复到达（ts 相同），两种情况都由 EventDeduplicator 过滤。
+"""
+
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduplicator:
+    def __init__(self, ttl: float = 600, max_size: int = 10000):
+        """初始化一个带过期时间的事件去重器。
+
+        Args:
+            ttl (float): 记录保留的时间（秒），需覆盖 Slack 的重试间隔。
+            max_size (int): 最多保留的记录数，超出时丢弃最早的记录。
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._seen: "OrderedDict[str, float]" = OrderedDict()  # 键 -> 过期时间，按插入顺序即过期顺序排列
+        self._lock = threading.Lock()
+
+    def seen(self, *keys: Optional[str]) -> bool:
+        """判断事件是否已经出现过，并记录本次出现的键。
+
+        Args:
+            keys (Optional[str]): 事件的各个去重键，例如 event_id 和 频道:ts，None 会被忽略。
+
+        Returns:
+            bool: 任意一个键已经出现过则为True，否则为False。
+        """
+        keys = [key for key in keys if key]
+        now = time.monotonic()
+        with self._lock:
+            while self._seen and (next(iter(self._seen.values())) <= now or len(self._seen) > self.max_size):
+                self._seen.popitem(last=False)
+            duplicate = any(key in self._seen for key in keys)
+            for key in keys:
+                self._seen[key] = now + self.ttl
+                self._seen.move_to_end(key)
+            return duplicate
+
+
+class _QueuedEvent:
+    def __init__(self, task: Callable[[], None], channel: str):
+        self.task = task
+        self.channel = channel
+        self.enqueued_at = time.monotonic()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+class EventPipeline:
+    def __init__(
+        self,
+        num_workers: int = 4,
+        max_pending: int = 1000,
+        deduplicator: Optional[EventDeduplicator] = None,
+        latency_window: int = 1000,
+    ):
+        """初始化事件处理流水线并启动工作线程。
+
+        每个频道有自己的待处理队列，频道本身在就绪队列中最多出现一次：工作线程取出一个频道，
+        处理该频道最早的事件，处理完后若频道仍有事件再把频道放回就绪队列。这样同一频道的
+        事件不会被两个线程同时处理，而一个频道积压时也不会阻塞其他频道。
+
+        Args:
+            num_workers (int): 工作线程数，即同时处理的事件数上限。
+            max_pending (int): 所有频道待处理事件总数的上限，超出时新事件被丢弃。
+            deduplicator (Optional[EventDeduplicator]): 去重器，默认新建一个。
+            latency_window (int): 计算延迟分位数时保留的最近事件数。
+        """
+        self.num_workers = num_workers
+        self.max_pending = max_pending
+        self.deduplicator = deduplicator or EventDeduplicator()
+        self._channels: Dict[str, Deque[_QueuedEvent]] = {}  # 有事件待处理或正在处理的频道
+        self._ready: "queue.Queue[Optional[str]]" = queue.Queue()  # 可以被取走处理的频道
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._in_flight = 0
+        self._counters = {"received": 0, "duplicates": 0, "dropped": 0, "processed": 0, "failed": 0}
+        self._wait_seconds: Deque[float] = deque(maxlen=latency_window)
+        self._run_seconds: Deque[float] = deque(maxlen=latency_window)
+        self._workers = [
+            threading.Thread(target=self._work, name=f"slack-event-worker-{i}", daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def submit(self, event_id: Optional[str], event: dict, task: Callable[[], None]) -> bool:
+        """去重后把事件放入所在频道的队列，立即返回。
+
+        Args:
+            event_id (Optional[str]): 事件回调中的 event_id。
+            event (dict): 事件内容，用其中的 channel 和 ts 排序和去重。
+            task (Callable[[], None]): 处理事件的函数。
+
+        Returns:
+            bool: 事件已入队则为True，重复或队列已满则为False。
+        """
+        channel = event.get("channel", "")
+        ts = event.get("ts")
+        with self._lock:
+            self._counters["received"] += 1
+            # 先检查容量再记录去重键：因队列已满被丢弃的事件不能留下记录，否则 Slack 重试时会被当作重复事件
+            if self._pending >= self.max_pending:
+                self._counters["dropped"] += 1
+                logger.warning("event queue full (%d), drop event %s", self._pending, event_id)
+                return False
+            if self.deduplicator.seen(event_id, f"{channel}:{ts}" if ts else None):
+                self._counters["duplicates"] += 1
+                logger.info("skip duplicate event %s (%s:%s)", event_id, channel, ts)
+                return False
+            self._pending += 1
+            pending = self._channels.get(channel)
+            if pending is None:
+                self._channels[channel] = deque([_QueuedEvent(task, channel)])
+                self._ready.put(channel)
+            else:
+                pending.append(_QueuedEvent(task, channel))
+        return True
+
+    def _work(self):
+        while True:
+            channel = self._ready.get()
+            if channel is None:
+                return
+            with self._lock:
+                item = self._channels[channel].popleft()
+                self._in_flight += 1
+            started = time.monotonic()
+            try:
+                item.task()
+                failed = False
+            except Exception:
+                logger.exception("failed to process event in channel %s", channel)
+                failed = True
+            finished = time.monotonic()
+            with self._lock:
+                self._in_flight -= 1
+                self._pending -= 1
+                self._counters["failed" if failed else "processed"] += 1
+                self._wait_seconds.append(started - item.enqueued_at)
+                self._run_seconds.append(finished - started)
+                if self._channels[channel]:
+                    self._ready.put(channel)
+                else:
+                    del self._channels[channel]
+
+    def metrics(self) -> Dict[str, object]:
+        """返回队列深度和处理延迟等指标。
+
+        Returns:
+            Dict[str, object]: queue_depth（等待处理的事件数）、in_flight（正在处理的事件数）、
+                active_channels（有事件的频道数）、各计数，以及最近事件排队等待和处理耗时的
+                p50/p95/max（秒）。
+        """
+        with self._lock:
+            wait_seconds = list(self._wait_seconds)
+            run_seconds = list(self._run_seconds)
+            metrics = {
+                "queue_depth": self._pending - self._in_flight,
+                "in_flight": self._in_flight,
+                "active_channels": len(self._channels),
+                "workers": self.num_workers,
+                **self._counters,
+            }
+        for name, values in (("wait", wait_seconds), ("processing", run_seconds)):
+            metrics[f"{name}_seconds"] = {
+                "p50": _percentile(values, 50),
+                "p95": _percentile(values, 95),
+                "max": max(values, default=0.0),
+            }
+        return metrics
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """处理完已入队的事件后停止工作线程。
+
+        Args:
+            timeout (Optional[float]): 每个工作线程最长等待时间（秒）。
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                if self._pending == 0:
+                    break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
+        for _ in self._workers:
+            self._ready.put(None)
+        for worker in self._workers:
+            worker.join(timeout)
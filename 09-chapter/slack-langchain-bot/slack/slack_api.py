@@ -1,6 +1,13 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import tempfile
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import AsyncIterator, Optional, Tuple
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_deepseek import ChatDeepSeek
 
@@ -19,10 +26,20 @@ chat_prompt = ChatPromptTemplate.from_messages([
 
 
 from libs.usage import UsageTracker
-from libs.utils import md5, get_text_from_whisper, format_dialog_text
+from libs.utils import get_text_from_whisper, format_dialog_text
 from libs.utils import index_cache_dir
 from agent.agent_api import langchain_agent
 
+logger = logging.getLogger(__name__)
+
+# Slack 文件 ID 到缓存文件名的映射，同一个文件再次出现时不需要重新下载
+file_id_cache_dir = index_cache_dir / ".file_ids"
+file_id_cache_dir.mkdir(parents=True, exist_ok=True)
+
+
+class FileTooLargeError(Exception):
+    pass
+
 class SlackContext:
     def __init__(self, event: dict, say, user: str, thread_ts: str):
         self.event = event
@@ -38,8 +55,15 @@ class SlackAPIHandler:
         self.image_extension_allowed = ["png", "jpg", "jepg", "webp"]
         self.file_extension_allowed = ["pdf", "txt", "mdx", "md", "markdown"]
         self.max_file_size = 10 * 1024 * 1024
+        self.download_chunk_size = 64 * 1024
+        # 复用连接的下载会话，多个工作线程共享连接池
+        self.session = requests.Session()
+        self.session.headers["Authorization"] = "Bearer " + self.client.token
+        self.session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
         self.usage = UsageTracker()
         self.chat_model = ChatDeepSeek(model="deepseek-chat")
+        # 开启后文字消息交给 LangGraph 代理，边生成边更新回复
+        self.stream_replies = os.environ.get("SLACK_STREAM_REPLIES", "").lower() in ("1", "true")
 
     def process_event(self, event: dict, say, logger) -> None:
         user = event["user"]
@@ -52,6 +76,8 @@ class SlackAPIHandler:
             file = event['files'][0]
             filetype = file["filetype"]
             file_md5_name = self.download_file(file, user)
+            if file_md5_name is None:
+                return
             if filetype in self.voice_extension_allowed:
                 voicemessage = get_text_from_whisper(file_md5_name)
                 dialog_text = format_dialog_text(event["text"], voicemessage)
@@ -79,27 +105,81 @@ class SlackAPIHandler:
             print(e)
         
     def download_file(self, file: dict, user: str) -> Optional[str]:
-        url_private = file["url_private"]
+        """下载文件到 index_cache_dir，文件名为内容的 MD5。
+
+        边下载边写入临时文件并计算 MD5，内存中只保留一个分块；超过 max_file_size 时立即中止。
+        同一个 Slack 文件已经下载过、对应的缓存文件仍然存在时直接返回，不再下载。
+
+        Args:
+            file (dict): 事件中的文件信息。
+            user (str): 上传文件的用户ID。
+
+        Returns:
+            Optional[str]: 缓存文件的路径，文件过大或下载失败时为None。
+        """
+        filetype = file["filetype"]
+        cached = self.cached_file(file)
+        if cached is not None:
+            return cached
+        if file.get("size", 0) > self.max_file_size:
+            return None
+
         temp_file_path = index_cache_dir / user
         temp_file_path.mkdir(parents=True, exist_ok=True)
-        temp_file_filename = temp_file_path / file["name"]
-        # 执行下载
-        with open(temp_file_filename, "wb") as f:
-            response = requests.get(url_private, headers={"Authorization": "Bearer " + self.client.token})
-            f.write(response.content)
-        # 生成MD5名称
-        filetype = file["filetype"]
-        file_md5_name = self.generate_md5_name(temp_file_filename, filetype)
-        return file_md5_name
-
-    def generate_md5_name(self, temp_file_filename: Path, filetype: str) -> str:
-        temp_file_md5 = md5(temp_file_filename)
-        file_md5_name = index_cache_dir / (temp_file_md5 + '.' + filetype)
-        if not file_md5_name.exists():
-            temp_file_filename.rename(file_md5_name)
+        hash_md5 = hashlib.md5()
+        with tempfile.NamedTemporaryFile(dir=temp_file_path, suffix=".tmp", delete=False) as f:
+            temp_file_filename = Path(f.name)
+            try:
+                with self.session.get(file["url_private"], stream=True, timeout=30) as response:
+                    response.raise_for_status()
+                    size = 0
+                    for chunk in response.iter_content(chunk_size=self.download_chunk_size):
+                        size += len(chunk)
+                        if size > self.max_file_size:
+                            raise FileTooLargeError(f"文件超过 {self.max_file_size} 字节")
+                        hash_md5.update(chunk)
+                        f.write(chunk)
+            except (requests.RequestException, FileTooLargeError) as e:
+                logger.warning("download %s failed: %s", file.get("id"), e)
+                f.close()
+                temp_file_filename.unlink(missing_ok=True)
+                return None
+
+        # 相同内容的文件已经缓存过时丢弃临时文件
+        file_md5_name = index_cache_dir / (hash_md5.hexdigest() + "." + filetype)
+        if file_md5_name.exists():
+            temp_file_filename.unlink()
+        else:
+            os.replace(temp_file_filename, file_md5_name)
+        self.remember_file(file, file_md5_name)
         return str(file_md5_name)
 
+    def cached_file(self, file: dict) -> Optional[str]:
+        """返回该 Slack 文件已下载的缓存路径，没有下载过或缓存已被清理时为None。"""
+        if not file.get("id"):
+            return None
+        record = file_id_cache_dir / file["id"]
+        if not record.exists():
+            return None
+        file_md5_name = Path(record.read_text().strip())
+        return str(file_md5_name) if file_md5_name.exists() else None
+
+    def remember_file(self, file: dict, file_md5_name: Path) -> None:
+        """记录 Slack 文件对应的缓存路径，先写临时文件再替换，并发写入时不会读到半个路径。"""
+        if not file.get("id"):
+            return
+        with tempfile.NamedTemporaryFile("w", dir=file_id_cache_dir, suffix=".tmp", delete=False) as f:
+            f.write(str(file_md5_name))
+        os.replace(f.name, file_id_cache_dir / file["id"])
+
     def process_conversation(self, context: SlackContext, dialog_text: Optional[str], voicemessage: Optional[str] = None) -> None:
+        if voicemessage is None and self.stream_replies:
+            # 按需导入，未开启时不需要安装 langgraph
+            from agent.agent_api_v2 import astream_agent
+            # 会话按消息串区分：消息串中的回复带有根消息的 thread_ts，顶层消息用自身的 ts
+            thread_ts = context.event.get("thread_ts", context.event["ts"])
+            self.post_streaming_reply(context, astream_agent(context.user, dialog_text, thread_ts))
+            return
         gpt_response = self.chat_model.invoke(dialog_text).content
         if voicemessage is None:
             context.say(f'<@{context.user}>, {gpt_response}', thread_ts=context.thread_ts)
@@ -107,6 +187,48 @@ class SlackAPIHandler:
             voice_file_path = langchain_agent(context.user, f"语音重复下面内容 {gpt_response}")
             self.client.files_upload_v2(file=voice_file_path, channel=context.event["channel"], thread_ts=context.thread_ts)
     
+    def post_streaming_reply(
+        self, context: SlackContext, chunks: AsyncIterator[str], update_interval: float = 1.0
+    ) -> str:
+        """边生成边回复：先发出一条消息，之后随着文本到达不断更新这条消息。
+
+        chunks 可以是 agent_api_v2.astream_agent 的返回值。为避免触发 Slack 的频率限制，
+        两次更新之间至少间隔 update_interval 秒，结束时再更新一次完整的回答。
+        在工作线程中调用，异步生成器提交到 agent_api_v2 常驻的事件循环中消费，与模型客户端的连接池
+        使用同一个事件循环；Slack 接口调用放到线程中执行，不阻塞令牌的接收。
+
+        Args:
+            context (SlackContext): 消息上下文。
+            chunks (AsyncIterator[str]): 逐段生成的回答文本。
+            update_interval (float): 两次更新消息的最短间隔（秒）。
+
+        Returns:
+            str: 完整的回答。
+        """
+        from agent.agent_api_v2 import run_async
+
+        channel = context.event["channel"]
+        # 回复发在消息所在的消息串中
+        thread_ts = context.event.get("thread_ts", context.thread_ts)
+        prefix = f"<@{context.user}>, "
+
+        async def consume() -> str:
+            response = await asyncio.to_thread(
+                self.client.chat_postMessage, channel=channel, thread_ts=thread_ts, text=prefix + "..."
+            )
+            ts = response["ts"]
+            text, posted, last_update = "", "", time.monotonic()
+            async for chunk in chunks:
+                text += chunk
+                if time.monotonic() - last_update >= update_interval:
+                    await asyncio.to_thread(self.client.chat_update, channel=channel, ts=ts, text=prefix + text)
+                    posted, last_update = text, time.monotonic()
+            if text != posted:
+                await asyncio.to_thread(self.client.chat_update, channel=channel, ts=ts, text=prefix + text)
+            return text
+
+        return run_async(consume())
+
     def check_usage(self, context: SlackContext) -> bool:
         if not self.usage.exists(context.user):
             self.usage.add_user(context.user)